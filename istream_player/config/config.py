@@ -81,9 +81,15 @@ class PlayerConfig:
 
     ssl_keylog_file: Optional[str] = None
 
+    # Source IP address of the player connections, to give each player of a process its own network identity
+    local_addr: Optional[str] = None
+
     # Live event logs file path
     live_log: Optional[str] = None
 
+    # Name of the results file(s) in run_dir. If not set, data-N.json with the first unused N.
+    session_id: Optional[str] = None
+
     def validate(self) -> None:
         """Assert if config properties are set properly"""
         assert bool(self.input), "A non-empty '--input' arg or 'input' config is required"
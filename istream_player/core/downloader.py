@@ -5,6 +5,7 @@ from enum import Enum
 from typing import Dict, List, Optional, Tuple
 
 from istream_player.core.module import ModuleInterface
+from istream_player.utils.timing import TransferTiming
 
 
 class DownloadType(Enum):
@@ -20,8 +21,22 @@ class DownloadRequest:
     headers: Dict[str, str] = field(default_factory=dict)
 
 
+@dataclass
+class DownloadResponse:
+    # HTTP status code, 304 if a conditional request was not modified
+    status: int
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def header(self, name: str) -> Optional[str]:
+        """Value of a header, with a case insensitive name"""
+        name = name.lower()
+        return next((v for k, v in self.headers.items() if k.lower() == name), None)
+
+
 class DownloadEventListener(ABC):
-    async def on_bytes_transferred(self, length: int, url: str, position: int, size: int, content: bytes) -> None:
+    async def on_bytes_transferred(
+        self, length: int, url: str, position: int, size: int, content: bytes, timestamp_ns: Optional[int] = None
+    ) -> None:
         """
         Parameters
         ----------
@@ -33,7 +48,11 @@ class DownloadEventListener(ABC):
             The current position of the stream, in bytes
         size: int
             The size of the content: in bytes
-            :param content:
+        content: bytes
+            The bytes transferred since last call. Usually a view of the receive buffer, not a copy.
+        timestamp_ns: int, optional
+            Arrival of the bytes on the monotonic clock (istream_player.utils.timing.now_ns), stamped once
+            by the downloader. None if the downloader does not stamp the chunks.
 
         """
         pass
@@ -73,6 +92,9 @@ class DownloadEventListener(ABC):
 
 
 class DownloadManager(ModuleInterface, ABC):
+    # True if stop and drop_url end the transfer of one URL without affecting the others
+    per_url_cancel = False
+
     def __init__(self) -> None:
         self.listeners: List[DownloadEventListener] = []
 
@@ -135,7 +157,7 @@ class DownloadManager(ModuleInterface, ABC):
             self.listeners.append(listener)
 
     @abstractmethod
-    async def wait_complete(self, url: str) -> Tuple[bytes, int]:
+    async def wait_complete(self, url: str) -> Tuple[memoryview, int]:
         """
         Wait the stream to complete
 
@@ -148,9 +170,42 @@ class DownloadManager(ModuleInterface, ABC):
         -------
             The return value could be None, meaning that the stream got dropped.
             It could be a tuple, the bytes as the first element and size as the second element.
+            The bytes are a memoryview of the receive buffer, they are not copied.
         """
         pass
 
+    def get_response(self, url: str) -> Optional[DownloadResponse]:
+        """
+        Status and headers of the last MPD response for a URL.
+        Only kept for DownloadType.MPD requests, and available after wait_complete
+
+        Parameters
+        ----------
+        url:
+            The URL of the MPD
+
+        Returns
+        -------
+            None if the downloader does not keep the responses
+        """
+        return None
+
+    def get_timing(self, url: str) -> Optional[TransferTiming]:
+        """
+        Timestamps of the last transfer of a URL: request, headers, first and last byte, and the gaps between chunks.
+        Only the latest transfers are kept.
+
+        Parameters
+        ----------
+        url:
+            The URL of the transfer
+
+        Returns
+        -------
+            None if the downloader does not time the transfers
+        """
+        return None
+
     @abstractmethod
     def cancel_read_url(self, url: str):
         pass
@@ -19,7 +19,11 @@ from istream_player.modules.analyzer.playback import Playback
 from istream_player.modules.buffer.buffer_manager import BufferManagerImpl
 from istream_player.modules.bw_meter.bandwidth import BandwidthMeterImpl
 from istream_player.modules.bw_meter.bandwidth_bytes import BandwidthMeterBytes
+from istream_player.modules.bw_meter.bandwidth_cont import BandwidthMeterCont
+from istream_player.modules.downloader.emulated import EmulatedClient
 from istream_player.modules.downloader.local import LocalClient
+from istream_player.modules.downloader.http2 import H2ClientImpl
+from istream_player.modules.downloader.pooled import PooledTCPClientImpl
 from istream_player.modules.downloader.quic.client import QuicClientImpl
 from istream_player.modules.downloader.tcp import TCPClientImpl
 from istream_player.modules.mpd.mpd_provider_impl import MPDProviderImpl
@@ -70,7 +74,7 @@ class PlayerContext:
             self.log.debug(f"\t\t{mod_type} : {mods}")
         for mod_type, mods in self.modules.items():
             for mod_name, mod in mods.items():
-                deps = self.composer.get_deps(mod.__class__.__mod_requires__)
+                deps = self.composer.get_deps(mod.__class__.__mod_requires__, self.modules)
                 # print(f"Dependencies for {mod_name}")
                 # pprint(deps)
                 await mod.setup(self.config, *deps)
@@ -113,17 +117,19 @@ class PlayerComposer:
         self.module_init_fn = {}
         self.module_cli = defaultdict(lambda: ModuleCliConfig(help="[Module]", allow_multi=False, default="", required=False))
 
-    def get_deps(self, reqs: list[str | Type[ModuleInterface]]):
+    def get_deps(self, reqs: list[str | Type[ModuleInterface]], modules: Optional[Dict[str, Dict[str, Module]]] = None):
+        if modules is None:
+            modules = self.modules
         deps = []
         for req in reqs:
             dep = {}
             if isinstance(req, str):
-                for mods in self.modules.values():
+                for mods in modules.values():
                     for mod_name, mod in mods.items():
                         if mod_name == req:
                             dep[mod_name] = mod
             else:
-                for mods in self.modules.values():
+                for mods in modules.values():
                     for mod_name, mod in mods.items():
                         if issubclass(mod.__class__, req):
                             dep[mod_name] = mod
@@ -146,6 +152,7 @@ class PlayerComposer:
         parser.add_argument("-v", "--verbose", help="Enable debug level output", action="store_true", required=False)
         parser.add_argument("--time_factor", help="Mutiplication factor for time delayd. Use 0-1 for speedup.", type=float)
         parser.add_argument("--run_dir", '-d', help="Run directory", required=False)
+        parser.add_argument("--session_id", help="Name of the results file in the run directory", required=False)
         # pprint(self.module_cli)
         for mod_type, mods in self.module_options.items():
             cli_opt = self.module_cli[mod_type]
@@ -211,6 +218,8 @@ class PlayerComposer:
 
         list(map(self.log.debug, pformat(config).splitlines()))
 
+        # Each player gets its own module instances, so one composer can run several sessions
+        modules: Dict[str, Dict[str, Module]] = defaultdict(dict)
         for attr_name, val in config.__dict__.items():
             # All module config from player_config should start with "mod_"
             if not attr_name.startswith("mod_"):
@@ -218,15 +227,21 @@ class PlayerComposer:
             mod_type_name = attr_name[4:]
             if self.module_init_fn.get(mod_type_name) is None:
                 raise Exception(f"Module init function not provided for module {mod_type_name}")
-            self.modules[mod_type_name].update(self.module_init_fn[mod_type_name](mod_type_name, val, self))
-        return PlayerContext(config, self.modules, self)
+            modules[mod_type_name].update(self.module_init_fn[mod_type_name](mod_type_name, val, self))
+        self.modules = modules
+        return PlayerContext(config, modules, self)
 
     def register_core_modules(self):
         self.register_module("mpd", [MPDProviderImpl], single_initializer, "MPD Provider", False, "mpd")
         self.register_module(
-            "downloader", [LocalClient, TCPClientImpl, QuicClientImpl], downloader_initializer, "Downloader", False, "local"
+            "downloader",
+            [LocalClient, TCPClientImpl, PooledTCPClientImpl, H2ClientImpl, QuicClientImpl, EmulatedClient],
+            downloader_initializer,
+            "Downloader",
+            False,
+            "local",
         )
-        self.register_module("bw", [BandwidthMeterImpl, BandwidthMeterBytes], single_initializer, "Bandwidth Estimation", False, "bw_meter")
+        self.register_module("bw", [BandwidthMeterImpl, BandwidthMeterBytes, BandwidthMeterCont], single_initializer, "Bandwidth Estimation", False, "bw_meter")
         self.register_module(
             "abr",
             [DashABRController, BufferABRController, BandwidthABRController, HybridABRController],
@@ -3,10 +3,31 @@ from typing import Optional
 
 from istream_player.core.module import ModuleInterface
 from istream_player.models import MPD
-from istream_player.models.mpd_objects import Segment
+from istream_player.models.mpd_objects import AdaptationSet, Segment
+
+
+class MPDEventListener(ABC):
+    async def on_adaptation_set_parsed(self, adaptation_set: AdaptationSet):
+        """
+        Callback when an adaptation set is parsed, before the rest of the MPD has been received.
+        Only called during the first download of the MPD, by providers parsing it while it downloads.
+
+        Parameters
+        ----------
+        adaptation_set: AdaptationSet
+            The parsed adaptation set
+        """
+        pass
 
 
 class MPDProvider(ModuleInterface, ABC):
+    def __init__(self) -> None:
+        self.listeners: list[MPDEventListener] = []
+
+    def add_listener(self, listener: MPDEventListener):
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
     @property
     @abstractmethod
     def mpd(self) -> Optional[MPD]:
@@ -33,6 +54,18 @@ class MPDProvider(ModuleInterface, ABC):
             MPD: Latest MPD Object
         """
 
+    @abstractmethod
+    async def wait_for_segment(self, index: int) -> MPD:
+        """Wait till a dynamic MPD has been updated up to the segment index, or has become static.
+        The MPD is refreshed in the background while waiting.
+
+        Args:
+            index (int): Segment number to wait for
+
+        Returns:
+            MPD: Latest MPD Object
+        """
+
     @abstractmethod
     def segment_by_url(self, url: str) -> Optional[Segment]:
         """Return Segment by URL if found.
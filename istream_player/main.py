@@ -8,6 +8,7 @@ import yaml
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.module_composer import PlayerComposer
+from istream_player.modules.downloader.pooled import close_connection_pools
 
 
 def load_from_dict(d: Dict, config: PlayerConfig):
@@ -40,6 +41,13 @@ def load_from_config_file(config_path: str, config: PlayerConfig):
         raise Exception(f"Config file format not supported. Use JSON or YAML. Used : {config_path}")
 
 
+async def run_player(composer: PlayerComposer, config: PlayerConfig):
+    try:
+        await composer.run(config)
+    finally:
+        await close_connection_pools()
+
+
 def main():
     try:
         assert sys.version_info.major >= 3 and sys.version_info.minor >= 3
@@ -71,7 +79,7 @@ def main():
 
     config.validate()
 
-    asyncio.run(composer.run(config))
+    asyncio.run(run_player(composer, config))
 
 
 if __name__ == "__main__":
@@ -1,5 +1,11 @@
+import re
+from abc import abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
-from typing import Dict, Literal, Optional, Union
+from types import MappingProxyType
+from typing import (Dict, Iterable, Iterator, List, Literal, Mapping,
+                    Optional, Tuple, Union)
 
 
 class MPD(object):
@@ -12,7 +18,8 @@ class MPD(object):
         max_segment_duration: float,
         min_buffer_time: float,
         adaptation_sets: Dict[int, "AdaptationSet"],
-        attrib: Dict[str, str]
+        attrib: Dict[str, str],
+        minimum_update_period: float = 0,
     ):
         self.content = content
         """
@@ -44,16 +51,75 @@ class MPD(object):
         The maximum segment duration in seconds
         """
 
+        self.minimum_update_period = minimum_update_period
+        """
+        The minimum time in seconds between refreshes of a dynamic MPD, 0 if not set
+        """
+
         self.adaptation_sets: Dict[int, AdaptationSet] = adaptation_sets
         """
         All the adaptation sets
         """
 
+        self.first_segment, self.last_segment = merge_segment_ranges(
+            (adaptation_set.first_segment, adaptation_set.last_segment) for adaptation_set in adaptation_sets.values()
+        )
+        """
+        The first and last segment numbers available in any adaptation set. last_segment < first_segment if there are none
+        """
+
+        self.version = 0
+        """
+        Incremented every time an update is merged into this MPD
+        """
+
         self.attrib = attrib
         """
         All attributes from XML
         """
 
+    def merge(self, other: "MPD") -> bool:
+        """
+        Merge the new segments of an updated version of this MPD in place.
+
+        Parameters
+        ----------
+        other: MPD
+            The updated MPD, parsed from the same URL
+
+        Returns
+        -------
+        merged: bool
+            False if the adaptation sets, representations or segment templates changed. Nothing is merged then.
+        """
+        if self.adaptation_sets.keys() != other.adaptation_sets.keys():
+            return False
+        pairs = []
+        for as_id, adaptation_set in self.adaptation_sets.items():
+            representations = other.adaptation_sets[as_id].representations
+            if adaptation_set.representations.keys() != representations.keys():
+                return False
+            for repr_id, representation in adaptation_set.representations.items():
+                segments, new_segments = representation.segments, representations[repr_id].segments
+                if not isinstance(segments, SegmentSequence) or not segments.can_merge(new_segments):
+                    return False
+                pairs.append((segments, new_segments))
+
+        for segments, new_segments in pairs:
+            segments.merge(new_segments)
+        for adaptation_set in self.adaptation_sets.values():
+            adaptation_set.update_segment_range()
+        self.first_segment, self.last_segment = merge_segment_ranges(
+            (adaptation_set.first_segment, adaptation_set.last_segment) for adaptation_set in self.adaptation_sets.values()
+        )
+        self.content = other.content
+        self.type = other.type
+        self.media_presentation_duration = other.media_presentation_duration
+        self.minimum_update_period = other.minimum_update_period
+        self.attrib = other.attrib
+        self.version += 1
+        return True
+
 
 class AdaptationSet(object):
     def __init__(
@@ -118,11 +184,91 @@ class AdaptationSet(object):
         All the representations under the adaptation set
         """
 
+        self.ladder = BitrateLadder(representations.values())
+        """
+        The representations sorted by bandwidth, for the ABR decisions
+        """
+
+        self.first_segment, self.last_segment = merge_segment_ranges(
+            segment_range(representation.segments) for representation in representations.values()
+        )
+        """
+        The first and last segment numbers available in any representation. last_segment < first_segment if there are none
+        """
+
         self.attrib = attrib
         """
         All attributes from XML
         """
 
+    def update_segment_range(self):
+        """Recompute first_segment and last_segment after the segments of the representations changed"""
+        self.first_segment, self.last_segment = merge_segment_ranges(
+            segment_range(representation.segments) for representation in self.representations.values()
+        )
+
+
+class BitrateLadder(object):
+    """
+    Immutable index of the representations of one adaptation set, sorted by bandwidth (lowest first).
+    It is built once when the adaptation set is parsed, so ABR decisions only need a bisect.
+    """
+
+    __slots__ = ("ids", "bandwidths", "ranks")
+
+    def __init__(self, representations: Iterable["Representation"]):
+        ordered = sorted(representations, key=lambda r: r.bandwidth)
+
+        self.ids: Tuple[int, ...] = tuple(r.id for r in ordered)
+        """
+        The representation ids, from the lowest to the highest bandwidth
+        """
+
+        self.bandwidths: Tuple[int, ...] = tuple(r.bandwidth for r in ordered)
+        """
+        The bandwidths in bps, in the same order as ids
+        """
+
+        self.ranks: Mapping[int, int] = MappingProxyType({id_: rank for rank, id_ in enumerate(self.ids)})
+        """
+        The position of each representation id in the ladder
+        """
+
+    def __getstate__(self):
+        # The ranks are a read-only view, which cannot be pickled
+        return self.ids, self.bandwidths
+
+    def __setstate__(self, state):
+        self.ids, self.bandwidths = state
+        self.ranks = MappingProxyType({id_: rank for rank, id_ in enumerate(self.ids)})
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def lowest_id(self) -> int:
+        return self.ids[0]
+
+    @property
+    def highest_id(self) -> int:
+        return self.ids[-1]
+
+    def highest_below(self, bw: float) -> int:
+        """
+        Return the id of the highest representation whose bandwidth is lower than bw,
+        or the lowest representation if there is none
+        """
+        return self.ids[max(bisect_left(self.bandwidths, bw) - 1, 0)]
+
+    def id_of_bandwidth(self, bandwidth: int) -> Optional[int]:
+        """
+        Return the id of the representation with exactly this bandwidth, None if there is none
+        """
+        rank = bisect_right(self.bandwidths, bandwidth) - 1
+        if rank >= 0 and self.bandwidths[rank] == bandwidth:
+            return self.ids[rank]
+        return None
+
 
 class Representation(object):
     def __init__(
@@ -134,7 +280,7 @@ class Representation(object):
         width_or_x: Union[int, float],
         height_or_y: Union[int, float],
         initialization: str,
-        segments: Dict[int, "Segment"],
+        segments: Mapping[int, "Segment"],
         attrib: Dict[str, str],
         z_pos: float = 0,
         x_rot: float = 0,
@@ -192,9 +338,9 @@ class Representation(object):
         The initialization URL
         """
 
-        self.segments: Dict[int, Segment] = segments
+        self.segments: Mapping[int, Segment] = segments
         """
-        The video segments
+        The video segments, by segment number. Usually a SegmentSequence computing them on demand.
         """
 
         self.attrib = attrib
@@ -221,4 +367,253 @@ class Segment(object):
     as_id: int
 
     # Representation ID
-    repr_id: int
\ No newline at end of file
+    repr_id: int
+
+
+class SegmentUrlTemplate(object):
+    """
+    Media URL template of one representation, with a single $Number$ (or $Number%05d$) variable.
+    URLs are formatted from a segment number, and parsed back to it.
+    """
+
+    __slots__ = ("prefix", "suffix", "number_format")
+
+    def __init__(self, template: str):
+        match = re.search(r"\$Number(%[^$]*)?\$", template)
+        if match is None:
+            raise ValueError(f"No $Number$ variable in segment template {template}")
+        self.prefix = template[: match.start()]
+        self.suffix = template[match.end():]
+        self.number_format = match.group(1) or "%d"
+        if "$" in self.prefix or "$" in self.suffix:
+            raise ValueError(f"Cannot replace variables other than $Number$ in {template}")
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SegmentUrlTemplate) and (self.prefix, self.suffix, self.number_format) == (
+            other.prefix,
+            other.suffix,
+            other.number_format,
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.prefix, self.suffix, self.number_format))
+
+    def format(self, number: int) -> str:
+        return self.prefix + (self.number_format % number) + self.suffix
+
+    def parse(self, url: str) -> Optional[int]:
+        """Return the segment number of a URL, None if the URL does not match the template"""
+        if len(url) <= len(self.prefix) + len(self.suffix) or not url.startswith(self.prefix) or not url.endswith(self.suffix):
+            return None
+        digits = url[len(self.prefix): len(url) - len(self.suffix)]
+        return int(digits) if digits.isdigit() else None
+
+
+class SegmentSequence(Mapping[int, Segment]):
+    """
+    Read-only mapping from segment number to Segment, computing each Segment on demand from the template.
+    Segment numbers are contiguous, from first to last.
+    """
+
+    def __init__(self, url_template: SegmentUrlTemplate, init_url: str, as_id: int, repr_id: int):
+        self.url_template = url_template
+        self.init_url = init_url
+        self.as_id = as_id
+        self.repr_id = repr_id
+
+    @property
+    @abstractmethod
+    def first(self) -> int:
+        """Number of the first segment"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def _timing(self, number: int) -> Tuple[float, float]:
+        """Start time and duration of a segment which is known to be in the sequence"""
+
+    @property
+    def last(self) -> int:
+        """Number of the last segment"""
+        return self.first + len(self) - 1
+
+    def __contains__(self, number) -> bool:
+        return isinstance(number, int) and self.first <= number <= self.last
+
+    def __getitem__(self, number: int) -> Segment:
+        if number not in self:
+            raise KeyError(number)
+        start_time, duration = self._timing(number)
+        return Segment(self.url_template.format(number), self.init_url, duration, start_time, self.as_id, self.repr_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.first, self.first + len(self)))
+
+    def segment_by_url(self, url: str) -> Optional[Segment]:
+        """Return the segment of this sequence with the given URL, None if there is none"""
+        number = self.url_template.parse(url)
+        if number is None or number not in self:
+            return None
+        return self[number]
+
+    def can_merge(self, other: Mapping[int, Segment]) -> bool:
+        """True if other is an update of this sequence, with the same template"""
+        return (
+            type(other) is type(self)
+            and isinstance(other, SegmentSequence)
+            and other.url_template == self.url_template
+            and other.init_url == self.init_url
+        )
+
+    @abstractmethod
+    def merge(self, other: "SegmentSequence"):
+        """Add the segments of an updated sequence which are after the last one of this sequence"""
+
+
+class TemplateSegments(SegmentSequence):
+    """Segments of a SegmentTemplate with a fixed duration"""
+
+    def __init__(
+        self,
+        url_template: SegmentUrlTemplate,
+        init_url: str,
+        as_id: int,
+        repr_id: int,
+        start_number: int,
+        count: int,
+        duration: float,
+    ):
+        super().__init__(url_template, init_url, as_id, repr_id)
+        self.start_number = start_number
+        self.count = count
+        self.duration = duration
+
+    @property
+    def first(self) -> int:
+        return self.start_number
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _timing(self, number: int) -> Tuple[float, float]:
+        return (number - self.start_number) * self.duration, self.duration
+
+    def can_merge(self, other: Mapping[int, Segment]) -> bool:
+        return (
+            super().can_merge(other)
+            and isinstance(other, TemplateSegments)
+            and (other.start_number, other.duration) == (self.start_number, self.duration)
+        )
+
+    def merge(self, other: "SegmentSequence"):
+        self.count = max(self.count, len(other))
+
+
+class TimelineSegments(SegmentSequence):
+    """
+    Segments of a SegmentTimeline. Each S element is kept as one run of segments with the same duration,
+    in arrays, so a segment is found with a bisect over the runs.
+    """
+
+    def __init__(self, url_template: SegmentUrlTemplate, init_url: str, as_id: int, repr_id: int, start_number: int):
+        super().__init__(url_template, init_url, as_id, repr_id)
+        self.start_number = start_number
+        self.count = 0
+        # First segment number, start time, duration and number of segments of each run
+        self.run_numbers = array("q")
+        self.run_starts = array("d")
+        self.run_durations = array("d")
+        self.run_counts = array("q")
+
+    def add_run(self, start_time: Optional[float], duration: float, count: int):
+        """
+        Append count segments of the same duration.
+        If start_time is None, the run starts where the previous one ended.
+        """
+        end = self.run_starts[-1] + self.run_durations[-1] * self.run_counts[-1] if self.count > 0 else 0
+        if start_time is None:
+            start_time = end
+        if self.count > 0 and duration == self.run_durations[-1] and abs(start_time - end) < 1e-6:
+            # Contiguous with the same duration: the last run is extended, the arrays only grow with new durations
+            self.run_counts[-1] += count
+            self.count += count
+            return
+        self.run_numbers.append(self.start_number + self.count)
+        self.run_starts.append(start_time)
+        self.run_durations.append(duration)
+        self.run_counts.append(count)
+        self.count += count
+
+    @property
+    def first(self) -> int:
+        return self.start_number
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _timing(self, number: int) -> Tuple[float, float]:
+        run = bisect_right(self.run_numbers, number) - 1
+        duration = self.run_durations[run]
+        return self.run_starts[run] + (number - self.run_numbers[run]) * duration, duration
+
+    def merge(self, other: "SegmentSequence"):
+        """
+        Add the S entries after the last known segment, and drop the segments before the first one of the update,
+        which left the time shift buffer
+        """
+        assert isinstance(other, TimelineSegments)
+        if len(other) == 0:
+            return
+        if len(self) == 0 or other.first > self.last + 1:
+            # No overlap: segment numbers stay contiguous by taking the new timeline as is
+            self.start_number = other.start_number
+            self.count = other.count
+            self.run_numbers, self.run_starts = array("q", other.run_numbers), array("d", other.run_starts)
+            self.run_durations, self.run_counts = array("d", other.run_durations), array("q", other.run_counts)
+            return
+        if other.last > self.last:
+            # Starting with the S entry containing the next segment
+            number = self.last + 1
+            run = bisect_right(other.run_numbers, number) - 1
+            skip = number - other.run_numbers[run]
+            duration = other.run_durations[run]
+            self.add_run(other.run_starts[run] + skip * duration, duration, other.run_counts[run] - skip)
+            for run in range(run + 1, len(other.run_numbers)):
+                self.add_run(other.run_starts[run], other.run_durations[run], other.run_counts[run])
+        self.drop_before(other.first)
+
+    def drop_before(self, number: int):
+        """Remove the segments before number, which must not be after the last segment"""
+        if number <= self.start_number:
+            return
+        run = bisect_right(self.run_numbers, number) - 1
+        skip = number - self.run_numbers[run]
+        del self.run_numbers[:run], self.run_starts[:run], self.run_durations[:run], self.run_counts[:run]
+        self.run_numbers[0] = number
+        self.run_starts[0] += skip * self.run_durations[0]
+        self.run_counts[0] -= skip
+        self.count -= number - self.start_number
+        self.start_number = number
+
+    def durations(self) -> List[float]:
+        """Distinct segment durations"""
+        return sorted(set(self.run_durations))
+
+
+def segment_range(segments: Mapping[int, Segment]) -> Tuple[int, int]:
+    """First and last segment numbers of a representation, (0, -1) if it has no segments"""
+    if isinstance(segments, SegmentSequence):
+        return (segments.first, segments.last) if len(segments) > 0 else (0, -1)
+    if len(segments) == 0:
+        return 0, -1
+    return min(segments.keys()), max(segments.keys())
+
+
+def merge_segment_ranges(ranges: Iterable[Tuple[int, int]]) -> Tuple[int, int]:
+    """Smallest range containing all the non-empty ranges, (0, -1) if they are all empty"""
+    non_empty = [(first, last) for first, last in ranges if first <= last]
+    if len(non_empty) == 0:
+        return 0, -1
+    return min(first for first, _ in non_empty), max(last for _, last in non_empty)
@@ -45,8 +45,7 @@ class BufferABRController(Module, ABRController):
         """
         next_bitrate = None
 
-        bitrates = [representation.bandwidth for representation in adaptation_set.representations.values()]
-        bitrates.sort()
+        bitrates = adaptation_set.ladder.bandwidths
 
         # Calculate the current buffer occupancy percentage
         current_buffer_occupancy = self.buffer_manager.buffer_level
@@ -66,12 +65,7 @@ class BufferABRController(Module, ABRController):
                     break
                 next_bitrate = self.rate_map[marker]
 
-        representation_id = None
-        for representation in adaptation_set.representations.values():
-            if representation.bandwidth == next_bitrate:
-                representation_id = representation.id
-
-        return representation_id
+        return adaptation_set.ladder.id_of_bandwidth(next_bitrate)
 
     def get_rate_map(self, bitrates):
         """
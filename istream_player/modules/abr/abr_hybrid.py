@@ -95,9 +95,5 @@ class HybridABRController(Module, ABRController):
         id: int
             The representation id
         """
-        representations = sorted(adaptation_set.representations.values(), key=lambda x: x.bandwidth, reverse=True)
-        for representation in representations:
-            if representation.bandwidth < bw:
-                return representation.id
         # If there's no representation whose bitrate is lower than the estimate, return the lowest one
-        return representations[-1].id
+        return adaptation_set.ladder.highest_below(bw)
@@ -1,5 +1,4 @@
 from dataclasses import asdict, dataclass
-import datetime
 import io
 import json
 import logging
@@ -12,6 +11,7 @@ from typing import Any, Dict, List, Optional, TextIO, Tuple
 from matplotlib.patches import Rectangle
 
 import matplotlib.pyplot as plt
+import numpy as np
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.analyzer import Analyzer
@@ -23,6 +23,8 @@ from istream_player.core.player import Player, PlayerEventListener
 from istream_player.core.scheduler import Scheduler, SchedulerEventListener
 from istream_player.models import State
 from istream_player.models.mpd_objects import Segment
+from istream_player.modules.analyzer.metrics_store import MetricsStore, load_metrics
+from istream_player.utils.timing import wall_time
 
 
 @dataclass
@@ -61,6 +63,25 @@ class AnalyzerSegment:
             return None
 
 
+SEGMENT_COLUMNS = {
+    "index": "i8",
+    "url": "U",
+    "repr_id": "i8",
+    "adap_set_id": "i8",
+    "bitrate": "i8",
+    "start_time": "f8",
+    "stop_time": "f8",
+    "first_byte_at": "f8",
+    "last_byte_at": "f8",
+    "quality": "i8",
+    "segment_throughput": "f8",
+    "adaptation_throughput": "f8",
+    "total_bytes": "f8",
+    "received_bytes": "f8",
+    "stopped_bytes": "f8",
+}
+
+
 @dataclass
 class BufferLevel:
     time: float
@@ -79,8 +100,24 @@ class PlaybackAnalyzer(
 ):
     log = logging.getLogger("PlaybackAnalyzer")
 
-    def __init__(self, *, plots_dir: Optional[str] = None):
-        self._start_time = datetime.datetime.now().timestamp()
+    def __init__(self, *, plots_dir: Optional[str] = None, store: str = "json", flush_interval: str = "5"):
+        """
+        Parameters
+        ----------
+        plots_dir: str, optional
+            Save the plots in this directory
+        store: str
+            "json" keeps everything in memory and dumps it at the end.
+            "columnar" streams the samples and the completed segments to a MetricsStore under run_dir,
+            and only dumps a summary at the end.
+        flush_interval: str
+            Seconds between two flushes of the columnar store
+        """
+        assert store in ("json", "columnar"), f"Unknown data_collector store : {store}"
+        self.store = store
+        self.flush_interval = float(flush_interval)
+        self._store: Optional[MetricsStore] = None
+        self._start_time = wall_time()
         self._buffer_levels: List[BufferLevel] = []
         self._throughputs: List[Tuple[float, int]] = []
         self._cont_bw: List[Tuple[float, int]] = []
@@ -108,6 +145,19 @@ class PlaybackAnalyzer(
         self.bandwidth_meter = bandwidth_meter
         self._mpd_provider = mpd_provider
         self.dump_results_path = join(config.run_dir, "data") if config.run_dir else None
+        if config.session_id is not None:
+            assert config.run_dir, "--run_dir is required with --session_id"
+            self.dump_results_path = join(config.run_dir, config.session_id) + ".json"
+
+        if self.store == "columnar":
+            assert config.run_dir, "--run_dir is required by the columnar store"
+            session_path = join(config.run_dir, config.session_id or f"data-{int(self._start_time)}-{os.getpid()}")
+            self.dump_results_path = session_path + ".json"
+            self._store = MetricsStore(session_path + ".metrics", flush_interval=self.flush_interval)
+            self._store.add_table("buffer_level", {"time": "f8", "level": "f8"})
+            self._store.add_table("bandwidth", {"time": "f8", "bandwidth": "f8"})
+            self._store.add_table("states", {"time": "f8", "state": "U", "position": "f8"})
+            self._store.add_table("segments", SEGMENT_COLUMNS)
 
         # segment_downloader.add_listener(self)
         bandwidth_meter.add_listener(self)
@@ -137,16 +187,26 @@ class PlaybackAnalyzer(
         The seconds sice given start_time
 
         """
-        return datetime.datetime.now().timestamp() - start_time
+        return wall_time() - start_time
 
     async def on_position_change(self, position):
         self._position = position
 
     async def on_state_change(self, position: float, old_state: State, new_state: State):
-        self._states.append((self._seconds_since(self._start_time), new_state, position))
+        self._record_state(position, new_state)
+
+    def _record_state(self, position: float, state: State):
+        time = self._seconds_since(self._start_time)
+        # States are few, they are kept in memory in both modes to compute the stalls
+        self._states.append((time, state, position))
+        if self._store is not None:
+            self._store.append("states", time, str(state), position)
 
     async def on_buffer_level_change(self, buffer_level):
-        self._buffer_levels.append(BufferLevel(self._seconds_since(self._start_time), buffer_level))
+        if self._store is not None:
+            self._store.append("buffer_level", self._seconds_since(self._start_time), buffer_level)
+        else:
+            self._buffer_levels.append(BufferLevel(self._seconds_since(self._start_time), buffer_level))
 
     async def on_segment_download_start(self, index, adap_bw: Dict[int, float], segments: Dict[int, Segment]):
         assert self._mpd_provider.mpd is not None
@@ -181,23 +241,33 @@ class PlaybackAnalyzer(
 
             analyzer_segment.segment_throughput = (stat.received_bytes * 8) / (stat.stop_time - stat.start_time)
 
+            if self._store is not None:
+                self._store_segment(self._segments_by_url.pop(segment.url))
+
+    def _store_segment(self, segment: AnalyzerSegment):
+        assert self._store is not None
+        self._store.append("segments", *(getattr(segment, col) for col in SEGMENT_COLUMNS))
+
     async def on_bandwidth_update(self, bw: int) -> None:
-        self._throughputs.append((self._seconds_since(self._start_time), bw))
+        if self._store is not None:
+            self._store.append("bandwidth", self._seconds_since(self._start_time), bw)
+        else:
+            self._throughputs.append((self._seconds_since(self._start_time), bw))
 
     def save(self, output: io.TextIOBase | TextIO) -> None:
         if self._mpd_provider.mpd is None:
             self.log.error("MPD not found. Aborting analysis")
             return
+        if self._store is not None:
+            self.save_columnar(output)
+            return
         bitrates = []
 
         last_quality = None
         quality_switches = 0
 
-        total_stall_duration = 0
-        total_stall_num = 0
-
         if len(self._states) > 0 and self._states[-1][1] != State.END:
-            self._states.append((self._seconds_since(self._start_time), State.END, self._position))
+            self._record_state(self._position, State.END)
 
         headers = ("Index", "Start", "End", "Quality", "Bitrate", "Adap-Th", "Seg-Th", "Ratio", "URL")
         output.write("%-10s%-10s%-10s%-10s%-10s%-10s%-10s%-10s%-20s\n" % headers)
@@ -225,27 +295,7 @@ class PlaybackAnalyzer(
             )
         output.write("\n")
 
-        # Stalls
-        output.write("Stalls:\n")
-        output.write("%-6s%-6s%-6s\n" % ("Start", "End", "Duration"))
-        buffering_start = None
-        self._stalls = []
-        for time, state, position in self._states:
-            if state == State.BUFFERING and buffering_start is None:
-                buffering_start = time
-
-            elif state == State.READY and buffering_start is not None:
-                duration = time - buffering_start
-                output.write("%-6.2f%-6.2f%-6.2f\n" % (buffering_start, time, duration))
-                self._stalls.append(Stall(buffering_start, time))
-                total_stall_num += 1
-                total_stall_duration += duration
-                buffering_start = None
-
-        output.write("\n")
-        # Stall summary
-        output.write(f"Number of Stalls: {total_stall_num}\n")
-        output.write(f"Total seconds of stalls: {total_stall_duration}\n")
+        total_stall_num, total_stall_duration = self.write_stalls(output)
 
         # Average bitrate
         average_bitrate = sum(bitrates) / len(bitrates) if len(bitrates) > 0 else 0
@@ -255,7 +305,12 @@ class PlaybackAnalyzer(
         output.write(f"Number of quality switches: {quality_switches}\n")
 
         if self.plots_dir is not None:
-            self.save_plots()
+            self.save_plots(
+                [i.time for i in self._buffer_levels],
+                [i.level for i in self._buffer_levels],
+                [i[0] for i in self._throughputs],
+                [i[1] for i in self._throughputs],
+            )
 
         self.dump_results(
             self._segments_by_url,
@@ -294,8 +349,84 @@ class PlaybackAnalyzer(
         else:
             json.dump(data["segments"], sys.stdout, indent=4)
 
+    def write_stalls(self, output: io.TextIOBase | TextIO) -> Tuple[int, float]:
+        """Find the stalls from the state changes, write them and return their number and total duration"""
+        total_stall_num = 0
+        total_stall_duration = 0
+
+        output.write("Stalls:\n")
+        output.write("%-6s%-6s%-6s\n" % ("Start", "End", "Duration"))
+        buffering_start = None
+        self._stalls = []
+        for time, state, position in self._states:
+            if state == State.BUFFERING and buffering_start is None:
+                buffering_start = time
+
+            elif state == State.READY and buffering_start is not None:
+                duration = time - buffering_start
+                output.write("%-6.2f%-6.2f%-6.2f\n" % (buffering_start, time, duration))
+                self._stalls.append(Stall(buffering_start, time))
+                total_stall_num += 1
+                total_stall_duration += duration
+                buffering_start = None
+
+        output.write("\n")
+        # Stall summary
+        output.write(f"Number of Stalls: {total_stall_num}\n")
+        output.write(f"Total seconds of stalls: {total_stall_duration}\n")
+        return total_stall_num, total_stall_duration
+
+    def save_columnar(self, output: io.TextIOBase | TextIO) -> None:
+        """Flush the columnar store and dump a summary of the session computed from it"""
+        assert self._store is not None
+        if len(self._states) > 0 and self._states[-1][1] != State.END:
+            self._record_state(self._position, State.END)
+        # Segments which never completed
+        for segment in self._segments_by_url.values():
+            self._store_segment(segment)
+        self._segments_by_url.clear()
+        self._store.flush()
+
+        tables = load_metrics(self._store.directory, ["segments", "buffer_level", "bandwidth"])
+        segments = tables["segments"]
+        qualities = segments["quality"][np.argsort(segments["index"], kind="stable")]
+        quality_switches = int(np.count_nonzero(np.diff(qualities)))
+        output.write(f"Segments: {len(qualities)}, metrics saved in {self._store.directory}\n")
+
+        total_stall_num, total_stall_duration = self.write_stalls(output)
+        output.write(f"Number of quality switches: {quality_switches}\n")
+
+        if self.plots_dir is not None:
+            self.save_plots(
+                tables["buffer_level"]["time"].tolist(),
+                tables["buffer_level"]["level"].tolist(),
+                tables["bandwidth"]["time"].tolist(),
+                tables["bandwidth"]["bandwidth"].tolist(),
+            )
+
+        data = {
+            "metrics": self._store.directory,
+            "num_segments": len(qualities),
+            "stalls": list(map(asdict, self._stalls)),
+            "num_stall": total_stall_num,
+            "dur_stall": total_stall_duration,
+            # Same as the json store, which never collects bitrates
+            "avg_bitrate": 0,
+            "num_quality_switches": quality_switches,
+            "states": [{"time": time, "state": str(state), "position": pos} for time, state, pos in self._states],
+        }
+        assert self.dump_results_path is not None
+        PlaybackAnalyzer.save_file(self.dump_results_path, data)
+
     @staticmethod
     def save_file(path: str, data: dict[str, Any]):
+        if path.endswith(".json"):
+            # Explicit session file name
+            print(f"Writing results in file {path}")
+            with open(path, "w") as f:
+                f.write(json.dumps(data))
+            return
+
         extra_index = 1
         final_path = f"{path}-{extra_index}.json"
         while os.path.exists(final_path):
@@ -306,10 +437,12 @@ class PlaybackAnalyzer(
         with open(final_path, "w") as f:
             f.write(json.dumps(data))
 
-    def save_plots(self):
+    def save_plots(
+        self, buffer_times: List[float], buffer_levels: List[float], bw_times: List[float], bws: List[float]
+    ):
         def plot_bws(ax: plt.Axes):
-            xs = [i[0] for i in self._throughputs]
-            ys = [i[1] / 1000 for i in self._throughputs]
+            xs = bw_times
+            ys = [bw / 1000 for bw in bws]
             lines1 = ax.plot(xs, ys, color="red", label="Throughput")
             ax.set_xlim(0)
             ax.set_ylim(0)
@@ -318,8 +451,8 @@ class PlaybackAnalyzer(
             return (*lines1,)
 
         def plot_bufs(ax: plt.Axes):
-            xs = [i.time for i in self._buffer_levels]
-            ys = [i.level for i in self._buffer_levels]
+            xs = buffer_times
+            ys = buffer_levels
             line1 = ax.step(xs, ys, color="blue", label="Buffer", where="post")
             y_top = max(ys)
             y_bottom = min(ys)
@@ -339,8 +472,10 @@ class PlaybackAnalyzer(
             return (*line1,)
 
         fig, ax1 = plt.subplots()
-        # ax2: plt.Axes = ax1.twinx()
         lines = plot_bufs(ax1)
+        if len(bws) > 0:
+            ax2: plt.Axes = ax1.twinx()
+            lines += plot_bws(ax2)
         labels = [line.get_label() for line in lines]
         fig.legend(lines, labels)
         if self.plots_dir is not None:
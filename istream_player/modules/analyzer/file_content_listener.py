@@ -1,46 +1,175 @@
+import asyncio
+import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join
-from typing import BinaryIO
+from typing import BinaryIO, Dict, Iterator, List, Optional, TextIO
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.analyzer import Analyzer
 from istream_player.core.downloader import (DownloadEventListener,
                                             DownloadManager)
 from istream_player.core.module import Module, ModuleOption
-from istream_player.core.player import PlayerEventListener
-from istream_player.models import State
+
+CONTAINER_FILE = "segments.bin"
+CONTAINER_INDEX_FILE = "segments.index.jsonl"
 
 
 @ModuleOption("file_saver", requires=[DownloadManager])
-class FileContentListener(Module, Analyzer, DownloadEventListener, PlayerEventListener):
-    files: dict[str, BinaryIO]
+class FileContentListener(Module, Analyzer, DownloadEventListener):
+    """
+    Save the downloaded content under <run_dir>/downloaded.
+
+    All the disk writes run in order on a single writer thread. At most max_pending writes are queued,
+    after that the downloader waits, so memory stays bounded when the disk is slower than the network.
+    Each file is closed as soon as its transfer ends.
+
+    With container=true, all the transfers of the session are appended to one file (segments.bin) instead,
+    and segments.index.jsonl records the extents of every URL in it. Use SegmentContainer to read it back.
+    """
+
     log = logging.getLogger("FileContentListener")
 
-    def __init__(self):
-        self.files = {}
+    def __init__(self, *, container: str = "false", max_pending: str = "64"):
+        super().__init__()
+        self.container = container.lower() == "true"
+        self.max_pending = int(max_pending)
+
+        # Only used from the writer thread
+        self.files: Dict[str, BinaryIO] = {}
+        self.extents: Dict[str, List[List[int]]] = {}
+        self._container: Optional[BinaryIO] = None
+        self._index: Optional[TextIO] = None
+        self._offset = 0
+        self._last_url: Optional[str] = None
+
+        self._executor: Optional[ThreadPoolExecutor] = None
 
     async def setup(self, config: PlayerConfig, downloaders: list[DownloadManager], **kwargs):
         assert config.run_dir, "--run-dir is required by file_saver module"
 
+        if isinstance(downloaders, DownloadManager):
+            downloaders = [downloaders]
         for dl in downloaders:
             dl.add_listener(self)
-            dl.add_listener(self)
 
         self.download_dir = join(config.run_dir, "downloaded")
         os.makedirs(self.download_dir, exist_ok=True)
 
-    async def on_state_change(self, position: float, old_state: State, new_state: State):
-        # self.log.info(f"{new_state}")
-        if new_state == State.END:
-            for url, file in self.files.items():
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file_saver")
+        self._pending = asyncio.Semaphore(self.max_pending)
+        if self.container:
+            self._container = open(join(self.download_dir, CONTAINER_FILE), "ab")
+            self._offset = self._container.tell()
+            self._index = open(join(self.download_dir, CONTAINER_INDEX_FILE), "a")
+
+    async def cleanup(self) -> None:
+        if self._executor is None:
+            return
+        # Writes run in order, so waiting for the last one waits for all of them
+        await (await self._submit(self._close_all))
+        self._executor.shutdown()
+        self._executor = None
+
+    async def _submit(self, fn, *args) -> asyncio.Future:
+        assert self._executor is not None
+        await self._pending.acquire()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        future.add_done_callback(self._on_write_done)
+        return future
+
+    def _on_write_done(self, future: asyncio.Future):
+        self._pending.release()
+        if not future.cancelled() and future.exception() is not None:
+            self.log.error(f"Failed to save content: {future.exception()}")
+
+    async def on_bytes_transferred(
+        self, length: int, url: str, position: int, size: int, content, timestamp_ns: Optional[int] = None
+    ) -> None:
+        if self._executor is None or len(content) == 0:
+            return
+        await self._submit(self._write, url, content)
+
+    async def on_transfer_end(self, size: int, url: str) -> None:
+        if self._executor is not None:
+            await self._submit(self._close, url, True)
+
+    async def on_transfer_canceled(self, url: str, position: int, size: int) -> None:
+        if self._executor is not None:
+            await self._submit(self._close, url, False)
+
+    def _write(self, url: str, content):
+        if self._container is not None:
+            self._container.write(content)
+            extents = self.extents.setdefault(url, [])
+            if self._last_url == url and len(extents) > 0:
+                # Contiguous with the previous chunk of the same URL
+                extents[-1][1] += len(content)
+            else:
+                extents.append([self._offset, len(content)])
+            self._offset += len(content)
+            self._last_url = url
+        else:
+            if url not in self.files:
+                self.files[url] = open(join(self.download_dir, url.split("/")[-1]), "wb")
+            self.files[url].write(content)
+
+    def _close(self, url: str, complete: bool):
+        if self._container is not None:
+            assert self._index is not None
+            extents = self.extents.pop(url, None)
+            if extents is None:
+                return
+            size = sum(length for _, length in extents)
+            self._index.write(json.dumps({"url": url, "size": size, "complete": complete, "extents": extents}) + "\n")
+            self._index.flush()
+            if self._last_url == url:
+                self._last_url = None
+        else:
+            file = self.files.pop(url, None)
+            if file is not None:
                 self.log.info(f"{url} : {file.tell()} bytes")
                 file.close()
-        pass
-
-    async def on_bytes_transferred(self, length: int, url: str, position: int, size: int, content) -> None:
-        if url not in self.files:
-            self.files[url] = open(join(self.download_dir, url.split("/")[-1]), "wb")
-        self.files[url].write(content)
-        # self.log.info(f"Saved {size} bytes")
-        pass
+
+    def _close_all(self):
+        for url in list(self.files.keys()):
+            self._close(url, False)
+        for url in list(self.extents.keys()):
+            self._close(url, False)
+        if self._container is not None:
+            self._container.close()
+            self._container = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+
+class SegmentContainer:
+    """
+    Read the content saved by file_saver in container mode.
+    When a URL has been downloaded more than once, the last transfer is returned.
+    """
+
+    def __init__(self, download_dir: str) -> None:
+        self.path = join(download_dir, CONTAINER_FILE)
+        self.entries: Dict[str, dict] = {}
+        with open(join(download_dir, CONTAINER_INDEX_FILE)) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[entry["url"]] = entry
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def read(self, url: str) -> bytes:
+        entry = self.entries[url]
+        content = bytearray()
+        with open(self.path, "rb") as f:
+            for offset, length in entry["extents"]:
+                content += os.pread(f.fileno(), length, offset)
+        return bytes(content)
@@ -0,0 +1,125 @@
+import json
+import os
+import re
+import time
+from os.path import join
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+SCHEMA_FILE = "schema.json"
+
+
+class ColumnTable:
+    """
+    Append-only table of typed columns.
+    Rows are buffered in memory and written as one .npz chunk per flush, named <table>-<chunk>.npz.
+    Float columns store None as NaN.
+    """
+
+    def __init__(self, directory: str, name: str, schema: Dict[str, str]) -> None:
+        self.directory = directory
+        self.name = name
+        self.schema = schema
+        self._columns: Dict[str, List[Any]] = {col: [] for col in schema}
+        self._chunk = 0
+
+    def __len__(self) -> int:
+        return len(next(iter(self._columns.values()), []))
+
+    def append(self, *values):
+        for col, value in zip(self._columns.values(), values):
+            col.append(value)
+
+    def flush(self):
+        if len(self) == 0:
+            return
+        arrays = {}
+        for col, values in self._columns.items():
+            dtype = self.schema[col]
+            if dtype.startswith("f"):
+                values = [np.nan if v is None else v for v in values]
+            arrays[col] = np.asarray(values, dtype=dtype)
+        for values in self._columns.values():
+            values.clear()
+
+        path = join(self.directory, f"{self.name}-{self._chunk:06d}.npz")
+        # Write then rename, so a crash never leaves a truncated chunk behind
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+        self._chunk += 1
+
+
+class MetricsStore:
+    """
+    Set of column tables saved under one directory.
+    Buffered rows are flushed every flush_interval seconds or every flush_rows rows, whichever comes first.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 5, flush_rows: int = 4096) -> None:
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.tables: Dict[str, ColumnTable] = {}
+        self._last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def add_table(self, name: str, schema: Dict[str, str]) -> ColumnTable:
+        table = ColumnTable(self.directory, name, schema)
+        self.tables[name] = table
+        with open(join(self.directory, SCHEMA_FILE), "w") as f:
+            json.dump({name: table.schema for name, table in self.tables.items()}, f)
+        return table
+
+    def append(self, table: str, *values):
+        self.tables[table].append(*values)
+        if len(self.tables[table]) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        for table in self.tables.values():
+            table.flush()
+        self._last_flush = time.monotonic()
+
+
+def load_metrics(directory: str, tables: Optional[List[str]] = None) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Load the tables saved by a MetricsStore
+
+    Parameters
+    ----------
+    directory: str
+        The directory of the store
+    tables: List[str], optional
+        Only load these tables
+
+    Returns
+    -------
+    tables: Dict[str, Dict[str, np.ndarray]]
+        One array per column, for each table
+    """
+    with open(join(directory, SCHEMA_FILE)) as f:
+        schema: Dict[str, Dict[str, str]] = json.load(f)
+
+    chunks: Dict[str, List[str]] = {name: [] for name in schema}
+    pattern = re.compile(r"^(.+)-(\d+)\.npz$")
+    for file in sorted(os.listdir(directory)):
+        match = pattern.match(file)
+        if match is not None and match.group(1) in chunks:
+            chunks[match.group(1)].append(file)
+
+    result = {}
+    for name, columns in schema.items():
+        if tables is not None and name not in tables:
+            continue
+        parts: Dict[str, List[np.ndarray]] = {col: [] for col in columns}
+        for file in chunks[name]:
+            with np.load(join(directory, file)) as data:
+                for col in columns:
+                    parts[col].append(data[col])
+        result[name] = {
+            col: np.concatenate(arrays) if len(arrays) > 0 else np.empty(0, dtype=columns[col])
+            for col, arrays in parts.items()
+        }
+    return result
@@ -3,7 +3,7 @@ import logging
 import sys
 from asyncio import create_subprocess_exec
 from asyncio.subprocess import PIPE
-from typing import Dict
+from typing import Dict, Optional
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.analyzer import Analyzer
@@ -123,7 +123,9 @@ class Playback(Module, Analyzer, PlayerEventListener, DownloadEventListener):
             # Segment
             pass
 
-    async def on_bytes_transferred(self, length: int, url: str, position: int, size: int, content) -> None:
+    async def on_bytes_transferred(
+        self, length: int, url: str, position: int, size: int, content, timestamp_ns: Optional[int] = None
+    ) -> None:
         segment = self.mpd_provider.segment_by_url(url)
         # self.log.debug(f"{self.decoders=}")
         if segment is None:
@@ -1,6 +1,5 @@
 import logging
-import time
-from typing import Dict
+from typing import Dict, Optional, Set
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.bw_meter import BandwidthMeter, DownloadStats
@@ -8,6 +7,7 @@ from istream_player.core.downloader import DownloadEventListener, DownloadManage
 from istream_player.core.module import Module, ModuleOption
 from istream_player.core.scheduler import Scheduler, SchedulerEventListener
 from istream_player.models.mpd_objects import Segment
+from istream_player.utils.timing import now_ns, to_wall, wall_time
 
 
 @ModuleOption("bw_meter", default=True, requires=["segment_downloader", Scheduler])
@@ -17,6 +17,12 @@ class BandwidthMeterImpl(Module, BandwidthMeter, DownloadEventListener, Schedule
     def __init__(self):
         super().__init__()
         self.stats: Dict[str, DownloadStats] = {}
+        # Transfers not yet used for a bandwidth estimate
+        self._unestimated: Set[str] = set()
+        # Completed transfers kept for get_stats until their index is reported, and the segment URLs of each
+        # index announced by the scheduler
+        self._finished: Dict[str, DownloadStats] = {}
+        self._expected: Dict[int, Set[str]] = {}
         self.total_bytes = 0
         self.start_time = 0
 
@@ -32,44 +38,59 @@ class BandwidthMeterImpl(Module, BandwidthMeter, DownloadEventListener, Schedule
 
     async def on_transfer_start(self, url) -> None:
         if self.start_time == 0:
-            self.start_time = time.time()
-        self.stats[url] = DownloadStats(start_time=time.time())
+            self.start_time = wall_time()
+        self.stats[url] = DownloadStats(start_time=wall_time())
+        self._unestimated.add(url)
 
     async def on_transfer_end(self, size: int, url: str) -> None:
         stats = self.stats.get(url)
         if stats is None:
             return
-        stats.stop_time = time.time()
+        stats.stop_time = wall_time()
         if stats.stopped_bytes is not None:
             stats.stopped_bytes = size
 
-    async def on_bytes_transferred(self, length: int, url: str, position: int, size: int, content: bytes) -> None:
+    async def on_bytes_transferred(
+        self, length: int, url: str, position: int, size: int, content: bytes, timestamp_ns: Optional[int] = None
+    ) -> None:
         stats = self.stats.get(url)
         if stats is None:
             return
         self.total_bytes += length
         stats.received_bytes += length
         stats.total_bytes = size
+        # Stamped by the downloader on arrival, not when the listener runs
+        t = to_wall(timestamp_ns if timestamp_ns is not None else now_ns())
         if stats.first_byte_at is None:
-            stats.first_byte_at = time.time()
-            stats.last_byte_at = stats.first_byte_at
-        else:
-            stats.last_byte_at = time.time()
+            stats.first_byte_at = t
+        stats.last_byte_at = t
 
     async def on_transfer_canceled(self, url: str, position: int, size: int) -> None:
         stats = self.stats.get(url)
         if stats is None:
             return
         stats.stopped_bytes = stats.received_bytes
-        stats.stop_time = time.time()
+        stats.stop_time = wall_time()
+
+    async def on_segment_download_start(self, index: int, adap_bw: Dict[int, float], segments: Dict[int, Segment]):
+        urls = {segment.url for segment in segments.values()}
+        # A revised index replaces its segments, the replaced ones are never reported
+        for url in self._expected.get(index, set()) - urls:
+            self._finished.pop(url, None)
+        self._expected[index] = urls
 
     def get_stats(self, url: str) -> DownloadStats:
-        return self.stats[url]
+        stats = self.stats.get(url)
+        return stats if stats is not None else self._finished[url]
 
     async def on_segment_download_complete(self, index: int, segments: Dict[int, Segment], stats: Dict[int, DownloadStats]):
         # Changed bw meter computation
         est_bws = []
-        for st in self.stats.values():
+        # Only finished transfers are used, later indices may still be in flight
+        completed = [url for url in self._unestimated if self.stats[url].stop_time is not None]
+        self._unestimated.difference_update(completed)
+        for url in completed:
+            st = self.stats[url]
             if st.start_time is None or st.last_byte_at is None:
                 continue
 
@@ -84,7 +105,16 @@ class BandwidthMeterImpl(Module, BandwidthMeter, DownloadEventListener, Schedule
         for listener in self.listeners:
             await listener.on_bandwidth_update(self._bw)
 
-        # Clear last segments
-        self.stats.clear()
+        # Completed transfers of later indices stay available to get_stats until they are reported. Init segments
+        # and replaced transfers are never reported, they are released now.
+        for reported in [i for i in self._expected.keys() if i <= index]:
+            del self._expected[reported]
+        expected = set().union(*self._expected.values())
+        for url in completed:
+            st = self.stats.pop(url)
+            if url in expected:
+                self._finished[url] = st
+        for segment in segments.values():
+            self._finished.pop(segment.url, None)
         self.total_bytes = 0
         self.start_time = 0
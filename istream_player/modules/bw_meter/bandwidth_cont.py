@@ -1,20 +1,25 @@
 import logging
-import operator
-import time
+from typing import Dict, Optional
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.bw_meter import (BandwidthMeter,
-                                          BandwidthUpdateListener)
+                                          BandwidthUpdateListener,
+                                          DownloadStats)
 from istream_player.core.downloader import (DownloadEventListener,
                                             DownloadManager)
 from istream_player.core.module import Module, ModuleOption
+from istream_player.utils.throughput_window import ThroughputWindow
+from istream_player.utils.timing import now_ns, to_wall, wall_time
 
 
 @ModuleOption("bw_cont", requires=["segment_downloader"])
-class BandwidthMeterImpl(Module, BandwidthMeter, DownloadEventListener):
-    log = logging.getLogger("BandwidthMeterImpl")
+class BandwidthMeterCont(Module, BandwidthMeter, DownloadEventListener):
+    log = logging.getLogger("BandwidthMeterCont")
 
-    def __init__(self):
+    # Download stats kept for get_stats
+    max_stats = 32
+
+    def __init__(self, *, estimator="mean", percentile="50", push_interval="0"):
         super().__init__()
 
         self.last_byte_at = 0
@@ -23,33 +28,57 @@ class BandwidthMeterImpl(Module, BandwidthMeter, DownloadEventListener):
         self.transmission_end_time = None
         self.extra_stats = {}
         self.first_byte_in_segment = True
-        self._cont_bw = []
         self.last_cont_bw = None
         self.downloading_url = None
+        self.stats: Dict[str, DownloadStats] = {}
+
+        # Estimator of the continuous bandwidth: mean, harmonic, ewma or percentile
+        self.estimator = estimator
+        self.percentile = float(percentile)
+        # Minimum time between two continuous bandwidth updates to the listeners (s), 0 for every chunk
+        self.push_interval = float(push_interval)
+        self._last_push = None
 
     async def setup(self, config: PlayerConfig, segment_downloader: DownloadManager, **kwargs):
         self._bw = config.static.max_initial_bitrate
         self.smooth_factor = config.static.smoothing_factor
         self.max_packet_delay = config.static.max_packet_delay
         self.cont_bw_window = config.static.cont_bw_window
+        self._window = ThroughputWindow(self.cont_bw_window, self.estimator, self.percentile)
 
         segment_downloader.add_listener(self)
 
     async def on_transfer_start(self, url) -> None:
-        self.transmission_start_time = time.time()
+        self.transmission_start_time = wall_time()
         self.bytes_transferred = 0
         self.first_byte_in_segment = True
         self.downloading_url = url
+        self.stats[url] = DownloadStats(start_time=self.transmission_start_time)
+        while len(self.stats) > self.max_stats:
+            del self.stats[next(iter(self.stats))]
         self.log.info("Transmission starts. URL: " + url)
 
-    async def on_bytes_transferred(self, length: int, url: str, position: int, size: int, content) -> None:
+    async def on_bytes_transferred(
+        self, length: int, url: str, position: int, size: int, content, timestamp_ns: Optional[int] = None
+    ) -> None:
         # if url == self.downloading_url:
         self.bytes_transferred += length
-        t = time.time()
+        # Stamped by the downloader on arrival, not when the listener runs
+        t = to_wall(timestamp_ns if timestamp_ns is not None else now_ns())
+        stats = self.stats.get(url)
+        if stats is not None:
+            stats.received_bytes += length
+            stats.total_bytes = size
+            if stats.first_byte_at is None:
+                stats.first_byte_at = t
+            stats.last_byte_at = t
         await self.update_cont_bw(length, t)
 
     async def on_transfer_end(self, size: int, url: str) -> None:
-        self.transmission_end_time = time.time()
+        self.transmission_end_time = wall_time()
+        stats = self.stats.get(url)
+        if stats is not None:
+            stats.stop_time = self.transmission_end_time
         self.update_bandwidth()
         self.bytes_transferred = 0
 
@@ -63,32 +92,25 @@ class BandwidthMeterImpl(Module, BandwidthMeter, DownloadEventListener):
     def bandwidth(self) -> float:
         return self._bw
 
+    def get_stats(self, url: str) -> DownloadStats:
+        return self.stats[url]
+
     async def update_cont_bw(self, bytes_transferred: int, time_at: float):
-        min_values = 2
         if self.first_byte_in_segment:
             self.first_byte_in_segment = False
         else:
-            # est_bw = 8*bytes_transferred/(time_at - self.last_byte_at)
-            # if est_bw < 10000000000:
-            # if self.max_packet_delay > (time_at - self.last_byte_at) > 0.001:
-            if True:
-                self._cont_bw.append((self.last_byte_at, time_at, bytes_transferred))
-                if len(self._cont_bw) >= min_values:
-                    window_start = time_at - self.cont_bw_window
-                    window_values = []
-                    for bw in self._cont_bw[::-1]:
-                        if bw[1] < window_start and len(window_values) >= min_values:
-                            break
-                        window_values.append(bw)
-                    # window = self._cont_bw[max(0, len(self._cont_bw)-self.rolling_mean_window):]
-                    total_bytes = sum(list(map(operator.itemgetter(2), window_values)))
-                    total_time = sum(list(map(lambda bw: (bw[1] - bw[0]), window_values)))
-                    window_mean = int(8 * total_bytes / total_time)
-                    self.last_cont_bw = window_mean
-        if self.last_cont_bw is not None:
-            for listener in self.listeners:
-                await listener.on_continuous_bw_update(self.last_cont_bw)
+            self._window.add(self.last_byte_at, time_at, bytes_transferred)
+            window_bw = self._window.value
+            if window_bw is not None:
+                self.last_cont_bw = int(window_bw)
         self.last_byte_at = time_at
+        if self.last_cont_bw is None:
+            return
+        if self._last_push is not None and time_at - self._last_push < self.push_interval:
+            return
+        self._last_push = time_at
+        for listener in self.listeners:
+            await listener.on_continuous_bw_update(self.last_cont_bw)
 
     def update_bandwidth(self):
         assert self.transmission_end_time is not None and self.transmission_start_time is not None
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import random
+import weakref
+from typing import Optional, Tuple
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.module import ModuleOption
+from istream_player.modules.downloader.local import LocalClient
+from istream_player.utils.bandwidth_trace import BandwidthTrace
+from istream_player.utils.timing import now_ns
+
+
+class EmulatedLink(object):
+    """
+    Token bucket bottleneck whose rate follows a bandwidth trace.
+    The transfers sharing the link send their packets one at a time, in arrival order.
+    """
+
+    def __init__(self, trace: BandwidthTrace, burst: int, time_factor: float):
+        self.trace = trace
+        self.burst = burst
+        self.time_factor = time_factor
+        self._loop = asyncio.get_running_loop()
+        self._start = self._loop.time()
+        self._lock = asyncio.Lock()
+        self._tokens = float(burst)
+        self._last = 0.0
+
+    def now(self) -> float:
+        """Time of the link in seconds. The trace is played slower or faster with the time factor of the players."""
+        return (self._loop.time() - self._start) / self.time_factor
+
+    async def transmit(self, size: int):
+        """Wait until the link has carried `size` bytes"""
+        if self.time_factor == 0:
+            return
+        async with self._lock:
+            now = self.now()
+            sent = self.trace.bytes_until(now)
+            self._tokens = min(self.burst, self._tokens + sent - self.trace.bytes_until(self._last))
+            self._last = now
+            if self._tokens < size:
+                ready = self.trace.time_for_bytes(sent + size - self._tokens)
+                await asyncio.sleep((ready - now) * self.time_factor)
+                self._tokens = size
+                self._last = ready
+            self._tokens -= size
+
+
+# Links of the running players, by event loop and link name. A link lives as long as a downloader uses it.
+_links: "weakref.WeakValueDictionary[Tuple[asyncio.AbstractEventLoop, str], EmulatedLink]" = weakref.WeakValueDictionary()
+
+
+def get_link(name: str, trace_path: Optional[str], bw_kbit: float, burst: int, time_factor: float) -> EmulatedLink:
+    """Return the link with the given name in the running event loop, creating it from the trace or constant rate"""
+    key = (asyncio.get_running_loop(), name)
+    link = _links.get(key)
+    if link is None:
+        trace = BandwidthTrace.load(trace_path) if trace_path else BandwidthTrace.constant(bw_kbit)
+        link = _links[key] = EmulatedLink(trace, burst, time_factor)
+    return link
+
+
+@ModuleOption("emulated")
+class EmulatedClient(LocalClient):
+    """
+    Reads local files like the local downloader, through an emulated network: a token bucket bottleneck
+    following a bandwidth trace (or a constant rate of `bw_kbit` kbit/s), a round trip time before the first byte
+    of each transfer and random packet loss. Lost packets are sent again one round trip later.
+
+    By default the downloaders of a player share a link of their own. Players of the same process
+    with the same `link` name share one bottleneck.
+    """
+
+    log = logging.getLogger("EmulatedClient")
+
+    def __init__(
+        self,
+        *,
+        trace="",
+        bw_kbit="10000",
+        link="",
+        burst="20000",
+        rtt="0",
+        jitter="0",
+        loss="0",
+        seed="0",
+        discard_body="false",
+    ) -> None:
+        super().__init__(discard_body=discard_body)
+        self.link_trace = trace or None
+        self.link_bw_kbit = float(bw_kbit)
+        self.link_name = link or None
+        self.burst = int(burst)
+        # Round trip time and its jitter in ms
+        self.rtt = float(rtt) / 1000
+        self.jitter = float(jitter) / 1000
+        self.loss = float(loss)
+        if not 0 <= self.loss < 1:
+            raise Exception(f"Emulated Downloader : Loss must be in [0, 1), got {loss}")
+        self.rng = random.Random(int(seed))
+        self.link: Optional[EmulatedLink] = None
+
+    async def setup(self, config: PlayerConfig, **kwargs):
+        await super().setup(config, **kwargs)
+        name = self.link_name if self.link_name is not None else f"player-{id(config)}"
+        self.link = get_link(name, self.link_trace, self.link_bw_kbit, self.burst, config.time_factor)
+
+    def sample_rtt(self) -> float:
+        return max(0.0, self.rtt + self.rng.uniform(-self.jitter, self.jitter))
+
+    async def request_read(self, url: str):
+        assert self.link is not None
+        await asyncio.sleep(self.sample_rtt() * self.time_factor)
+        for chunk in self.read_chunks(url):
+            await self.link.transmit(len(chunk))
+            while self.rng.random() < self.loss:
+                await asyncio.sleep(self.sample_rtt() * self.time_factor)
+                await self.link.transmit(len(chunk))
+            await self.transfer_queue.put((url, chunk, now_ns()))
+        await self.transfer_queue.put((url, None, now_ns()))
@@ -0,0 +1,304 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.errors import ErrorCodes
+from h2.events import (ConnectionTerminated, DataReceived, ResponseReceived,
+                       StreamEnded, StreamReset)
+from h2.settings import SettingCodes
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.downloader import (DownloadManager, DownloadRequest,
+                                            DownloadResponse, DownloadType)
+from istream_player.core.module import Module, ModuleOption
+from istream_player.utils.async_utils import critical_task
+from istream_player.utils.segment_buffer import SegmentBuffer
+from istream_player.utils.timing import TransferTiming, TransferTimings, now_ns
+from istream_player.utils.tls import client_ssl_context
+
+
+class H2Session:
+    """
+    One HTTP/2 connection to an origin. All the requests to the origin are multiplexed as streams over it.
+    """
+
+    log = logging.getLogger("H2Session")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, window_size: int) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.conn = H2Connection(config=H2Configuration(client_side=True, header_encoding="utf-8"))
+        self.conn.initiate_connection()
+        self.conn.update_settings({SettingCodes.INITIAL_WINDOW_SIZE: window_size})
+        self.conn.increment_flow_control_window(window_size)
+        self.flush()
+
+    @staticmethod
+    async def open(scheme: str, host: str, port: int, window_size: int, local_addr: Optional[str] = None) -> "H2Session":
+        local = (local_addr, 0) if local_addr is not None else None
+        if scheme == "https":
+            reader, writer = await asyncio.open_connection(host, port, ssl=client_ssl_context("h2"), local_addr=local)
+            ssl_object = writer.get_extra_info("ssl_object")
+            if ssl_object is None or ssl_object.selected_alpn_protocol() != "h2":
+                writer.close()
+                raise Exception(f"Server {host}:{port} did not negotiate HTTP/2")
+        else:
+            # Cleartext HTTP/2 with prior knowledge (h2c)
+            reader, writer = await asyncio.open_connection(host, port, local_addr=local)
+        return H2Session(reader, writer, window_size)
+
+    def flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.writer.write(data)
+
+    def close(self):
+        try:
+            self.conn.close_connection()
+            self.flush()
+        finally:
+            self.writer.close()
+
+
+@ModuleOption("h2")
+class H2ClientImpl(Module, DownloadManager):
+    """
+    HTTP/2 client multiplexing all the requests to an origin over one TCP connection.
+    A single stream can be stopped with RST_STREAM without affecting the others.
+    """
+
+    log = logging.getLogger("H2ClientImpl")
+    per_url_cancel = True
+
+    def __init__(self, *, window_size: str = str(16 * 1024 * 1024), read_size: str = "65536", discard_body: str = "false"):
+        super().__init__()
+        # Only count the received bytes of segments, without keeping them
+        self.discard_body = discard_body.lower() == "true"
+        self.window_size = int(window_size)
+        self.read_size = int(read_size)
+
+        self._sessions: Dict[Tuple[str, str, int], H2Session] = {}
+        self._session_lock = asyncio.Lock()
+        self._reader_tasks: Dict[Tuple[str, str, int], asyncio.Task] = {}
+
+        # Stream ids are only unique within one session
+        self._streams: Dict[Tuple[H2Session, int], str] = {}
+        self._url_streams: Dict[str, Tuple[H2Session, int]] = {}
+
+        self._headers: Dict[str, Dict[str, str]] = {}
+        self._mpd_urls: Set[str] = set()
+        self._mpd_responses: Dict[str, DownloadResponse] = {}
+        self._content: Dict[str, SegmentBuffer] = {}
+        self._sizes: Dict[str, int] = {}
+        self._completed: Dict[str, asyncio.Event] = {}
+        self._timings = TransferTimings()
+
+        self._partially_accepted_urls: Set[str] = set()
+        self._cancelled_urls: Set[str] = set()
+
+    async def setup(self, config: PlayerConfig, **kwargs):
+        self.ssl_keylog_file = config.ssl_keylog_file
+        self.local_addr = config.local_addr
+
+    async def cleanup(self) -> None:
+        await self.close()
+
+    @property
+    def is_busy(self):
+        return len(self._url_streams) > 0
+
+    async def _get_session(self, url: str) -> H2Session:
+        parsed = urlparse(url)
+        scheme = parsed.scheme.lower()
+        host = parsed.hostname or "localhost"
+        port = parsed.port or (443 if scheme == "https" else 80)
+        key = (scheme, host, port)
+        async with self._session_lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = await H2Session.open(scheme, host, port, self.window_size, self.local_addr)
+                self._sessions[key] = session
+                self._reader_tasks[key] = asyncio.create_task(self._read_loop(key, session), name=f"TASK_H2_READ_{host}")
+        return session
+
+    async def download(self, request: DownloadRequest, save: bool = False) -> Optional[memoryview]:
+        url = request.url
+        self._completed[url] = asyncio.Event()
+        self._content[url] = SegmentBuffer(discard=self.discard_body and request.req_type != DownloadType.MPD)
+        self._partially_accepted_urls.discard(url)
+        self._cancelled_urls.discard(url)
+        if request.req_type == DownloadType.MPD:
+            self._mpd_urls.add(url)
+
+        session = await self._get_session(url)
+        parsed = urlparse(url)
+        path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        headers = [
+            (":method", "GET"),
+            (":scheme", parsed.scheme),
+            (":authority", parsed.netloc),
+            (":path", path),
+        ] + [(k.lower(), v) for k, v in request.headers.items()]
+
+        for listener in self.listeners:
+            await listener.on_transfer_start(url)
+        # No await between reserving the stream id and sending the headers, other downloads of the session would
+        # get the same id
+        self._timings.start(url)
+        stream_id = session.conn.get_next_available_stream_id()
+        self._streams[(session, stream_id)] = url
+        self._url_streams[url] = (session, stream_id)
+        session.conn.send_headers(stream_id, headers, end_stream=True)
+        session.flush()
+
+        if save:
+            await self._completed[url].wait()
+            return self._content[url].view()
+        return None
+
+    @critical_task()
+    async def _read_loop(self, key: Tuple[str, str, int], session: H2Session):
+        while True:
+            data = await session.reader.read(self.read_size)
+            # All the frames of one read arrived together
+            t = now_ns()
+            if not data:
+                self.log.info(f"Connection to {key} closed by the server")
+                await self._terminate_session(key, session)
+                return
+            for event in session.conn.receive_data(data):
+                await self._handle_event(key, session, event, t)
+            if self._sessions.get(key) is not session:
+                # Terminated by a GOAWAY
+                return
+            session.flush()
+            await session.writer.drain()
+
+    async def _handle_event(self, key: Tuple[str, str, int], session: H2Session, event, t_ns: int):
+        if isinstance(event, ConnectionTerminated):
+            self.log.info(f"Connection terminated by the server: {event.error_code}")
+            # The callers get None for the streams in flight and can retry them on a new connection
+            await self._terminate_session(key, session)
+            return
+
+        url = self._streams.get((session, getattr(event, "stream_id", 0)))
+        if url is None:
+            # Data still arriving on a stream reset by us, or connection level events
+            if isinstance(event, DataReceived):
+                session.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            return
+
+        if isinstance(event, ResponseReceived):
+            headers = {k: v for k, v in event.headers}
+            self._headers[url] = headers
+            if url in self._mpd_urls:
+                self._mpd_responses[url] = DownloadResponse(int(headers[":status"]), headers)
+            size = int(headers.get("content-length", 0))
+            self._sizes[url] = size
+            self._content[url] = SegmentBuffer(size, discard=self._content[url].discard)
+            timing = self._timings.get(url)
+            if timing is not None:
+                timing.on_headers(t_ns)
+        elif isinstance(event, DataReceived):
+            session.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            timing = self._timings.get(url)
+            if timing is not None:
+                timing.on_chunk(t_ns, len(event.data))
+            content = self._content[url]
+            view = content.append(event.data)
+            size = self._sizes.get(url, 0)
+            for listener in self.listeners:
+                await listener.on_bytes_transferred(len(event.data), url, content.position, size, view, timestamp_ns=t_ns)
+        elif isinstance(event, StreamEnded):
+            self.log.info(f"Transfer ends: {len(self._content[url])}")
+            self._finish(url)
+            for listener in self.listeners:
+                await listener.on_transfer_end(len(self._content[url]), url)
+        elif isinstance(event, StreamReset):
+            self.log.info(f"Stream reset by the server: {url}")
+            self._cancelled_urls.add(url)
+            self._finish(url)
+            for listener in self.listeners:
+                await listener.on_transfer_canceled(url, len(self._content[url]), self._sizes.get(url, 0))
+
+    def _finish(self, url: str):
+        timing = self._timings.get(url)
+        if timing is not None and timing.end_ns is None:
+            timing.on_end(now_ns())
+        stream = self._url_streams.pop(url, None)
+        if stream is not None:
+            del self._streams[stream]
+        self._completed[url].set()
+
+    def _reset(self, url: str) -> bool:
+        """Send RST_STREAM for one URL. Return False if the URL is not downloading"""
+        stream = self._url_streams.get(url)
+        if stream is None:
+            return False
+        session, stream_id = stream
+        session.conn.reset_stream(stream_id, error_code=ErrorCodes.CANCEL)
+        session.flush()
+        self._finish(url)
+        return True
+
+    async def _terminate_session(self, key: Tuple[str, str, int], session: H2Session):
+        # A new session to the same origin may already be open
+        if self._sessions.get(key) is session:
+            del self._sessions[key]
+            self._reader_tasks.pop(key, None)
+        for (stream_session, _), url in list(self._streams.items()):
+            if stream_session is session:
+                self._cancelled_urls.add(url)
+                self._finish(url)
+                for listener in self.listeners:
+                    await listener.on_transfer_canceled(url, len(self._content[url]), self._sizes.get(url, 0))
+        session.writer.close()
+
+    async def wait_complete(self, url: str) -> Optional[Tuple[memoryview, int]]:
+        await self._completed[url].wait()
+        del self._completed[url]
+        content = self._content.pop(url)
+        size = self._sizes.pop(url, len(content))
+        self._headers.pop(url, None)
+        # If the url has been dropped, return None
+        if url in self._cancelled_urls:
+            self._cancelled_urls.remove(url)
+            return None
+        self._partially_accepted_urls.discard(url)
+        return content.view(), size
+
+    def get_response(self, url: str) -> Optional[DownloadResponse]:
+        return self._mpd_responses.get(url)
+
+    def get_timing(self, url: str) -> Optional[TransferTiming]:
+        return self._timings.get(url)
+
+    def cancel_read_url(self, url: str):
+        return
+
+    async def stop(self, url: str):
+        self.log.info("STOP DOWNLOADING: " + url)
+        if not self._reset(url):
+            return
+        self._partially_accepted_urls.add(url)
+        for listener in self.listeners:
+            await listener.on_transfer_end(len(self._content[url]), url)
+
+    async def drop_url(self, url: str):
+        self.log.info("DROP DOWNLOADING: " + url)
+        if not self._reset(url):
+            return
+        self._cancelled_urls.add(url)
+        for listener in self.listeners:
+            await listener.on_transfer_canceled(url, len(self._content[url]), self._sizes.get(url, 0))
+
+    async def close(self):
+        for task in self._reader_tasks.values():
+            task.cancel()
+        for session in self._sessions.values():
+            session.close()
+        self._reader_tasks.clear()
+        self._sessions.clear()
@@ -1,36 +1,60 @@
 import asyncio
-from collections import defaultdict
+import mmap
+import os
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Dict, Iterator, Optional, Tuple
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.downloader import (DownloadEventListener,
-                                            DownloadManager, DownloadRequest)
+                                            DownloadManager, DownloadRequest,
+                                            DownloadResponse, DownloadType)
 from istream_player.core.module import Module, ModuleOption
+from istream_player.utils.bandwidth_trace import BandwidthTrace
+from istream_player.utils.segment_buffer import SegmentBuffer
+from istream_player.utils.timing import TransferTiming, TransferTimings, now_ns
 
 
 @ModuleOption("local", default=True)
 class LocalClient(Module, DownloadManager):
-    def __init__(self, *, bw="100000000000") -> None:
+    def __init__(self, *, bw="100000000000", trace="", share="client", discard_body="false") -> None:
         super().__init__()
-        self.bw = int(bw)  # Not implemented
+        # Rate in bytes per second, or a bandwidth trace in the resources/traces/trace_*.csv format which overrides it
+        self.bw = int(bw)
+        self.trace_path = trace or None
+        # The rate is shared by all the transfers of the client, or applies to each URL
+        if share not in ("client", "url"):
+            raise Exception(f"Local Downloader : Unknown share '{share}', use 'client' or 'url'")
+        self.share = share
+        # Only count the read bytes of segments, without keeping them
+        self.discard_body = discard_body.lower() == "true"
         self.max_packet_size = 20_000
 
-        self.transfer_queue: asyncio.Queue[tuple[str, bytes | None]] = asyncio.Queue()
-        self.content: Dict[str, bytearray] = defaultdict(bytearray)
+        self.trace: Optional[BandwidthTrace] = None
+        self._start = 0.0
+        # Trace bytes reserved by the chunks of all the transfers of the client
+        self._client_mark = 0.0
+
+        # (url, chunk or None at the end, monotonic release time in ns)
+        self.transfer_queue: asyncio.Queue[tuple[str, bytes | None, int]] = asyncio.Queue()
+        self.content: Dict[str, SegmentBuffer] = {}
         self.transfer_size: Dict[str, int] = {}
         self.transfer_compl: Dict[str, asyncio.Event] = {}
+        self.responses: Dict[str, DownloadResponse] = {}
+        self.timings = TransferTimings()
         self.downloader_task: Optional[asyncio.Task] = None
 
     async def setup(self, config: PlayerConfig, **kwargs):
         self.downloader_task = asyncio.create_task(self.throttled_download(), name="TASK_LOCAL_DOWNLOADER")
         self.time_factor = config.time_factor
+        self.trace = BandwidthTrace.load(self.trace_path) if self.trace_path else BandwidthTrace.constant(self.bw * 8 / 1000)
+        self._start = asyncio.get_running_loop().time()
 
     async def cleanup(self):
         if self.downloader_task:
             self.downloader_task.cancel()
 
-    async def wait_complete(self, url: str) -> Tuple[bytes, int]:
+    async def wait_complete(self, url: str) -> Tuple[memoryview, int]:
         """
         Wait the stream to complete
 
@@ -49,7 +73,13 @@ class LocalClient(Module, DownloadManager):
         del self.content[url]
         del self.transfer_compl[url]
         del self.transfer_size[url]
-        return content, len(content)
+        return content.view(), len(content)
+
+    def get_response(self, url: str) -> Optional[DownloadResponse]:
+        return self.responses.get(url)
+
+    def get_timing(self, url: str) -> Optional[TransferTiming]:
+        return self.timings.get(url)
 
     def cancel_read_url(self, url: str):
         raise Exception("Local Downloader : Cannot cancel download")
@@ -64,17 +94,29 @@ class LocalClient(Module, DownloadManager):
     def is_busy(self):
         return False
 
-    async def download(self, request: DownloadRequest, save: bool = False) -> Optional[bytes]:
+    async def download(self, request: DownloadRequest, save: bool = False) -> Optional[memoryview]:
         url = request.url
         self.transfer_compl[url] = asyncio.Event()
-        self.transfer_size[url] = Path(url).stat().st_size
+        self.timings.start(url)
+        stat = Path(url).stat()
+        read_body = True
+        if request.req_type == DownloadType.MPD:
+            self.responses[url] = self.file_response(request, stat)
+            read_body = self.responses[url].status != 304
+        self.transfer_size[url] = stat.st_size if read_body else 0
+        self.content[url] = SegmentBuffer(
+            self.transfer_size[url], discard=self.discard_body and request.req_type != DownloadType.MPD
+        )
         for listener in self.listeners:
             await listener.on_transfer_start(url)
-        asyncio.create_task(self.request_read(url), name=f"TASK_LOCAL_REQREAD_{url.rsplit('/', 1)[-1]}")
+        if read_body:
+            asyncio.create_task(self.request_read(url), name=f"TASK_LOCAL_REQREAD_{url.rsplit('/', 1)[-1]}")
+        else:
+            # Not modified, the transfer ends without body
+            await self.transfer_queue.put((url, None, now_ns()))
         if save:
             await self.transfer_compl[url].wait()
-            content = self.content[url]
-            return content
+            return self.content[url].view()
         else:
             return None
 
@@ -88,29 +130,81 @@ class LocalClient(Module, DownloadManager):
         if listener not in self.listeners:
             self.listeners.append(listener)
 
+    @staticmethod
+    def file_response(request: DownloadRequest, stat: os.stat_result) -> DownloadResponse:
+        """Emulate the validators of an HTTP server from the file modification time, and answer conditional requests"""
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        headers = {"ETag": etag, "Last-Modified": formatdate(stat.st_mtime, usegmt=True)}
+        if "If-None-Match" in request.headers:
+            not_modified = request.headers["If-None-Match"] == etag
+        elif "If-Modified-Since" in request.headers:
+            not_modified = parsedate_to_datetime(request.headers["If-Modified-Since"]).timestamp() >= int(stat.st_mtime)
+        else:
+            not_modified = False
+        return DownloadResponse(304 if not_modified else 200, headers)
+
+    def read_chunks(self, url: str) -> Iterator[bytes]:
+        """Read the file in packets through a memory map, without blocking reads on the event loop"""
+        with open(url, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for offset in range(0, size, self.max_packet_size):
+                    yield mm[offset:offset + self.max_packet_size]
+
+    def reserve(self, size: int, mark: float) -> Tuple[float, float]:
+        """
+        Schedule a chunk on the rate trace
+
+        Parameters
+        ----------
+        size:
+            Size of the chunk in bytes
+        mark:
+            Trace bytes already reserved by the previous chunks sharing the rate
+
+        Returns
+        -------
+            The new mark, and the event loop time at which the chunk is released
+        """
+        assert self.trace is not None
+        now = (asyncio.get_running_loop().time() - self._start) / self.time_factor
+        mark = max(mark, self.trace.bytes_until(now)) + size
+        return mark, self._start + self.trace.time_for_bytes(mark) * self.time_factor
+
     async def request_read(self, url: str):
         # print(f"Request : {url}")
-        with open(url, "rb") as f:
-            while True:
-                data = f.read(self.max_packet_size)
-                # print(f"Putting {len(data)} bytes for {url}")
-                await self.transfer_queue.put((url, data))
-                if not data:
-                    break
+        mark = 0.0
+        for chunk in self.read_chunks(url):
+            if self.time_factor > 0:
+                # Released at absolute times, so waking up late does not delay the next chunks
+                if self.share == "client":
+                    self._client_mark, release = self.reserve(len(chunk), self._client_mark)
+                else:
+                    mark, release = self.reserve(len(chunk), mark)
+                await asyncio.sleep(max(0.0, release - asyncio.get_running_loop().time()))
+            await self.transfer_queue.put((url, chunk, now_ns()))
+        await self.transfer_queue.put((url, None, now_ns()))
 
     async def throttled_download(self):
         while True:
             # print("Getting response from transfer_queue")
-            url, chunk = await self.transfer_queue.get()
+            # Stamped when released by the reader, so the time spent in the listeners does not delay the stamps
+            url, chunk, t = await self.transfer_queue.get()
+            timing = self.timings.get(url)
             if chunk:
-                self.content[url].extend(chunk)
+                if timing is not None:
+                    timing.on_chunk(t, len(chunk))
+                view = self.content[url].append(chunk)
                 for listener in self.listeners:
                     await listener.on_bytes_transferred(
-                        len(chunk), url, len(self.content[url]), self.transfer_size[url], chunk
+                        len(chunk), url, len(self.content[url]), self.transfer_size[url], view, timestamp_ns=t
                     )
             else:
+                if timing is not None:
+                    timing.on_end(t)
                 self.transfer_compl[url].set()
                 for listener in self.listeners:
                     await listener.on_transfer_end(self.transfer_size[url], url)
-            await asyncio.sleep(self.time_factor * self.max_packet_size / self.bw)
 
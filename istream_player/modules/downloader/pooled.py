@@ -0,0 +1,197 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Set, Tuple
+
+import aiohttp
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.downloader import (DownloadManager, DownloadRequest,
+                                            DownloadResponse, DownloadType)
+from istream_player.core.module import Module, ModuleOption
+from istream_player.utils.async_utils import critical_task
+from istream_player.utils.segment_buffer import SegmentBuffer
+from istream_player.utils.timing import TransferTiming, TransferTimings, now_ns
+from istream_player.utils.tls import client_ssl_context
+
+# Connection pools shared by all the pooled clients of a process, keyed by event loop, pool limits and source address.
+# Players running one after another in the same event loop reuse the warm TCP/TLS connections.
+_pools: Dict[Tuple[asyncio.AbstractEventLoop, int, int, float, Optional[str]], aiohttp.ClientSession] = {}
+
+
+def get_connection_pool(
+    limit: int, limit_per_host: int, keepalive_timeout: float, local_addr: Optional[str] = None
+) -> aiohttp.ClientSession:
+    """Return the shared session of the running event loop for the given limits and source address, creating it if needed"""
+    loop = asyncio.get_running_loop()
+    key = (loop, limit, limit_per_host, keepalive_timeout, local_addr)
+    session = _pools.get(key)
+    if session is None or session.closed:
+        # Pools of event loops which are already closed cannot be reused
+        for stale_key in [k for k in _pools.keys() if k[0].is_closed()]:
+            del _pools[stale_key]
+
+        connector = aiohttp.TCPConnector(
+            ssl=client_ssl_context(),
+            limit=limit,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            local_addr=(local_addr, 0) if local_addr is not None else None,
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _pools[key] = session
+    return session
+
+
+async def close_connection_pools():
+    """Close all the shared sessions of the running event loop"""
+    loop = asyncio.get_running_loop()
+    for key in [k for k in _pools.keys() if k[0] is loop]:
+        await _pools.pop(key).close()
+
+
+@ModuleOption("tcp_pool")
+class PooledTCPClientImpl(Module, DownloadManager):
+    """
+    HTTP/1.1 client on top of a process wide keep-alive connection pool.
+    Every URL is downloaded by its own task, so concurrent requests use parallel connections
+    (up to limit_per_host) and can be stopped or dropped independently.
+    """
+
+    log = logging.getLogger("PooledTCPClientImpl")
+    per_url_cancel = True
+
+    def __init__(
+        self, *, limit: str = "100", limit_per_host: str = "6", keepalive_timeout: str = "60", discard_body: str = "false"
+    ):
+        super().__init__()
+        # Only count the received bytes of segments, without keeping them
+        self.discard_body = discard_body.lower() == "true"
+        self.limit = int(limit)
+        self.limit_per_host = int(limit_per_host)
+        self.keepalive_timeout = float(keepalive_timeout)
+
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._responses: Dict[str, aiohttp.ClientResponse] = {}
+        self._mpd_responses: Dict[str, DownloadResponse] = {}
+        self._content: Dict[str, SegmentBuffer] = {}
+        self._sizes: Dict[str, int] = {}
+        self._completed: Dict[str, asyncio.Event] = {}
+        self._timings = TransferTimings()
+
+        self._partially_accepted_urls: Set[str] = set()
+        self._cancelled_urls: Set[str] = set()
+
+    async def setup(self, config: PlayerConfig, **kwargs):
+        self.ssl_keylog_file = config.ssl_keylog_file
+        self.local_addr = config.local_addr
+
+    async def cleanup(self) -> None:
+        await self.close()
+
+    @property
+    def is_busy(self):
+        return len(self._tasks) > 0
+
+    async def download(self, request: DownloadRequest, save: bool = False) -> Optional[memoryview]:
+        url = request.url
+        self._completed[url] = asyncio.Event()
+        self._content[url] = SegmentBuffer(discard=self.discard_body and request.req_type != DownloadType.MPD)
+        self._partially_accepted_urls.discard(url)
+        self._cancelled_urls.discard(url)
+
+        for listener in self.listeners:
+            await listener.on_transfer_start(url)
+        self._tasks[url] = asyncio.create_task(self._download_inner(request), name=f"TASK_POOL_DOWNLOAD_{url.rsplit('/', 1)[-1]}")
+        if save:
+            await self._completed[url].wait()
+            return self._content[url].view()
+        return None
+
+    @critical_task()
+    async def _download_inner(self, request: DownloadRequest):
+        url = request.url
+        session = get_connection_pool(self.limit, self.limit_per_host, self.keepalive_timeout, self.local_addr)
+        timing = self._timings.start(url)
+        async with session.get(url, headers=request.headers) as resp:
+            timing.on_headers(now_ns())
+            self._responses[url] = resp
+            if request.req_type == DownloadType.MPD:
+                self._mpd_responses[url] = DownloadResponse(resp.status, dict(resp.headers))
+            size = resp.content_length or 0
+            self._sizes[url] = size
+            content = SegmentBuffer(size, discard=self._content[url].discard)
+            self._content[url] = content
+            async for chunk in resp.content.iter_any():
+                t = now_ns()
+                timing.on_chunk(t, len(chunk))
+                view = content.append(chunk)
+                self.log.debug(f"Bytes transferred: length: {len(chunk)}, position: {content.position}, size: {size}, url: {url}")
+                for listener in self.listeners:
+                    await listener.on_bytes_transferred(len(chunk), url, content.position, size, view, timestamp_ns=t)
+        self.log.info(f"Transfer ends: {len(self._content[url])}")
+        self._finish(url)
+        for listener in self.listeners:
+            await listener.on_transfer_end(len(self._content[url]), url)
+
+    def _finish(self, url: str):
+        timing = self._timings.get(url)
+        if timing is not None and timing.end_ns is None:
+            timing.on_end(now_ns())
+        self._tasks.pop(url, None)
+        self._responses.pop(url, None)
+        self._completed[url].set()
+
+    def _abort(self, url: str) -> bool:
+        """Cancel the task and close the connection of one URL. Return False if the URL is not downloading"""
+        task = self._tasks.get(url)
+        if task is None:
+            return False
+        task.cancel()
+        resp = self._responses.get(url)
+        if resp is not None and resp.connection is not None and resp.connection.transport is not None:
+            # The connection is in an unknown state mid-body. Do not return it to the pool.
+            resp.connection.transport.abort()
+        self._finish(url)
+        return True
+
+    async def wait_complete(self, url: str) -> Optional[Tuple[memoryview, int]]:
+        await self._completed[url].wait()
+        del self._completed[url]
+        content = self._content.pop(url)
+        size = self._sizes.pop(url, len(content))
+        # If the url has been dropped, return None
+        if url in self._cancelled_urls:
+            self._cancelled_urls.remove(url)
+            return None
+        self._partially_accepted_urls.discard(url)
+        return content.view(), size
+
+    def get_response(self, url: str) -> Optional[DownloadResponse]:
+        return self._mpd_responses.get(url)
+
+    def get_timing(self, url: str) -> Optional[TransferTiming]:
+        return self._timings.get(url)
+
+    def cancel_read_url(self, url: str):
+        return
+
+    async def stop(self, url: str):
+        self.log.info("STOP DOWNLOADING: " + url)
+        if not self._abort(url):
+            return
+        self._partially_accepted_urls.add(url)
+        for listener in self.listeners:
+            await listener.on_transfer_end(len(self._content[url]), url)
+
+    async def drop_url(self, url: str):
+        self.log.info("DROP DOWNLOADING: " + url)
+        if not self._abort(url):
+            return
+        self._cancelled_urls.add(url)
+        for listener in self.listeners:
+            await listener.on_transfer_canceled(url, len(self._content[url]), self._sizes.get(url, 0))
+
+    async def close(self):
+        # Only the transfers of this client are stopped. The pool stays warm for the next player.
+        for url in list(self._tasks.keys()):
+            self._abort(url)
@@ -12,11 +12,14 @@ from aioquic.tls import SessionTicket
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.downloader import (DownloadEventListener,
-                                            DownloadManager, DownloadRequest)
+                                            DownloadManager, DownloadRequest,
+                                            DownloadType)
 from istream_player.core.module import Module, ModuleOption
 from istream_player.modules.downloader.quic.event_parser import \
     H3EventParserImpl
 from istream_player.modules.downloader.quic.protocol import HttpProtocol
+from istream_player.utils import tls
+from istream_player.utils.timing import TransferTiming, now_ns
 
 
 @ModuleOption("quic")
@@ -27,9 +30,11 @@ class QuicClientImpl(Module, DownloadManager):
 
     log = logging.getLogger("QuicClientImpl")
 
-    def __init__(self):
+    def __init__(self, *, discard_body: str = "false"):
         super().__init__()
         self._client: Optional[HttpProtocol] = None
+        # Only count the received bytes of segments, without keeping them
+        self.discard_body = discard_body.lower() == "true"
 
         self._close_event: Optional[asyncio.Event] = None
         self.event_parser = H3EventParserImpl(listeners=[])
@@ -65,9 +70,12 @@ class QuicClientImpl(Module, DownloadManager):
         """
         return False
 
-    async def wait_complete(self, url) -> Optional[Tuple[bytes, int]]:
+    async def wait_complete(self, url) -> Optional[Tuple[memoryview, int]]:
         return await self.event_parser.wait_complete(url)
 
+    def get_timing(self, url: str) -> Optional[TransferTiming]:
+        return self.event_parser.get_timing(url)
+
     async def close(self):
         # This is to close the whole connection
         if self._close_event is not None:
@@ -86,6 +94,7 @@ class QuicClientImpl(Module, DownloadManager):
         """
         self.log.info("New session ticket received from server: " + ticket.server_name)
         self.quic_configuration.session_ticket = ticket
+        tls.save_session_ticket(ticket)
 
     async def _download_internal(self, request: DownloadRequest) -> AsyncIterator[Tuple[H3Event, str]]:
         url = request.url
@@ -99,8 +108,9 @@ class QuicClientImpl(Module, DownloadManager):
         queue = asyncio.Queue()
 
         async def drain(iterator: AsyncIterator):
-            async for i in iterator:
-                await queue.put(i)
+            # Stamped as soon as the event leaves its stream, before waiting for the events of the other streams
+            async for event, url in iterator:
+                await queue.put((event, url, now_ns()))
 
         async def read_new_request():
             while True:
@@ -110,8 +120,8 @@ class QuicClientImpl(Module, DownloadManager):
 
         asyncio.create_task(read_new_request())
         while True:
-            event, url = await queue.get()
-            await self.event_parser.parse(url, event)
+            event, url, t = await queue.get()
+            await self.event_parser.parse(url, event, t)
 
     async def start(self, host, port, client_up_event=None):
         """
@@ -129,6 +139,9 @@ class QuicClientImpl(Module, DownloadManager):
 
         self._close_event = asyncio.Event()
         self._event_queue = asyncio.Queue()
+        # Resume the session of a previous player of the process
+        if self.quic_configuration.session_ticket is None:
+            self.quic_configuration.session_ticket = tls.get_session_ticket(self.quic_configuration.server_name or host)
 
         async with connect(
             host,
@@ -164,6 +177,7 @@ class QuicClientImpl(Module, DownloadManager):
             asyncio.create_task(self.start(host, port, client_up_event=event))
             await event.wait()
 
+        self.event_parser.expect(url, discard=self.discard_body and request.req_type != DownloadType.MPD)
         for listener in self.listeners:
             await listener.on_transfer_start(url)
         await self._download_queue.put(request)
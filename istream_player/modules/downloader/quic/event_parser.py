@@ -6,11 +6,27 @@ from typing import Dict, List, Optional, Set, Tuple, cast
 from aioquic.h3.events import DataReceived, H3Event, HeadersReceived
 
 from istream_player.core.downloader import DownloadEventListener
+from istream_player.utils.segment_buffer import SegmentBuffer
+from istream_player.utils.timing import TransferTiming, TransferTimings, now_ns
 
 
 class H3EventParser(ABC):
     @abstractmethod
-    async def wait_complete(self, url: str) -> Optional[Tuple[bytes, int]]:
+    def expect(self, url: str, discard: bool = False):
+        """
+        Register a new request before its events arrive
+
+        Parameters
+        ----------
+        url:
+            The URL of the request
+        discard:
+            If True, only count the received bytes without keeping them
+        """
+        pass
+
+    @abstractmethod
+    async def wait_complete(self, url: str) -> Optional[Tuple[memoryview, int]]:
         """
         Wait the stream to complete
 
@@ -27,9 +43,23 @@ class H3EventParser(ABC):
         pass
 
     @abstractmethod
-    async def parse(self, url: str, event: H3Event):
+    async def parse(self, url: str, event: H3Event, timestamp_ns: Optional[int] = None):
+        """
+        Parameters
+        ----------
+        url:
+            The URL of the request
+        event:
+            The HTTP/3 event of the request
+        timestamp_ns:
+            Arrival of the event on the monotonic clock, now if None
+        """
         pass
 
+    def get_timing(self, url: str) -> Optional[TransferTiming]:
+        """Timestamps of the last transfer of a URL, None if it is not timed"""
+        return None
+
     @abstractmethod
     def add_listener(self, listener: DownloadEventListener):
         pass
@@ -60,9 +90,11 @@ class H3EventParserImpl(H3EventParser):
         self._completed_urls = set()
         self._waiting_urls: Dict[str, asyncio.Event] = dict()
         self._content_lengths: Dict[str, int] = dict()
-        self._contents: Dict[str, bytearray] = dict()
+        self._contents: Dict[str, SegmentBuffer] = dict()
         self._partially_accepted_urls: Set[str] = set()
         self._canceled_urls: Set[str] = set()
+        self._discard_urls: Set[str] = set()
+        self._timings = TransferTimings()
 
     @staticmethod
     def parse_headers(headers: List[Tuple[bytes, bytes]]) -> Dict[str, str]:
@@ -72,11 +104,18 @@ class H3EventParserImpl(H3EventParser):
             result[key.decode('utf-8')] = value.decode('utf-8')
         return result
 
-    async def wait_complete(self, url: str) -> Optional[Tuple[bytes, int]]:
+    def expect(self, url: str, discard: bool = False):
+        self._timings.start(url)
+        if discard:
+            self._discard_urls.add(url)
+        else:
+            self._discard_urls.discard(url)
+
+    async def wait_complete(self, url: str) -> Optional[Tuple[memoryview, int]]:
         # If url is in partially accepted set, return read bytes and length
         if url in self._partially_accepted_urls:
-            content = self._contents[url]
-            return bytes(content), self._content_lengths[url]
+            content = self._contents.pop(url)
+            return content.view(), self._content_lengths.pop(url)
         # If the url has been dropped, return None
         if url in self._canceled_urls:
             return None
@@ -91,33 +130,49 @@ class H3EventParserImpl(H3EventParser):
             return None
         if url in self._completed_urls:
             self._completed_urls.remove(url)
-        content = self._contents[url]
-        size = self._content_lengths[url]
-        return bytes(content), size
+        content = self._contents.pop(url)
+        size = self._content_lengths.pop(url)
+        self._discard_urls.discard(url)
+        return content.view(), size
 
-    async def parse(self, url: str, event: H3Event):
+    def get_timing(self, url: str) -> Optional[TransferTiming]:
+        return self._timings.get(url)
+
+    async def parse(self, url: str, event: H3Event, timestamp_ns: Optional[int] = None):
         self.log.info(f"Event {event.__class__.__name__} received for {url}")
+        t = timestamp_ns if timestamp_ns is not None else now_ns()
+        timing = self._timings.get(url)
         if isinstance(event, HeadersReceived):
+            if timing is not None:
+                timing.on_headers(t)
             headers = self.parse_headers(event.headers)
             size = int(headers.get("content-length", 0))
             self._content_lengths[url] = size
+            self._contents[url] = SegmentBuffer(size, discard=url in self._discard_urls)
         else:
             event = cast(DataReceived, event)
+            if url in self._partially_accepted_urls and url not in self._contents:
+                # Late data of a stream which has already been closed and consumed
+                return
             size = self._content_lengths[url]
 
             if url not in self._contents:
-                self._contents[url] = bytearray()
+                self._contents[url] = SegmentBuffer(size, discard=url in self._discard_urls)
 
-            self._contents[url].extend(event.data)
+            view = self._contents[url].append(event.data)
             position = len(self._contents[url])
+            if timing is not None:
+                timing.on_chunk(t, len(event.data))
 
             for listener in self.listeners:
-                await listener.on_bytes_transferred(len(event.data), url, position, size, event.data)
+                await listener.on_bytes_transferred(len(event.data), url, position, size, view, timestamp_ns=t)
 
             if url in self._partially_accepted_urls:
                 return
 
             if size == position:
+                if timing is not None:
+                    timing.on_end(t)
                 self._completed_urls.add(url)
                 if url in self._waiting_urls:
                     self._waiting_urls[url].set()
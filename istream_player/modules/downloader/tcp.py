@@ -1,22 +1,25 @@
 import asyncio
 import logging
-import ssl
-from typing import Optional, Tuple
-
-import aiohttp
+from typing import Dict, Optional, Tuple
 
 from istream_player.config.config import PlayerConfig
-from istream_player.core.downloader import DownloadManager, DownloadRequest
+from istream_player.core.downloader import (DownloadManager, DownloadRequest,
+                                            DownloadResponse, DownloadType)
 from istream_player.core.module import Module, ModuleOption
+from istream_player.modules.downloader.pooled import get_connection_pool
 from istream_player.utils.async_utils import critical_task
+from istream_player.utils.segment_buffer import SegmentBuffer
+from istream_player.utils.timing import TransferTiming, TransferTimings, now_ns
 
 
 @ModuleOption("tcp")
 class TCPClientImpl(Module, DownloadManager):
     log = logging.getLogger("TCPClientImpl")
 
-    def __init__(self):
+    def __init__(self, *, discard_body: str = "false"):
         super().__init__()
+        # Only count the received bytes of segments, without keeping them
+        self.discard_body = discard_body.lower() == "true"
         self._download_queue: asyncio.Queue[DownloadRequest] = asyncio.Queue()
         self._session = None
         self._session_close_event = asyncio.Event()
@@ -29,21 +32,25 @@ class TCPClientImpl(Module, DownloadManager):
         self._cancelled_urls = set()
 
         self._headers = {}
-        self._content = {}
+        self._content: Dict[str, SegmentBuffer] = {}
+        self._responses: Dict[str, DownloadResponse] = {}
+        self._timings = TransferTimings()
 
         self._waiting_urls = {}
 
     async def setup(self, config: PlayerConfig, **kwargs):
         self.ssl_keylog_file = config.ssl_keylog_file
+        self.local_addr = config.local_addr
 
     async def cleanup(self) -> None:
         await self.close()
 
-    async def wait_complete(self, url: str) -> Optional[Tuple[bytes, int]]:
+    async def wait_complete(self, url: str) -> Optional[Tuple[memoryview, int]]:
         # If url is in partially accepted set, return read bytes and length
         if url in self._partially_accepted_urls:
-            content = self._content[url]
-            return bytes(content), int(self._headers[url]["CONTENT-LENGTH"])
+            self._partially_accepted_urls.remove(url)
+            content = self._content.pop(url)
+            return content.view(), int(self._headers.pop(url)["CONTENT-LENGTH"])
         # If the url has been dropped, return None
         if url in self._cancelled_urls:
             return None
@@ -58,9 +65,15 @@ class TCPClientImpl(Module, DownloadManager):
             return None
         if url in self._completed_urls:
             self._completed_urls.remove(url)
-        content = self._content[url]
-        size = int(self._headers[url]["Content-Length"])
-        return bytes(content), size
+        content = self._content.pop(url)
+        size = int(self._headers.pop(url).get("Content-Length", len(content)))
+        return content.view(), size
+
+    def get_response(self, url: str) -> Optional[DownloadResponse]:
+        return self._responses.get(url)
+
+    def get_timing(self, url: str) -> Optional[TransferTiming]:
+        return self._timings.get(url)
 
     def cancel_read_url(self, url: str):
         return
@@ -72,10 +85,10 @@ class TCPClientImpl(Module, DownloadManager):
     def is_busy(self):
         return self._is_busy
 
-    async def download(self, request: DownloadRequest, save: bool = False) -> Optional[bytes]:
+    async def download(self, request: DownloadRequest, save: bool = False) -> Optional[memoryview]:
         url = request.url
         self._waiting_urls[url] = asyncio.Event()
-        self._content[url] = bytearray()
+        self._content[url] = SegmentBuffer(discard=self.discard_body and request.req_type != DownloadType.MPD)
         if self._session is None:
             session_start_event = asyncio.Event()
             asyncio.create_task(self._create_session(session_start_event))
@@ -90,22 +103,32 @@ class TCPClientImpl(Module, DownloadManager):
     async def _download_inner(self, request: DownloadRequest):
         assert self._session is not None
         url = request.url
+        timing = self._timings.start(url)
         async with self._session.get(url, headers=request.headers) as resp:
+            timing.on_headers(now_ns())
             self._downloading_task_resp = resp
             self._headers[url] = dict(resp.headers)
+            if request.req_type == DownloadType.MPD:
+                self._responses[url] = DownloadResponse(resp.status, dict(resp.headers))
             try:
-                size = int(resp.headers["CONTENT-LENGTH"])
+                # A 304 Not Modified has no body
+                size = 0 if resp.status == 304 else int(resp.headers["CONTENT-LENGTH"])
             except KeyError:
                 self.log.info(resp.headers)
                 self.log.info(await resp.content.read())
                 exit(1)
+            content = SegmentBuffer(size, discard=self._content[url].discard)
+            self._content[url] = content
             async for chunk in resp.content.iter_any():
-                self._content[url] += bytearray(chunk)
+                t = now_ns()
+                timing.on_chunk(t, len(chunk))
+                view = content.append(chunk)
                 self.log.info(
-                    f"Bytes transferred: length: {len(chunk)}, position: {len(self._content[url])}, size: {size}, url: {url}"
+                    f"Bytes transferred: length: {len(chunk)}, position: {content.position}, size: {size}, url: {url}"
                 )
                 for listener in self.listeners:
-                    await listener.on_bytes_transferred(len(chunk), url, len(self._content[url]), size, chunk)
+                    await listener.on_bytes_transferred(len(chunk), url, content.position, size, view, timestamp_ns=t)
+        timing.on_end(now_ns())
         self.log.info(f"Transfer ends: {len(self._content[url])}")
         self._completed_urls.add(url)
         self._waiting_urls[url].set()
@@ -121,20 +144,20 @@ class TCPClientImpl(Module, DownloadManager):
             self._downloading_task = asyncio.create_task(self._download_inner(req_url))
 
     async def _create_session(self, session_start_event):
-        ssl_context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_CLIENT, verify_mode=ssl.CERT_NONE)
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        # ssl_context.keylog_filename = self.ssl_keylog_file
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
-            self._session = session
-            session_start_event.set()
-            task = asyncio.create_task(self._download_task())
-            await self._session_close_event.wait()
-            task.cancel()
+        # The keep-alive connections of the process wide pool are reused by the next sessions. The limits are the
+        # defaults of aiohttp, one request at a time is sent anyway.
+        self._session = get_connection_pool(100, 0, 15.0, self.local_addr)
+        session_start_event.set()
+        task = asyncio.create_task(self._download_task())
+        await self._session_close_event.wait()
+        task.cancel()
 
     async def close(self):
         if self._session_close_event is not None:
             self._session_close_event.set()
+        # The session is shared, the transfer in flight is not closed with it
+        if self._downloading_task is not None and not self._downloading_task.done():
+            self._downloading_task.cancel()
 
     async def stop(self, url: str):
         self.log.info("STOP DOWNLOADING: " + url)
@@ -149,4 +172,4 @@ class TCPClientImpl(Module, DownloadManager):
         self._partially_accepted_urls.add(url)
         self._waiting_urls[url].set()
         for listener in self.listeners:
-            await listener.on_transfer_end(len(self._content), url)
+            await listener.on_transfer_end(len(self._content[url]), url)
@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import os
+import pickle
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from istream_player.models.mpd_objects import MPD
+
+
+@dataclass
+class CachedMPD:
+    url: str
+
+    # Conditional request headers (If-None-Match / If-Modified-Since) of the cached response
+    validators: Dict[str, str] = field(default_factory=dict)
+
+    # SHA-1 of the MPD body, to validate the entry when the downloader does not report the response headers
+    digest: str = ""
+
+    mpd: Optional[MPD] = None
+
+
+class MPDCache(object):
+    """
+    Parsed static MPDs by URL, shared by all the players of the process.
+    The players only use an entry after the server confirmed it: a 304 answer to its validators, or the same body.
+    With a directory, the entries are also stored there as pickle files, so they survive the process.
+    """
+
+    log = logging.getLogger("MPDCache")
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._entries: Dict[str, CachedMPD] = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def digest(content: bytes) -> str:
+        return hashlib.sha1(content).hexdigest()
+
+    def _path(self, url: str) -> str:
+        assert self.directory is not None
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".pickle")
+
+    def get(self, url: str) -> Optional[CachedMPD]:
+        entry = self._entries.get(url)
+        if entry is not None or self.directory is None:
+            return entry
+        try:
+            with open(self._path(url), "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.log.warning(f"Ignoring unreadable MPD cache entry of {url}: {e}")
+            return None
+        if not isinstance(entry, CachedMPD) or entry.url != url:
+            return None
+        self._entries[url] = entry
+        return entry
+
+    def put(self, entry: CachedMPD):
+        self._entries[entry.url] = entry
+        if self.directory is None:
+            return
+        path = self._path(entry.url)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_caches: Dict[Optional[str], MPDCache] = {}
+
+
+def get_mpd_cache(directory: Optional[str] = None) -> MPDCache:
+    """Return the process wide MPD cache, persisted to the directory if one is given"""
+    cache = _caches.get(directory)
+    if cache is None:
+        cache = _caches[directory] = MPDCache(directory)
+    return cache
@@ -1,35 +1,63 @@
+import asyncio
 import logging
 import time
 from asyncio import Task
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Set
 
 from istream_player.config.config import PlayerConfig
-from istream_player.core.downloader import (DownloadManager, DownloadRequest,
-                                            DownloadType)
+from istream_player.core.downloader import (DownloadEventListener,
+                                            DownloadManager, DownloadRequest,
+                                            DownloadResponse, DownloadType)
 from istream_player.core.module import Module, ModuleOption
 from istream_player.core.mpd_provider import MPDProvider
-from istream_player.models.mpd_objects import MPD, Segment
-from istream_player.modules.mpd.parser import DefaultMPDParser
+from istream_player.models.mpd_objects import MPD, Segment, SegmentSequence
+from istream_player.modules.mpd.cache import CachedMPD, MPDCache, get_mpd_cache
+from istream_player.modules.mpd.parser import (DefaultMPDParser,
+                                               StreamingMPDParser)
 from istream_player.utils.async_utils import AsyncResource, critical_task
 
 
 @ModuleOption("mpd", default=True, requires=["mpd_downloader"])
-class MPDProviderImpl(Module, MPDProvider):
+class MPDProviderImpl(Module, MPDProvider, DownloadEventListener):
     log = logging.getLogger("MPDProviderImpl")
 
-    def __init__(self):
-        self.parser = DefaultMPDParser()
+    def __init__(self, *, parser: str = "default", cache: str = "false", cache_dir: str = ""):
+        super().__init__()
+        # Static MPDs parsed by the previous players of the process (and of previous processes with cache_dir)
+        self.cache: Optional[MPDCache] = None
+        if cache.lower() == "true" or cache_dir != "":
+            self.cache = get_mpd_cache(cache_dir or None)
+        # "stream" parses the MPD while it downloads, and publishes the adaptation sets as soon as they are parsed
+        if parser == "stream":
+            self.parser: DefaultMPDParser = StreamingMPDParser()
+        elif parser == "default":
+            self.parser = DefaultMPDParser()
+        else:
+            raise ValueError(f"Unknown MPD parser {parser}, use 'default' or 'stream'")
+        # Number of bytes of the current MPD download fed to the streaming parser
+        self._stream_position: Optional[int] = None
         self.last_updated = 0
+        self._notified_last_segment = -1
 
         self._mpd_res: AsyncResource[Optional[MPD]] = AsyncResource(None)
-        self._segments_by_url: Dict[str, Optional[Segment]] = {}
+        # Segment URLs are resolved by parsing them against the media templates, instead of a dict of all the URLs
+        self._init_urls: Set[str] = set()
+        # Media URL suffix -> prefix -> sequences using this template
+        self._sequences_by_affix: Dict[str, Dict[str, List[SegmentSequence]]] = {}
         self._task: Optional[Task] = None
+        self._update_lock = asyncio.Lock()
+        # Conditional request headers built from the validators of the last MPD response
+        self._validators: Dict[str, str] = {}
+        # Notified when an update extends the segment range of the MPD, or makes it static
+        self._range_cond = asyncio.Condition()
         # self._repr_quality: Dict[int, int] = {}
 
     async def setup(self, config: PlayerConfig, mpd_downloader: DownloadManager, **kwargs):
         self.update_interval = config.static.update_interval
         self.download_manager = mpd_downloader
         self.mpd_url = config.input
+        if isinstance(self.parser, StreamingMPDParser):
+            mpd_downloader.add_listener(self)
 
     @property
     def mpd(self) -> Optional[MPD]:
@@ -44,32 +72,150 @@ class MPDProviderImpl(Module, MPDProvider):
         return value
 
     def segment_by_url(self, url: str) -> Optional[Segment]:
-        return self._segments_by_url[url]
+        if url in self._init_urls:
+            return None
+        # Template URLs are <prefix><digits><suffix>: strip the suffix, then the digits, to find the template
+        for suffix, by_prefix in self._sequences_by_affix.items():
+            if not url.endswith(suffix):
+                continue
+            prefix = url[: len(url) - len(suffix)].rstrip("0123456789")
+            for sequence in by_prefix.get(prefix, ()):
+                segment = sequence.segment_by_url(url)
+                if segment is not None:
+                    return segment
+        # Templates with a prefix ending with digits
+        for by_prefix in self._sequences_by_affix.values():
+            for sequences in by_prefix.values():
+                for sequence in sequences:
+                    segment = sequence.segment_by_url(url)
+                    if segment is not None:
+                        return segment
+        raise KeyError(url)
+
+    async def wait_for_segment(self, index: int) -> MPD:
+        mpd = await self.available()
+        if mpd.type == "dynamic" and self._task is None:
+            self._task = asyncio.create_task(self.update_repeatedly())
+        async with self._range_cond:
+            await self._range_cond.wait_for(
+                lambda: self.mpd is not None and (self.mpd.type != "dynamic" or self.mpd.last_segment >= index)
+            )
+        return await self.available()
+
+    @property
+    def refresh_interval(self) -> float:
+        """Minimum time between two MPD downloads, the minimumUpdatePeriod of the MPD if it has one"""
+        if self.mpd is not None and self.mpd.minimum_update_period > 0:
+            return self.mpd.minimum_update_period
+        return self.update_interval
+
+    @staticmethod
+    def conditional_headers(response: Optional[DownloadResponse]) -> Dict[str, str]:
+        if response is None:
+            return {}
+        headers = {}
+        etag = response.header("ETag")
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        last_modified = response.header("Last-Modified")
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+        return headers
 
     @critical_task()
     async def update(self):
-        if self.mpd is not None and (time.time() - self.last_updated) < self.update_interval:
-            return
-        await self.download_manager.download(DownloadRequest(self.mpd_url, DownloadType.MPD), save=True)
-        content, size = await self.download_manager.wait_complete(self.mpd_url)
-        text = content.decode("utf-8")
-        mpd = self.parser.parse(text, url=self.mpd_url)
+        async with self._update_lock:
+            if self.mpd is not None and (time.time() - self.last_updated) < self.refresh_interval:
+                return
+            # Refreshes of a live MPD are conditional, an unchanged MPD costs a 304 without body
+            cached = self.cache.get(self.mpd_url) if self.cache is not None and self.mpd is None else None
+            if self.mpd is not None:
+                headers = self._validators
+            elif cached is not None:
+                headers = cached.validators
+            else:
+                headers = {}
+            streaming = isinstance(self.parser, StreamingMPDParser)
+            if streaming:
+                self.parser.reset(self.mpd_url)
+                self._stream_position = 0
+            await self.download_manager.download(DownloadRequest(self.mpd_url, DownloadType.MPD, dict(headers)), save=True)
+            content, size = await self.download_manager.wait_complete(self.mpd_url)
+            if streaming:
+                # Downloaders which do not report the bytes as they arrive
+                if self._stream_position < len(content):
+                    await self.feed_parser(content[self._stream_position:])
+                self._stream_position = None
+            self.last_updated = time.time()
+            response = self.download_manager.get_response(self.mpd_url)
+            not_modified = response is not None and response.status == 304
+            if not_modified and self.mpd is not None:
+                self.log.debug("MPD not modified")
+                return
+            digest = MPDCache.digest(content) if self.cache is not None and not not_modified else ""
+
+            if cached is not None and (not_modified or digest == cached.digest):
+                self.log.info(f"Using the cached MPD of {self.mpd_url}")
+                assert cached.mpd is not None
+                new_mpd = cached.mpd
+                self._validators = cached.validators
+            else:
+                self._validators = self.conditional_headers(response)
+                if streaming:
+                    new_mpd = self.parser.close()
+                else:
+                    text = str(content, "utf-8")
+                    new_mpd = self.parser.parse(text, url=self.mpd_url)
+                # Dynamic MPDs are modified in place by the refreshes, they are not shared
+                if self.cache is not None and new_mpd.type == "static":
+                    self.cache.put(CachedMPD(self.mpd_url, self._validators, digest, new_mpd))
+            # Only the new segments are merged into the current model, unless its structure changed
+            if self.mpd is not None and self.mpd.merge(new_mpd):
+                mpd = self.mpd
+            else:
+                mpd = new_mpd
+                self.set_mpd(mpd)
+
+        if mpd.type != "dynamic" or mpd.last_segment > self._notified_last_segment:
+            self._notified_last_segment = mpd.last_segment
+            async with self._range_cond:
+                self._range_cond.notify_all()
+
+    async def on_bytes_transferred(
+        self, length: int, url: str, position: int, size: int, content: bytes, timestamp_ns: Optional[int] = None
+    ) -> None:
+        if url == self.mpd_url and self._stream_position is not None:
+            await self.feed_parser(content)
+
+    async def feed_parser(self, data: bytes):
+        assert isinstance(self.parser, StreamingMPDParser) and self._stream_position is not None
+        self._stream_position += len(data)
+        adaptation_sets = self.parser.feed(data)
+        # Adaptation sets are only published before the first MPD is available
+        if self.mpd is None:
+            for adaptation_set in adaptation_sets:
+                for listener in self.listeners:
+                    await listener.on_adaptation_set_parsed(adaptation_set)
+
+    def set_mpd(self, mpd: MPD):
         self._mpd_res.value = mpd
+        self._init_urls = set()
+        self._sequences_by_affix = {}
         for adap_set in mpd.adaptation_sets.values():
             for repr in adap_set.representations.values():
-                for seg in repr.segments.values():
-                    self._segments_by_url[seg.url] = seg
-                    self._segments_by_url[seg.init_url] = None
-
-        self.last_updated = time.time()
-
-    # @critical_task()
-    # async def update_repeatedly(self):
-    #     assert self._mpd is not None
-    #     while self._mpd.type == "dynamic":
-    #         await self.update()
-    #         await asyncio.sleep(self.update_interval)
-    #     self.log.info(f"MPD file changed from dynamic to {self._mpd.type}")
+                self._init_urls.add(repr.initialization)
+                if isinstance(repr.segments, SegmentSequence):
+                    template = repr.segments.url_template
+                    by_prefix = self._sequences_by_affix.setdefault(template.suffix, {})
+                    by_prefix.setdefault(template.prefix, []).append(repr.segments)
+
+    @critical_task()
+    async def update_repeatedly(self):
+        assert self.mpd is not None
+        while self.mpd.type == "dynamic":
+            await asyncio.sleep(self.refresh_interval)
+            await self.update()
+        self.log.info(f"MPD file changed from dynamic to {self.mpd.type}")
 
     async def run(self):
         assert self.mpd_url is not None
@@ -3,11 +3,12 @@ import os
 import re
 from abc import ABC, abstractmethod
 from math import ceil
-from typing import Dict, Optional
+from typing import Dict, List, Literal, Optional, Tuple, Union
 from xml.etree import ElementTree
-from xml.etree.ElementTree import Element
+from xml.etree.ElementTree import Element, XMLPullParser
 
-from istream_player.models.mpd_objects import MPD, AdaptationSet, Representation, Segment
+from istream_player.models.mpd_objects import (MPD, AdaptationSet, Representation, SegmentSequence,
+                                               SegmentUrlTemplate, TemplateSegments, TimelineSegments)
 
 
 class MPDParsingException(BaseException):
@@ -44,27 +45,18 @@ class DefaultMPDParser(MPDParser):
         """
         Remove the namespace string from XML string
         """
-        content = re.sub('xmlns="[^"]+"', "", content, count=1)
-        return content
+        # The default namespace is declared in the MPD tag, so the rest of the content does not need to be scanned
+        root_end = content.find(">", content.find("<MPD")) + 1
+        return re.sub('xmlns="[^"]+"', "", content[:root_end], count=1) + content[root_end:]
 
     def parse(self, content: str, url: str) -> MPD:
         content = self.remove_namespace_from_content(content)
         root = ElementTree.fromstring(content)
 
-        type_ = root.attrib["type"]
-        assert type_ == "static" or type_ == "dynamic"
-
-        # media presentation duration
-        media_presentation_duration = self.parse_iso8601_time(root.attrib.get("mediaPresentationDuration", ""))
-        self.log.info(f"{media_presentation_duration=}")
-
-        # min buffer duration
-        min_buffer_time = self.parse_iso8601_time(root.attrib.get("minBufferTime", ""))
-        self.log.info(f"{min_buffer_time=}")
-
-        # max segment duration
-        max_segment_duration = self.parse_iso8601_time(root.attrib.get("maxSegmentDuration", ""))
-        self.log.info(f"{max_segment_duration=}")
+        type_ = self.parse_type(root.attrib)
+        media_presentation_duration, max_segment_duration, min_buffer_time, minimum_update_period = self.parse_times(
+            root.attrib
+        )
 
         period = root.find("Period")
 
@@ -76,14 +68,63 @@ class DefaultMPDParser(MPDParser):
         base_url = os.path.dirname(url) + "/"
 
         for index, adaptation_set_xml in enumerate(period):
-            content_type = adaptation_set_xml.attrib.get("contentType", "video").lower()
-            if content_type in ["video", "pointcloud"]:
-                adaptation_set: AdaptationSet = self.parse_adaptation_set(
-                    adaptation_set_xml, base_url, index, media_presentation_duration
-                )
+            adaptation_set = self.parse_period_child(adaptation_set_xml, base_url, index, media_presentation_duration)
+            if adaptation_set is not None:
                 adaptation_sets[adaptation_set.id] = adaptation_set
 
-        return MPD(content, url, type_, media_presentation_duration, max_segment_duration, min_buffer_time, adaptation_sets, root.attrib)
+        return MPD(
+            content,
+            url,
+            type_,
+            media_presentation_duration,
+            max_segment_duration,
+            min_buffer_time,
+            adaptation_sets,
+            root.attrib,
+            minimum_update_period=minimum_update_period,
+        )
+
+    @staticmethod
+    def parse_type(attrib: Dict[str, str]) -> Literal["static", "dynamic"]:
+        type_ = attrib["type"]
+        assert type_ == "static" or type_ == "dynamic"
+        return type_
+
+    def parse_times(self, attrib: Dict[str, str]) -> Tuple[float, float, float, float]:
+        """
+        Parse the times of the MPD tag
+
+        Returns
+        -------
+        times: Tuple[float, float, float, float]
+            Media presentation duration, max segment duration, min buffer time and minimum update period in seconds
+        """
+        # media presentation duration
+        media_presentation_duration = self.parse_iso8601_time(attrib.get("mediaPresentationDuration", ""))
+        self.log.info(f"{media_presentation_duration=}")
+
+        # min buffer duration
+        min_buffer_time = self.parse_iso8601_time(attrib.get("minBufferTime", ""))
+        self.log.info(f"{min_buffer_time=}")
+
+        # max segment duration
+        max_segment_duration = self.parse_iso8601_time(attrib.get("maxSegmentDuration", ""))
+        self.log.info(f"{max_segment_duration=}")
+
+        # minimum update period of dynamic MPDs
+        minimum_update_period = self.parse_iso8601_time(attrib.get("minimumUpdatePeriod", ""))
+        self.log.info(f"{minimum_update_period=}")
+
+        return media_presentation_duration, max_segment_duration, min_buffer_time, minimum_update_period
+
+    def parse_period_child(
+        self, tree: Element, base_url, index: int, media_presentation_duration: float
+    ) -> Optional[AdaptationSet]:
+        """Parse one child of the Period tag. None if it is not a supported adaptation set"""
+        content_type = tree.attrib.get("contentType", "video").lower()
+        if content_type in ["video", "pointcloud"]:
+            return self.parse_adaptation_set(tree, base_url, index, media_presentation_duration)
+        return None
 
     def parse_adaptation_set(
         self, tree: Element, base_url, index: Optional[int], media_presentation_duration: float
@@ -175,44 +216,27 @@ class DefaultMPDParser(MPDParser):
         initialization = segment_template.attrib["initialization"]
         initialization = initialization.replace("$RepresentationID$", id_)
         initialization = full_base_url + initialization
-        segments: Dict[int, Segment] = {}
-
         timescale = int(segment_template.attrib["timescale"])
         media = segment_template.attrib["media"].replace("$RepresentationID$", id_)
         start_number = int(segment_template.attrib["startNumber"])
+        url_template = SegmentUrlTemplate(full_base_url + media)
 
+        # Segments are computed on demand from the template, instead of one Segment object per number
+        segments: SegmentSequence
         segment_timeline = segment_template.find("SegmentTimeline")
         if segment_timeline is not None:
-            num = start_number
-            start_time = 0
+            segments = TimelineSegments(url_template, initialization, as_id, int(id_), start_number)
             for segment in segment_timeline:
                 duration = float(segment.attrib["d"]) / timescale
-                url = full_base_url + re.sub(r"\$Number(%\d+d)\$", r"\1", media) % num
-                if "t" in segment.attrib:
-                    start_time = float(segment.attrib["t"]) / timescale
-                segments[num] = Segment(url, initialization, duration, start_time, as_id, int(id_))
-                num += 1
-                start_time += duration
-
-                if "r" in segment.attrib:  # repeat
-                    for _ in range(int(segment.attrib["r"])):
-                        url = full_base_url + self.var_repl(media, {"Number": num})
-                        segments[num] = Segment(url, initialization, duration, start_time, as_id, int(id_))
-                        num += 1
-                        start_time += duration
+                start_time = float(segment.attrib["t"]) / timescale if "t" in segment.attrib else None
+                # Each S element is one segment, plus r repetitions
+                segments.add_run(start_time, duration, 1 + max(int(segment.attrib.get("r", 0)), 0))
         else:
             # GPAC DASH format
-            num = start_number
-            start_time = 0
             num_segments = ceil((media_presentation_duration * timescale) / int(segment_template.attrib["duration"]))
             duration = float(segment_template.attrib["duration"]) / timescale
             self.log.debug(f"{num_segments=}, {duration=}")
-            for _ in range(num_segments):
-                url = full_base_url + self.var_repl(media, {"Number": num})
-                segments[num] = Segment(url, initialization, duration, start_time, as_id, int(id_))
-                num += 1
-                start_time += duration
-            # self.log.debug(segments)
+            segments = TemplateSegments(url_template, initialization, as_id, int(id_), start_number, num_segments, duration)
 
         if is_pointcloud:
             return Representation(int(id_), mime, codec, bandwidth, x_pos, y_pos, initialization, segments, tree.attrib,
@@ -232,4 +256,104 @@ class DefaultMPDParser(MPDParser):
             else:
                 raise Exception(f"Cannot replace {m} in {s}")
 
-        return re.sub(r"\$.*\$", _repl, s)
\ No newline at end of file
+        return re.sub(r"\$.*\$", _repl, s)
+
+
+class StreamingMPDParser(DefaultMPDParser):
+    """
+    Parse an MPD incrementally, from the chunks of its download.
+    Namespaces are removed from the tags as they are parsed, and each adaptation set is built as soon as its
+    end tag is received, then dropped from the element tree.
+
+    Usage: reset(url), feed(chunk) for every chunk, then close() to get the MPD.
+    """
+
+    log = logging.getLogger("StreamingMPDParser")
+
+    def __init__(self):
+        self.reset("")
+
+    def reset(self, url: str):
+        """Start parsing a new MPD"""
+        self.url = url
+        self.base_url = os.path.dirname(url) + "/"
+        self._pull_parser = XMLPullParser(events=("start", "end"))
+        self._chunks: List[bytes] = []
+        # Open elements, from the root to the current one
+        self._stack: List[Element] = []
+        self._root_attrib: Optional[Dict[str, str]] = None
+        self._times: Tuple[float, float, float, float] = (0, 0, 0, 0)
+        self._period: Optional[Element] = None
+        self._period_index = 0
+        self.adaptation_sets: Dict[int, AdaptationSet] = {}
+
+    def feed(self, data: Union[bytes, memoryview]) -> List[AdaptationSet]:
+        """
+        Parse a chunk of the MPD
+
+        Returns
+        -------
+        adaptation_sets: List[AdaptationSet]
+            The adaptation sets completed by this chunk
+        """
+        data = bytes(data)
+        self._chunks.append(data)
+        self._pull_parser.feed(data)
+        return self._read_events()
+
+    def close(self) -> MPD:
+        """Finish parsing and return the MPD"""
+        self._pull_parser.close()
+        self._read_events()
+        if self._root_attrib is None:
+            raise MPDParsingException('Cannot find "MPD" tag')
+        if self._period is None:
+            raise MPDParsingException('Cannot find "Period" tag')
+
+        media_presentation_duration, max_segment_duration, min_buffer_time, minimum_update_period = self._times
+        return MPD(
+            str(b"".join(self._chunks), "utf-8"),
+            self.url,
+            self.parse_type(self._root_attrib),
+            media_presentation_duration,
+            max_segment_duration,
+            min_buffer_time,
+            self.adaptation_sets,
+            self._root_attrib,
+            minimum_update_period=minimum_update_period,
+        )
+
+    def parse(self, content: str, url: str) -> MPD:
+        self.reset(url)
+        self.feed(content.encode("utf-8"))
+        return self.close()
+
+    def _read_events(self) -> List[AdaptationSet]:
+        parsed = []
+        for event, element in self._pull_parser.read_events():
+            if event == "start":
+                self._stack.append(element)
+                if len(self._stack) == 1:
+                    self._root_attrib = dict(element.attrib)
+                    self._times = self.parse_times(self._root_attrib)
+                elif len(self._stack) == 2 and self._period is None and self._local_name(element) == "Period":
+                    self._period = element
+                continue
+
+            self._stack.pop()
+            element.tag = self._local_name(element)
+            # Children of the first Period. Their descendants have already been renamed
+            if len(self._stack) == 2 and self._stack[-1] is self._period:
+                adaptation_set = self.parse_period_child(
+                    element, self.base_url, self._period_index, self._times[0]
+                )
+                self._period_index += 1
+                self._period.remove(element)
+                if adaptation_set is not None:
+                    self.adaptation_sets[adaptation_set.id] = adaptation_set
+                    parsed.append(adaptation_set)
+        return parsed
+
+    @staticmethod
+    def _local_name(element: Element) -> str:
+        return element.tag.rpartition("}")[2]
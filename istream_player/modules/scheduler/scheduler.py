@@ -1,41 +1,93 @@
 import asyncio
-import itertools
 import logging
 from asyncio import Task
-from typing import Dict, Optional, Set
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Set
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.abr import ABRController
 from istream_player.core.buffer import BufferManager
 from istream_player.core.bw_meter import BandwidthMeter
-from istream_player.core.downloader import (DownloadManager, DownloadRequest,
+from istream_player.core.downloader import (DownloadEventListener,
+                                            DownloadManager, DownloadRequest,
                                             DownloadType)
 from istream_player.core.module import Module, ModuleOption
-from istream_player.core.mpd_provider import MPDProvider
+from istream_player.core.mpd_provider import MPDEventListener, MPDProvider
 from istream_player.core.scheduler import Scheduler, SchedulerEventListener
-from istream_player.models import AdaptationSet
+from istream_player.models import MPD, AdaptationSet
+from istream_player.models.mpd_objects import Representation, Segment, merge_segment_ranges
 from istream_player.utils import critical_task
 
 
+@dataclass
+class InFlightIndex:
+    # Segment index
+    index: int
+
+    # Map of adaptation set ID to selected representation ID
+    selections: Dict[int, int]
+
+    # Map of adaptation set ID to requested segment
+    segments: Dict[int, Segment]
+
+    # Task fetching all the segments of this index in fan-out mode. Resolves to the wait_complete results
+    fanout_task: Optional[asyncio.Future] = None
+
+    # Bandwidth estimate the selections were made with
+    bandwidth: float = 0
+
+    @property
+    def urls(self) -> List[str]:
+        return [segment.url for segment in self.segments.values()]
+
+    @property
+    def duration(self) -> float:
+        return max(segment.duration for segment in self.segments.values())
+
+
 @ModuleOption(
     "scheduler", default=True, requires=["segment_downloader", BandwidthMeter, BufferManager, MPDProvider, ABRController]
 )
-class SchedulerImpl(Module, Scheduler):
+class SchedulerImpl(Module, Scheduler, MPDEventListener, DownloadEventListener):
     log = logging.getLogger("SchedulerImpl")
 
-    def __init__(self):
+    def __init__(self, *, pipeline_depth: str = "1", fanout: str = "0"):
         super().__init__()
 
         self.adaptation_sets: Optional[Dict[int, AdaptationSet]] = None
+        # MPD the adaptation sets were selected from, and their first and last segment numbers
+        self._mpd: Optional[MPD] = None
+        self._mpd_version = -1
+        self._segment_range = (0, -1)
         self.started = False
 
+        # Maximum number of segment indices requested but not yet enqueued to the buffer
+        self.pipeline_depth = int(pipeline_depth)
+        assert self.pipeline_depth >= 1, "pipeline_depth should be at least 1"
+
+        # Maximum number of concurrent adaptation set transfers per index. 0 requests them one by one
+        self.fanout = int(fanout)
+        assert self.fanout >= 0, "fanout should be a non-negative integer"
+
         self._task: Optional[Task] = None
+        # Next index to be enqueued to the buffer (oldest in-flight index)
         self._index = 0
+        # Next index to be requested
+        self._next_index = 0
+        self._in_flight: Deque[InFlightIndex] = deque()
         self._representation_initialized: Set[str] = set()
-        self._current_selections: Optional[Dict[int, int]] = None
+        self._pending_initializations: Dict[str, asyncio.Event] = {}
+        self._prefetch_tasks: Set[asyncio.Task] = set()
+        # Segment URLs requested one by one, and the ones which have received bytes
+        self._requested_urls: Set[str] = set()
+        self._started_urls: Set[str] = set()
 
         self._end = False
+        self._segments_ended = False
         self._dropped_index = None
+        # Index beyond the last segment of a dynamic MPD, waiting for an MPD update
+        self._waiting_index: Optional[int] = None
 
     async def setup(
         self,
@@ -47,14 +99,14 @@ class SchedulerImpl(Module, Scheduler):
         abr_controller: ABRController,
     ):
         self.max_buffer_duration = config.buffer_duration
-        self.update_interval = config.static.update_interval
-        self.time_factor = config.time_factor
 
         self.download_manager = segment_downloader
         self.bandwidth_meter = bandwidth_meter
         self.buffer_manager = buffer_manager
         self.abr_controller = abr_controller
         self.mpd_provider = mpd_provider
+        mpd_provider.add_listener(self)
+        segment_downloader.add_listener(self)
 
         select_as = config.select_as.split("-")
         if len(select_as) == 1 and select_as[0].isdecimal():
@@ -71,109 +123,309 @@ class SchedulerImpl(Module, Scheduler):
             raise Exception("select_as should be of the format '<uint>-<uint>' or '<uint>'.")
 
     def segment_limits(self, adap_sets: Dict[int, AdaptationSet]) -> tuple[int, int]:
-        ids = [
-            [[seg_id for seg_id in repr.segments.keys()] for repr in as_val.representations.values()]
-            for as_val in adap_sets.values()
-        ]
-        ids = itertools.chain(*ids)
-        ids = list(itertools.chain(*ids))
-        # print(adap_sets, ids)
-        return min(ids), max(ids)
+        return merge_segment_ranges((as_val.first_segment, as_val.last_segment) for as_val in adap_sets.values())
+
+    def update_adaptation_sets(self, mpd: MPD):
+        """Select the adaptation sets of a new or updated MPD and cache their segment limits"""
+        if mpd is self._mpd and mpd.version == self._mpd_version:
+            return
+        self._mpd, self._mpd_version = mpd, mpd.version
+        self.adaptation_sets = self.select_adaptation_sets(mpd.adaptation_sets)
+        self._segment_range = self.segment_limits(self.adaptation_sets)
+
+    @property
+    def in_flight_duration(self) -> float:
+        """Playback duration of all the segments requested but not yet enqueued to the buffer"""
+        return sum(entry.duration for entry in self._in_flight)
+
+    def has_headroom(self) -> bool:
+        """True if the buffer can take one more index on top of the ones already in flight"""
+        return self.buffer_manager.buffer_level + self.in_flight_duration <= self.max_buffer_duration
 
     @critical_task()
     async def run(self):
         await self.mpd_provider.available()
         assert self.mpd_provider.mpd is not None
-        self.adaptation_sets = self.select_adaptation_sets(self.mpd_provider.mpd.adaptation_sets)
-        # print(f"{self.adaptation_sets=}")
+        self.update_adaptation_sets(self.mpd_provider.mpd)
 
         # Start from the min segment index  --old
-        self._index = self.segment_limits(self.adaptation_sets)[0]
-        
+        self._index = self._next_index = self._segment_range[0]
+
         while True:
-            # Check buffer level
-            if self.buffer_manager.buffer_level > self.max_buffer_duration:
-                await asyncio.sleep(self.time_factor * self.update_interval)
+            # Keep up to pipeline_depth indices in flight while the buffer has room for them
+            while not self._segments_ended and len(self._in_flight) < self.pipeline_depth and self.has_headroom():
+                if not await self.request_next_index():
+                    break
+            await self.revise_queued_indices()
+
+            if len(self._in_flight) == 0:
+                if self._segments_ended:
+                    self._end = True
+                    return
+                if self._waiting_index is not None:
+                    # The MPD has no new segments yet
+                    self.update_adaptation_sets(await self.mpd_provider.wait_for_segment(self._waiting_index))
+                    self._waiting_index = None
+                    continue
+                # Buffer is full. Resume as soon as the player dequeues enough for the next index
+                async with self.buffer_manager.buffer_change_cond:
+                    await self.buffer_manager.buffer_change_cond.wait_for(self.has_headroom)
                 continue
 
-            assert self.mpd_provider.mpd is not None
-            if self.mpd_provider.mpd.type == "dynamic":
-                await self.mpd_provider.update()
-                self.adaptation_sets = self.select_adaptation_sets(self.mpd_provider.mpd.adaptation_sets)
+            await self.complete_oldest_index()
 
-            # last_segment = max(self.adaptation_sets[0].representations[0].segments.keys())
-            # first_segment = min(self.adaptation_sets[0].representations[0].segments.keys())
-            first_segment, last_segment = self.segment_limits(self.adaptation_sets)
-            self.log.info(f"{first_segment=}, {last_segment=}")
+    async def request_next_index(self) -> bool:
+        """
+        Request the segments of the next index
 
-            if self._index < first_segment:
-                self.log.info(f"Segment {self._index} not in mpd, Moving to next segment")
-                self._index += 1
-                continue
+        Returns
+        -------
+        requested: bool
+            False if the scheduler has to wait before requesting more indices, True otherwise
+        """
+        assert self.mpd_provider.mpd is not None
+        if self.mpd_provider.mpd.type == "dynamic":
+            await self.mpd_provider.update()
+            self.update_adaptation_sets(self.mpd_provider.mpd)
+
+        assert self.adaptation_sets is not None
+        first_segment, last_segment = self._segment_range
+        self.log.info(f"{first_segment=}, {last_segment=}")
 
-            if self.mpd_provider.mpd.type == "dynamic" and self._index > last_segment:
-                self.log.info(f"Waiting for more segments in mpd : {self.mpd_provider.mpd.type}")
-                await asyncio.sleep(self.time_factor * self.update_interval)
+        if self._next_index < first_segment:
+            self.log.info(f"Segment {self._next_index} not in mpd, Moving to next segment")
+            if self._next_index == self._index:
+                self._index += 1
+            self._next_index += 1
+            return True
+
+        if self.mpd_provider.mpd.type == "dynamic" and self._next_index > last_segment:
+            self.log.info(f"Waiting for more segments in mpd : {self.mpd_provider.mpd.type}")
+            self._waiting_index = self._next_index
+            return False
+
+        entry = await self.request_index(self._next_index)
+        if entry is None:
+            self._segments_ended = True
+            return False
+        self._in_flight.append(entry)
+        self._next_index += 1
+        return True
+
+    async def request_index(self, index: int) -> Optional[InFlightIndex]:
+        """
+        Select representations for one index and request one segment from each adaptation set.
+        The ABR decision is taken when the request is issued, and revised by revise_queued_indices
+        while none of its transfers has started.
+
+        Returns
+        -------
+        entry: InFlightIndex, optional
+            None if there are no more segments left
+        """
+        assert self.adaptation_sets is not None
+        # Download one segment from each adaptation set
+        if index == self._dropped_index:
+            selections = self.abr_controller.update_selection_lowest(self.adaptation_sets)
+        else:
+            selections = self.abr_controller.update_selection(self.adaptation_sets, index)
+        self.log.info(f"Downloading index {index} at {selections}")
+
+        # Get segments to download for each adaptation set
+        try:
+            segments = {
+                adaptation_set_id: self.adaptation_sets[adaptation_set_id].representations[selection].segments[index]
+                for adaptation_set_id, selection in selections.items()
+            }
+        except KeyError:
+            # No more segments left
+            self.log.info("No more segments left")
+            return None
+
+        if self.fanout > 0:
+            return await self.request_index_fanout(index, selections, segments)
+        return await self.request_segments(index, selections, segments)
+
+    async def request_segments(
+        self, index: int, selections: Dict[int, int], segments: Dict[int, Segment], requested: Set[str] = set()
+    ) -> InFlightIndex:
+        """Request the segments of one index one by one, except the URLs already requested"""
+        assert self.adaptation_sets is not None
+        # All adaptation sets take the current bandwidth
+        bandwidth = self.bandwidth_meter.bandwidth
+        adap_bw = {as_id: bandwidth for as_id in selections.keys()}
+        for listener in self.listeners:
+            await listener.on_segment_download_start(index, adap_bw, segments)
+
+        for adaptation_set_id, selection in selections.items():
+            if segments[adaptation_set_id].url in requested:
                 continue
+            representation = self.adaptation_sets[adaptation_set_id].representations[selection]
+            await self.initialize_representation(adaptation_set_id, representation)
+            self._requested_urls.add(segments[adaptation_set_id].url)
+            await self.download_manager.download(DownloadRequest(segments[adaptation_set_id].url, DownloadType.SEGMENT))
 
-            # Download one segment from each adaptation set
-            if self._index == self._dropped_index:
-                selections = self.abr_controller.update_selection_lowest(self.adaptation_sets)
-            else:
-                selections = self.abr_controller.update_selection(self.adaptation_sets, self._index)
-            self.log.info(f"Downloading index {self._index} at {selections}")
-            self._current_selections = selections
+        return InFlightIndex(index, selections, segments, bandwidth=bandwidth)
 
-            # All adaptation sets take the current bandwidth
-            adap_bw = {as_id: self.bandwidth_meter.bandwidth for as_id in selections.keys()}
+    async def revise_queued_indices(self):
+        """
+        Run the ABR again for the in-flight indices whose transfers have not received any byte yet, if the
+        bandwidth estimate changed since they were requested. The transfers of the adaptation sets whose
+        selection changed are dropped and requested again at the new representation.
 
-            # Get segments to download for each adaptation set
+        Only downloaders which can drop one URL without affecting the others support this. Fan-out indices
+        are not revised, their transfers are admitted by their own task.
+        """
+        if self.fanout > 0 or not self.download_manager.per_url_cancel or self.adaptation_sets is None:
+            return
+        bandwidth = self.bandwidth_meter.bandwidth
+        for position, entry in enumerate(self._in_flight):
+            if entry.bandwidth == bandwidth or entry.index == self._dropped_index:
+                continue
+            if any(url in self._started_urls for url in entry.urls):
+                continue
+            selections = self.abr_controller.update_selection(self.adaptation_sets, entry.index)
             try:
                 segments = {
-                    adaptation_set_id: self.adaptation_sets[adaptation_set_id].representations[selection].segments[self._index]
-                    for adaptation_set_id, selection in selections.items()
+                    as_id: self.adaptation_sets[as_id].representations[selection].segments[entry.index]
+                    for as_id, selection in selections.items()
                 }
             except KeyError:
-                # No more segments left
-                self.log.info("No more segments left")
-                self._end = True
+                continue
+            if selections == entry.selections:
+                entry.bandwidth = bandwidth
+                continue
+            self.log.info(f"Revising index {entry.index} from {entry.selections} to {selections}")
+            kept = {segment.url for segment in segments.values()}
+            for url in entry.urls:
+                if url not in kept:
+                    self._forget_urls([url])
+                    await self.download_manager.drop_url(url)
+                    # Consumes the dropped transfer
+                    await self.download_manager.wait_complete(url)
+            self._in_flight[position] = await self.request_segments(
+                entry.index, selections, segments, requested=kept & set(entry.urls)
+            )
+
+    async def request_index_fanout(self, index: int, selections: Dict[int, int], segments: Dict[int, Segment]) -> InFlightIndex:
+        """
+        Fetch the segments of all adaptation sets of one index concurrently, at most `fanout` at a time.
+
+        Each adaptation set gets a share of the bandwidth proportional to the bytes it is expected to
+        transfer. The transfers are admitted largest first, so that with a bounded concurrency the
+        adaptation sets of the index finish close together instead of the largest one finishing last.
+        """
+        assert self.adaptation_sets is not None
+        representations = {
+            as_id: self.adaptation_sets[as_id].representations[selection] for as_id, selection in selections.items()
+        }
+        budgets = {as_id: representations[as_id].bandwidth * segments[as_id].duration / 8 for as_id in selections.keys()}
+        total_budget = sum(budgets.values())
+
+        bandwidth = self.bandwidth_meter.bandwidth
+        if total_budget > 0:
+            adap_bw = {as_id: bandwidth * budget / total_budget for as_id, budget in budgets.items()}
+        else:
+            adap_bw = {as_id: bandwidth / len(budgets) for as_id in budgets.keys()}
+        for listener in self.listeners:
+            await listener.on_segment_download_start(index, adap_bw, segments)
+
+        semaphore = asyncio.Semaphore(self.fanout)
+        order = sorted(budgets.keys(), key=lambda as_id: budgets[as_id], reverse=True)
+        fanout_task = asyncio.gather(
+            *[self.fetch_segment(semaphore, as_id, representations[as_id], segments[as_id]) for as_id in order]
+        )
+        return InFlightIndex(index, selections, segments, fanout_task)
+
+    async def fetch_segment(
+        self, semaphore: asyncio.Semaphore, adaptation_set_id: int, representation: Representation, segment: Segment
+    ) -> Optional[Any]:
+        async with semaphore:
+            await self.initialize_representation(adaptation_set_id, representation)
+            await self.download_manager.download(DownloadRequest(segment.url, DownloadType.SEGMENT))
+            return await self.download_manager.wait_complete(segment.url)
+
+    async def initialize_representation(self, adaptation_set_id: int, representation: Representation):
+        """Download the initialization segment of a representation, if not already done"""
+        representation_str = "%d:%d" % (adaptation_set_id, representation.id)
+        if representation_str in self._representation_initialized:
+            return
+        # Another transfer is already fetching this initialization segment
+        pending = self._pending_initializations.get(representation_str)
+        if pending is not None:
+            await pending.wait()
+            if representation_str not in self._representation_initialized:
+                # It failed, try again
+                await self.initialize_representation(adaptation_set_id, representation)
+            return
+
+        self._pending_initializations[representation_str] = asyncio.Event()
+        try:
+            await self.download_manager.download(DownloadRequest(representation.initialization, DownloadType.STREAM_INIT))
+            result = await self.download_manager.wait_complete(representation.initialization)
+            if result is None:
+                # Dropped, the next request of the representation tries again
+                self.log.info(f"Initialization {representation.initialization} dropped")
                 return
+            self.log.info(f"Initialization {representation.initialization} Complete")
+            self._representation_initialized.add(representation_str)
+        finally:
+            # Wake up the waiting transfers even if it failed
+            self._pending_initializations.pop(representation_str).set()
+
+    async def complete_oldest_index(self):
+        """Wait for the oldest in-flight index and enqueue it to the buffer"""
+        entry = self._in_flight[0]
+        self.log.info(f"Waiting for completion urls {entry.urls}")
+        if entry.fanout_task is not None:
+            results = await entry.fanout_task
+        else:
+            results = [await self.download_manager.wait_complete(url) for url in entry.urls]
+        self.log.info(f"Completed downloading from urls {entry.urls}")
+        if any([result is None for result in results]):
+            # Result is None means the stream got dropped. Request the same index again in its place.
+            self._dropped_index = entry.index
+            self._forget_urls(entry.urls)
+            retry = await self.request_index(entry.index)
+            if retry is None:
+                self._in_flight.clear()
+                self._segments_ended = True
+            else:
+                self._in_flight[0] = retry
+            return
 
-            for listener in self.listeners:
-                await listener.on_segment_download_start(self._index, adap_bw, segments)
-
-            # duration = 0
-            urls = []
-            for adaptation_set_id, selection in selections.items():
-                adaptation_set = self.adaptation_sets[adaptation_set_id]
-                representation = adaptation_set.representations[selection]
-                representation_str = "%d:%d" % (adaptation_set_id, representation.id)
-                if representation_str not in self._representation_initialized:
-                    await self.download_manager.download(DownloadRequest(representation.initialization, DownloadType.STREAM_INIT))
-                    await self.download_manager.wait_complete(representation.initialization)
-                    self.log.info(f"Segment {self._index} Complete. Move to next segment")
-                    self._representation_initialized.add(representation_str)
-                try:
-                    segment = representation.segments[self._index]
-                except IndexError:
-                    self.log.info("Segments ended")
-                    self._end = True
-                    return
-                urls.append(segment.url)
-                await self.download_manager.download(DownloadRequest(segment.url, DownloadType.SEGMENT))
-                # duration = segment.duration
-            self.log.info(f"Waiting for completion urls {urls}")
-            results = [await self.download_manager.wait_complete(url) for url in urls]
-            self.log.info(f"Completed downloading from urls {urls}")
-            if any([result is None for result in results]):
-                # Result is None means the stream got dropped
-                self._dropped_index = self._index
-                continue
-            download_stats = {as_id: self.bandwidth_meter.get_stats(segment.url) for as_id, segment in segments.items()}
-            for listener in self.listeners:
-                await listener.on_segment_download_complete(self._index, segments, download_stats)
-            self._index += 1
-            await self.buffer_manager.enqueue_buffer(segments)
+        self._in_flight.popleft()
+        self._forget_urls(entry.urls)
+        download_stats = {as_id: self.bandwidth_meter.get_stats(segment.url) for as_id, segment in entry.segments.items()}
+        for listener in self.listeners:
+            await listener.on_segment_download_complete(entry.index, entry.segments, download_stats)
+        self._index = entry.index + 1
+        await self.buffer_manager.enqueue_buffer(entry.segments)
+
+    def _forget_urls(self, urls: List[str]):
+        self._requested_urls.difference_update(urls)
+        self._started_urls.difference_update(urls)
+
+    async def on_bytes_transferred(
+        self, length: int, url: str, position: int, size: int, content, timestamp_ns: Optional[int] = None
+    ) -> None:
+        if url in self._requested_urls:
+            self._started_urls.add(url)
+
+    async def on_adaptation_set_parsed(self, adaptation_set: AdaptationSet):
+        """
+        Fetch the initialization segment of a selected adaptation set while the rest of the MPD downloads.
+        The representation is the one matching the current bandwidth estimate, the likely first ABR choice.
+        """
+        if (self.selected_as_start is not None and adaptation_set.id < self.selected_as_start) or (
+            self.selected_as_end is not None and adaptation_set.id > self.selected_as_end
+        ):
+            return
+        representation = adaptation_set.representations[adaptation_set.ladder.highest_below(self.bandwidth_meter.bandwidth)]
+        # Not awaited, the MPD download reports its bytes to this callback
+        task = asyncio.create_task(self.initialize_representation(adaptation_set.id, representation))
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
 
     def select_adaptation_sets(self, adaptation_sets: Dict[int, AdaptationSet]):
         as_ids = adaptation_sets.keys()
@@ -186,6 +438,8 @@ class SchedulerImpl(Module, Scheduler):
         await self.download_manager.close()
         if self._task is not None:
             self._task.cancel()
+        for task in self._prefetch_tasks:
+            task.cancel()
 
     @property
     def is_end(self):
@@ -205,19 +459,18 @@ class SchedulerImpl(Module, Scheduler):
             The index of segment to cancel
         """
 
-        # If the index is the the index of currently downloading segment, ignore it
-        if self._index != index or self._current_selections is None:
+        # Only indices which are still in flight can be canceled
+        entry = next((entry for entry in self._in_flight if entry.index == index), None)
+        if entry is None:
             return
 
         # Do not cancel the task for the first index
         if index == 0:
             return
 
-        assert self.adaptation_sets is not None
-        for adaptation_set_id, selection in self._current_selections.items():
-            segment = self.adaptation_sets[adaptation_set_id].representations[selection].segments[self._index]
-            self.log.debug(f"Stop current downloading URL: {segment.url}")
-            await self.download_manager.stop(segment.url)
+        for url in entry.urls:
+            self.log.debug(f"Stop current downloading URL: {url}")
+            await self.download_manager.stop(url)
 
     async def drop_index(self, index):
         self._dropped_index = index
@@ -1 +1,2 @@
 from .async_utils import *  # noqa
+from .segment_buffer import *  # noqa
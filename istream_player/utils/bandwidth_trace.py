@@ -0,0 +1,161 @@
+import struct
+import zipfile
+from typing import Dict, List, Sequence
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+
+class BandwidthTrace(object):
+    """
+    Link rate over time, read from the resources/traces/trace_*.csv format: a header line, then
+    `timestamp_ms,bandwidth_kbit_s` lines. As in switch.sh, the rate of a line holds from the timestamp of the
+    previous line to its own, and the trace loops.
+    """
+
+    def __init__(self, ends: np.ndarray, rates: np.ndarray):
+        """
+        Parameters
+        ----------
+        ends:
+            End of each interval in seconds from the start of the trace, non decreasing
+        rates:
+            Rate of each interval in bytes per second, positive
+        """
+        assert len(ends) == len(rates) > 0 and ends[-1] > 0, "A trace needs at least one non empty interval"
+        assert np.all(rates > 0), "Trace rates must be positive"
+        self.ends = ends
+        self.rates = rates
+        self.starts = np.concatenate(([0.0], ends[:-1]))
+        self.cum_bytes = np.cumsum((ends - self.starts) * rates)
+        self.period = float(ends[-1])
+        self.period_bytes = float(self.cum_bytes[-1])
+
+    @staticmethod
+    def constant(kbit_s: float) -> "BandwidthTrace":
+        return BandwidthTrace(np.array([1.0]), np.array([kbit_s * 1000 / 8]))
+
+    @staticmethod
+    def load(path: str) -> "BandwidthTrace":
+        """Load a trace from a CSV file, or from a trace library with `<library>.npz#<index>`"""
+        if "#" in path:
+            library, index = path.rsplit("#", 1)
+            return get_trace_library(library).trace(int(index))
+        data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        if len(data) == 1:
+            return BandwidthTrace.constant(data[0, 1])
+        # Out of order timestamps make empty intervals, like the skipped sleeps of switch.sh
+        timestamps = np.maximum.accumulate(data[:, 0])
+        return BandwidthTrace((timestamps[1:] - timestamps[0]) / 1000, data[1:, 1] * 1000 / 8)
+
+    def rate_at(self, t: float) -> float:
+        """Rate in bytes per second at t seconds"""
+        return float(self.rates[np.searchsorted(self.ends, t % self.period, side="right")])
+
+    def bytes_until(self, t: float) -> float:
+        """Bytes the link can carry from the start of the trace to t seconds"""
+        loops, t = divmod(t, self.period)
+        i = np.searchsorted(self.ends, t, side="right")
+        prev = self.cum_bytes[i - 1] if i > 0 else 0.0
+        return loops * self.period_bytes + prev + (t - self.starts[i]) * self.rates[i]
+
+    def time_for_bytes(self, total: float) -> float:
+        """Inverse of bytes_until: the time at which the link has carried `total` bytes"""
+        loops, total = divmod(total, self.period_bytes)
+        i = np.searchsorted(self.cum_bytes, total, side="right")
+        prev = self.cum_bytes[i - 1] if i > 0 else 0.0
+        return loops * self.period + self.starts[i] + (total - prev) / self.rates[i]
+
+
+class TraceLibrary(object):
+    """
+    Traces resampled on a uniform grid, stored together in one uncompressed .npz file by prepare_traces.py:
+    the rates of all the traces in kbit/s (`rates`), the start of each trace in `rates` and the end of the last
+    one (`offsets`), the grid step (`step_ms`), the source names and summary statistics of each trace.
+    The rates are memory mapped, so the players and rate appliers of a host share the same pages.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with np.load(path) as npz:
+            self.offsets = npz["offsets"]
+            self.step = float(npz["step_ms"]) / 1000
+            self.names: List[str] = [str(name) for name in npz["names"]]
+            self.mean = npz["mean"]
+            self.std = npz["std"]
+            self.min = npz["min"]
+            self.max = npz["max"]
+            self.p5 = npz["p5"]
+            self.p95 = npz["p95"]
+            self.duration = npz["duration"]
+        self.rates = self._map("rates")
+
+    def _map(self, name: str) -> np.ndarray:
+        """Memory map an array stored without compression in the archive"""
+        with zipfile.ZipFile(self.path) as archive:
+            info = archive.getinfo(name + ".npy")
+        if info.compress_type != zipfile.ZIP_STORED:
+            with np.load(self.path) as npz:
+                return npz[name]
+        with open(self.path, "rb") as f:
+            # The data follows the local file header, whose name and extra field lengths can differ from the
+            # central directory
+            f.seek(info.header_offset)
+            name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = npy_format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = npy_format.read_array_header_2_0(f)
+            offset = f.tell()
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                         order="F" if fortran_order else "C")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def kbit(self, index: int) -> np.ndarray:
+        """Rates of a trace in kbit/s, one per step"""
+        return self.rates[self.offsets[index]:self.offsets[index + 1]]
+
+    def trace(self, index: int) -> BandwidthTrace:
+        rates = self.kbit(index)
+        return BandwidthTrace((np.arange(len(rates)) + 1) * self.step, np.asarray(rates, dtype=np.float64) * 1000 / 8)
+
+    @staticmethod
+    def save(path: str, names: Sequence[str], traces: Sequence[np.ndarray], step_ms: int):
+        """Store the traces (kbit/s per step) with their statistics. The statistics of empty traces are NaN."""
+        lengths = np.array([len(trace) for trace in traces], dtype=np.int64)
+        functions = {
+            "mean": np.mean,
+            "std": np.std,
+            "min": np.min,
+            "max": np.max,
+            "p5": lambda trace: np.percentile(trace, 5),
+            "p95": lambda trace: np.percentile(trace, 95),
+        }
+        stats = {
+            key: [function(trace) if len(trace) > 0 else np.nan for trace in traces] for key, function in functions.items()
+        }
+        # Not compressed, so the rates can be memory mapped
+        np.savez(
+            path,
+            rates=np.concatenate(traces).astype(np.float32) if traces else np.zeros(0, np.float32),
+            offsets=np.concatenate(([0], np.cumsum(lengths))),
+            step_ms=np.int64(step_ms),
+            names=np.array(names, dtype=str),
+            duration=lengths * step_ms / 1000,
+            **{key: np.array(values, dtype=np.float64) for key, values in stats.items()},
+        )
+
+
+_libraries: Dict[str, TraceLibrary] = {}
+
+
+def get_trace_library(path: str) -> TraceLibrary:
+    """Return the trace library of the process opened from the path"""
+    library = _libraries.get(path)
+    if library is None:
+        library = _libraries[path] = TraceLibrary(path)
+    return library
@@ -0,0 +1,63 @@
+from typing import List, Optional
+
+
+class SegmentBuffer:
+    """
+    Receive buffer of one transfer.
+
+    When the size is known (from Content-Length), the whole buffer is allocated once and every chunk is copied
+    into it at its offset. Otherwise the chunks are kept in a list and joined once when the content is requested.
+    In discard mode only the byte count is kept.
+    """
+
+    def __init__(self, size: int = 0, discard: bool = False) -> None:
+        self.size = size
+        self.discard = discard
+        self.position = 0
+
+        self._buffer: Optional[bytearray] = bytearray(size) if size > 0 and not discard else None
+        self._chunks: List[bytes] = []
+
+    def __len__(self) -> int:
+        return self.position
+
+    def append(self, chunk: bytes) -> memoryview:
+        """
+        Add a chunk at the end of the buffer
+
+        Parameters
+        ----------
+        chunk: bytes
+            The received bytes
+
+        Returns
+        -------
+        view: memoryview
+            A view of the chunk, without copying it again
+        """
+        length = len(chunk)
+        start = self.position
+        self.position += length
+        if self.discard:
+            return memoryview(chunk)
+        if self._buffer is not None:
+            if self.position <= len(self._buffer):
+                self._buffer[start:self.position] = chunk
+                return memoryview(self._buffer)[start:self.position]
+            # More bytes than announced. Fall back to the chunk list.
+            self._chunks = [bytes(memoryview(self._buffer)[:start])]
+            self._buffer = None
+        self._chunks.append(chunk)
+        return memoryview(chunk)
+
+    def view(self) -> memoryview:
+        """
+        Return the bytes received so far. Empty in discard mode.
+        """
+        if self.discard:
+            return memoryview(b"")
+        if self._buffer is not None:
+            return memoryview(self._buffer)[:self.position]
+        if len(self._chunks) > 1:
+            self._chunks = [b"".join(self._chunks)]
+        return memoryview(self._chunks[0] if self._chunks else b"")
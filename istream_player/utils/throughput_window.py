@@ -0,0 +1,91 @@
+import bisect
+import math
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+ESTIMATORS = ("mean", "harmonic", "ewma", "percentile")
+
+
+class ThroughputWindow(object):
+    """
+    Throughput of the chunks received in the last `window` seconds, updated in amortized O(1) per chunk.
+
+    Estimators:
+        mean: total bits over total transfer time of the window
+        harmonic: harmonic mean of the chunk rates of the window
+        ewma: chunk rates averaged with a time constant of `window` seconds
+        percentile: the given percentile of the chunk rates of the window (sorted insertion, O(log n) search)
+    """
+
+    def __init__(self, window: float, estimator: str = "mean", percentile: float = 50, min_samples: int = 2):
+        if estimator not in ESTIMATORS:
+            raise Exception(f"Unknown throughput estimator '{estimator}', use one of {ESTIMATORS}")
+        self.window = window
+        self.estimator = estimator
+        self.percentile = percentile
+        # The oldest samples are kept until the window has this many
+        self.min_samples = min_samples
+
+        # (start, end, bytes) of each chunk in the window
+        self._samples: Deque[Tuple[float, float, int]] = deque()
+        self._total_bytes = 0
+        self._total_time = 0.0
+        # Sum of 1/rate of the chunks with a duration
+        self._inverse_rates = 0.0
+        self._timed = 0
+        self._sorted_rates: List[float] = []
+        self._ewma: Optional[float] = None
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, start: float, end: float, size: int):
+        """Add a chunk of `size` bytes received between start and end (seconds), and evict the expired ones"""
+        self._samples.append((start, end, size))
+        self._total_bytes += size
+        duration = end - start
+        self._total_time += duration
+        if duration > 0 and size > 0:
+            rate = 8 * size / duration
+            self._inverse_rates += 1 / rate
+            self._timed += 1
+            if self.estimator == "percentile":
+                bisect.insort(self._sorted_rates, rate)
+            elif self.estimator == "ewma":
+                weight = 1 - math.exp(-duration / self.window) if self.window > 0 else 1
+                self._ewma = rate if self._ewma is None else self._ewma + weight * (rate - self._ewma)
+
+        window_start = end - self.window
+        while len(self._samples) > self.min_samples and self._samples[0][1] < window_start:
+            self._evict()
+        if self._timed == 0:
+            # No rounding error left over when the last timed chunk is evicted
+            self._inverse_rates = 0.0
+
+    def _evict(self):
+        start, end, size = self._samples.popleft()
+        self._total_bytes -= size
+        duration = end - start
+        self._total_time -= duration
+        if duration > 0 and size > 0:
+            rate = 8 * size / duration
+            self._inverse_rates -= 1 / rate
+            self._timed -= 1
+            if self.estimator == "percentile":
+                del self._sorted_rates[bisect.bisect_left(self._sorted_rates, rate)]
+
+    @property
+    def value(self) -> Optional[float]:
+        """The estimate in bits per second, None until the window has enough samples"""
+        if len(self._samples) < self.min_samples:
+            return None
+        if self.estimator == "mean":
+            return 8 * self._total_bytes / self._total_time if self._total_time > 0 else None
+        if self.estimator == "ewma":
+            return self._ewma
+        if self._timed == 0:
+            return None
+        if self.estimator == "harmonic":
+            return self._timed / self._inverse_rates
+        rank = min(len(self._sorted_rates) - 1, int(len(self._sorted_rates) * self.percentile / 100))
+        return self._sorted_rates[rank]
@@ -0,0 +1,85 @@
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+now_ns = time.monotonic_ns
+
+# Wall clock time of the monotonic origin, read once so the stamps are not moved by clock steps (NTP)
+_WALL_OFFSET_NS = time.time_ns() - time.monotonic_ns()
+
+
+def to_wall(t_ns: int) -> float:
+    """Seconds since the epoch of a monotonic timestamp, so the reports keep their wall clock meaning"""
+    return (t_ns + _WALL_OFFSET_NS) / 1e9
+
+
+def wall_time() -> float:
+    """Current time in seconds since the epoch, read from the monotonic clock"""
+    return to_wall(time.monotonic_ns())
+
+
+@dataclass(slots=True)
+class TransferTiming:
+    """Monotonic timestamps (ns) and gaps of one transfer, stamped by the downloader"""
+
+    request_ns: int
+    headers_ns: Optional[int] = None
+    first_byte_ns: Optional[int] = None
+    last_byte_ns: Optional[int] = None
+    end_ns: Optional[int] = None
+    bytes: int = 0
+    chunks: int = 0
+    # Longest gap between two chunks, and the total of the gaps longer than the idle threshold
+    max_gap_ns: int = 0
+    idle_ns: int = 0
+
+    # Gaps longer than this are counted as idle time (ns)
+    IDLE_THRESHOLD_NS = 50_000_000
+
+    def on_headers(self, t_ns: int):
+        self.headers_ns = t_ns
+
+    def on_chunk(self, t_ns: int, length: int):
+        if self.first_byte_ns is None:
+            self.first_byte_ns = t_ns
+        elif self.last_byte_ns is not None:
+            gap = t_ns - self.last_byte_ns
+            if gap > self.max_gap_ns:
+                self.max_gap_ns = gap
+            if gap > self.IDLE_THRESHOLD_NS:
+                self.idle_ns += gap
+        self.last_byte_ns = t_ns
+        self.bytes += length
+        self.chunks += 1
+
+    def on_end(self, t_ns: int):
+        self.end_ns = t_ns
+
+    @property
+    def ttfb(self) -> Optional[float]:
+        """Seconds from the request to the first byte of the body"""
+        return None if self.first_byte_ns is None else (self.first_byte_ns - self.request_ns) / 1e9
+
+    @property
+    def header_time(self) -> Optional[float]:
+        """Seconds from the request to the response headers"""
+        return None if self.headers_ns is None else (self.headers_ns - self.request_ns) / 1e9
+
+
+class TransferTimings(object):
+    """Timings of the latest transfers of a downloader, by URL. The oldest are dropped past `max_size`."""
+
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self._timings: Dict[str, TransferTiming] = {}
+
+    def start(self, url: str, t_ns: Optional[int] = None) -> TransferTiming:
+        # A new request of the same URL replaces the previous timing, and becomes the newest
+        self._timings.pop(url, None)
+        timing = self._timings[url] = TransferTiming(now_ns() if t_ns is None else t_ns)
+        while len(self._timings) > self.max_size:
+            del self._timings[next(iter(self._timings))]
+        return timing
+
+    def get(self, url: str) -> Optional[TransferTiming]:
+        return self._timings.get(url)
@@ -0,0 +1,32 @@
+import functools
+import ssl
+from typing import Dict
+
+from aioquic.tls import SessionTicket
+
+
+@functools.lru_cache(maxsize=None)
+def client_ssl_context(*alpn_protocols: str) -> ssl.SSLContext:
+    """
+    Return the TLS client context of the process for the given ALPN protocols.
+    Sharing the context also shares its TLS session cache between the players of the process.
+    Certificates are not verified.
+    """
+    ssl_context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_CLIENT)
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    if alpn_protocols:
+        ssl_context.set_alpn_protocols(list(alpn_protocols))
+    return ssl_context
+
+
+# Last QUIC session ticket received from each server, to resume the sessions of later players with 0-RTT
+_session_tickets: Dict[str, SessionTicket] = {}
+
+
+def get_session_ticket(server_name: str):
+    return _session_tickets.get(server_name)
+
+
+def save_session_ticket(ticket: SessionTicket):
+    _session_tickets[ticket.server_name] = ticket
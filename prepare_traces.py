@@ -1,45 +1,80 @@
-import numpy as np
+import argparse
 import glob
 import os
+import warnings
+
+import numpy as np
+
+from istream_player.utils.bandwidth_trace import TraceLibrary
 
 INPUT_DIR = "resources/traces"
 OUTPUT_DIR = "resources/traces"
 MIN_KBIT = 50.0
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-trace_idx = 0
+def load_log(path):
+    """Return the timestamps (ms) and throughput (kbit/s) of a 4G log: timestamp in column 0, bytes in 4, duration (ms) in 5"""
+    with warnings.catch_warnings():
+        # Lines with missing columns are skipped
+        warnings.simplefilter("ignore")
+        data = np.genfromtxt(path, usecols=(0, 4, 5), invalid_raise=False, ndmin=2)
+    data = data[np.all(np.isfinite(data), axis=1) & (data[:, 2] > 0)]
+    return data[:, 0], data[:, 1] * 8.0 / data[:, 2]
 
-for path in sorted(glob.glob(os.path.join(INPUT_DIR, "*.log"))):
-    out_path = os.path.join(OUTPUT_DIR, f"trace_{trace_idx}.csv")
 
-    with open(path, "r") as fin, open(out_path, "w") as fout:
-        fout.write("timestamp_ms,bandwidth_kbit_s\n")
-        bws = []
+def resample(timestamps, kbit, step_ms):
+    """Rate of each step of a uniform grid, holding the last sample"""
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, kbit = timestamps[order], kbit[order]
+    grid = np.arange(timestamps[0], timestamps[-1] + 1, step_ms)
+    return kbit[np.searchsorted(timestamps, grid, side="right") - 1]
 
-        for line in fin:
-            if not line.strip():
-                continue
 
-            cols = line.split()
-            if len(cols) < 6:
-                continue
+def main():
+    parser = argparse.ArgumentParser(description="Convert 4G throughput logs into a trace library")
+    parser.add_argument("--input-dir", default=INPUT_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--library", help="Path of the trace library (default: <output-dir>/traces.npz)")
+    parser.add_argument("--step-ms", type=int, default=1000, help="Resampling step")
+    parser.add_argument("--min-kbit", type=float, default=MIN_KBIT, help="Lower samples are raised to this rate")
+    parser.add_argument("--target-mean", type=float, help="Scale each trace to this mean rate in kbit/s")
+    parser.add_argument("--no-csv", action="store_true", help="Only write the library, not the trace_N.csv files")
+    args = parser.parse_args()
 
-            timestamp_ms = int(cols[0])
-            bytes_tx = float(cols[4])
-            duration_ms = float(cols[5])
+    os.makedirs(args.output_dir, exist_ok=True)
+    names, traces = [], []
+    for path in sorted(glob.glob(os.path.join(args.input_dir, "*.log"))):
+        timestamps, kbit = load_log(path)
+        names.append(os.path.basename(path))
+        if len(kbit) == 0:
+            # Kept as an empty trace, so the index of a log does not depend on the other logs
+            print(f"No samples in {path}, trace {len(traces)} is empty")
+            traces.append(np.zeros(0, np.float32))
+            continue
+        # Clamped instead of dropped, so low samples do not become gaps held at the previous rate
+        rates = np.maximum(resample(timestamps, kbit, args.step_ms), args.min_kbit)
+        if args.target_mean:
+            rates = np.maximum(rates * (args.target_mean / rates.mean()), args.min_kbit)
+        traces.append(rates.astype(np.float32))
 
-            if duration_ms <= 0:
-                continue
+    library = args.library or os.path.join(args.output_dir, "traces.npz")
+    TraceLibrary.save(library, names, traces, args.step_ms)
+    index = TraceLibrary(library)
+    for i, name in enumerate(names):
+        if len(traces[i]) == 0:
+            continue
+        print("Trace {} ({}), avg {:.1f} kbit/s, p5 {:.1f}, p95 {:.1f}, duration: {:.0f}s".format(
+            i, name, index.mean[i], index.p5[i], index.p95[i], index.duration[i]
+        ))
 
-            kbit_per_s = (bytes_tx * 8.0) / duration_ms
-            bws.append(kbit_per_s)
+        if not args.no_csv:
+            # The rate of a line holds from the previous timestamp to its own
+            rates = traces[i]
+            timestamps = np.arange(len(rates) + 1) * args.step_ms
+            rows = np.column_stack((timestamps, np.concatenate((rates[:1], rates))))
+            np.savetxt(os.path.join(args.output_dir, f"trace_{i}.csv"), rows, fmt=("%d", "%.3f"), delimiter=",",
+                       header="timestamp_ms,bandwidth_kbit_s", comments="")
 
-            if kbit_per_s >= MIN_KBIT:
-                fout.write(f"{timestamp_ms},{kbit_per_s:.3f}\n")
-            
-    print("Trace {}, avg {} kbit/s, duration: {}s".format(
-        trace_idx, np.mean(bws), len(bws)
-    ))
 
-    trace_idx += 1
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ from pathlib import Path
 import re
 import time
 import argparse
+import json
+import multiprocessing
+import random
 
 
 CONTROL_FILE = Path("control/run.flag")
@@ -44,9 +47,115 @@ def wait_for_container_startup(prefixes, timeout=60):
     raise TimeoutError("Some containers failed to start in time.")
 
 
+def schedule_arrivals(n_clients, process="simultaneous", interval=0.0, seed=None):
+    """Start delay of each client: all at once, one every interval, or Poisson arrivals with the mean interval."""
+    if process == "simultaneous" or interval <= 0:
+        return [0.0] * n_clients
+    if process == "staggered":
+        return [i * interval for i in range(n_clients)]
+    if process == "poisson":
+        rng = random.Random(seed)
+        delays, t = [], 0.0
+        for _ in range(n_clients):
+            delays.append(t)
+            t += rng.expovariate(1 / interval)
+        return delays
+    raise ValueError(f"Unknown arrival process: {process}")
+
+
+def check_container_clients(clients_per_container):
+    """
+    The clients of a container share its switch, trace and source address, so they would compete inside one
+    shaped link instead of each having its own. Only one client per container until the switch shapes each
+    client separately.
+    """
+    if clients_per_container != 1:
+        raise SystemExit(
+            f"clients_per_container={clients_per_container}: the clients of a container would share one shaped "
+            "link. Use one client per container, or the native runner."
+        )
+
+
+def run_native(cfg, config_path, exp_dir, exp_name):
+    """
+    Run the clients as processes of this host instead of containers.
+    The clients are sharded over worker processes pinned to the available cores. The workers start together
+    behind a barrier, and the clients arrive at the times scheduled here.
+    """
+    n_clients = cfg["n_containers"]
+    node_id = cfg.get("node_id", 0)
+    os.environ.update({
+        "EXP_STR": exp_name,
+        "LAMDA": str(cfg["sleep_lambda"]),
+        "NODE_ID": str(node_id),
+        "ISTREAM_CONFIG": str(cfg["istream_player_config_path"]),
+        "EXPERIMENT_CONFIG": str(config_path),
+        "CONTROL_FILE": str(CONTROL_FILE.resolve()),
+    })
+    # The wrapper reads its settings from the environment when imported
+    import wrapper
+
+    delays = schedule_arrivals(
+        n_clients, cfg.get("arrival_process", "simultaneous"), cfg.get("arrival_interval", 0.0), seed=f"{node_id}"
+    )
+    addrs = wrapper.local_addrs
+    clients = [
+        wrapper.Client(str(i), addrs[i % len(addrs)] if addrs else None, start_delay=delay)
+        for i, delay in enumerate(delays)
+    ]
+    for client in clients:
+        (exp_dir / client.client_id).mkdir(parents=True, exist_ok=True)
+
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    n_workers = max(1, min(cfg.get("workers", len(cores)), n_clients))
+    start_barrier = multiprocessing.Barrier(n_workers + 1)
+    started = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=wrapper.run_worker,
+            args=(clients[i::n_workers], start_barrier, started, cores[i % len(cores)]),
+            name=f"istream_worker_{i}",
+        )
+        for i in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    running = False
+    try:
+        print(f"Waiting for {n_workers} workers on {len(cores)} cores")
+        start_barrier.wait(timeout=120)
+
+        starts = [started.get(timeout=120) for _ in workers]
+        times = [t for _, _, t in starts]
+        skew = max(times) - min(times)
+        print(f"[ok] All workers started, skew {skew * 1000:.3f} ms")
+        with open(exp_dir / "start.json", "w") as f:
+            json.dump({
+                "skew": skew,
+                "workers": [{"cpu": cpu, "pid": pid, "time": t} for cpu, pid, t in starts],
+                "arrivals": {client.client_id: client.start_delay for client in clients},
+            }, f)
+
+        running = True
+        print(f"Experiment running for {cfg['duration']}s")
+        time.sleep(cfg["duration"])
+    finally:
+        CONTROL_FILE.write_text("0")
+        if running:
+            print("\nWaiting for the running sessions to end...")
+        else:
+            # A worker did not come up, the others would wait forever at the broken barrier
+            print("\nWorkers failed to start, terminating them")
+            for worker in workers:
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+        print("All workers stopped. Experiment complete." if running else "All workers stopped.")
+
 def main():
     parser = argparse.ArgumentParser(description="Experiment orchestration script")
     parser.add_argument("--config", required=True, help="Path to YAML config file")
+    parser.add_argument("--native", action="store_true", help="Run the clients as local processes instead of containers")
     args = parser.parse_args()
 
     config_path = args.config
@@ -55,20 +164,32 @@ def main():
 
     # === Extract config ===
     n_containers = cfg["n_containers"]
+    # Several clients can share one player container, run by a few worker processes
+    clients_per_container = cfg.get("clients_per_container", 1)
+    workers_per_container = cfg.get("workers_per_container", 1)
+    n_clients = n_containers
+    n_containers = -(-n_clients // clients_per_container)
     exp_duration = cfg["duration"]
     lamda = cfg["sleep_lambda"]
     node_id = cfg.get("node_id", 0)
     istream_config = cfg["istream_player_config_path"]
     bw_min = cfg.get("bandwidth_min", 500)
     bw_max = cfg.get("bandwidth_max", 5000)
+    native = args.native or cfg.get("runner") == "native"
+    if not native:
+        check_container_clients(clients_per_container)
 
     # === Prepare directories ===
     base_logs = Path("./logs")
     exp_dir, exp_name = get_next_experiment_dir(base_logs)
+    # Keep the config next to the logs, for scripts/aggregate_reports.py
+    with open(exp_dir / "experiment.yaml", "w") as f:
+        yaml.safe_dump(cfg, f)
     CONTROL_FILE.parent.mkdir(exist_ok=True)
     CONTROL_FILE.write_text("1")
 
     print(f"Starting experiment: {exp_name}")
+    print(f"  clients    : {n_clients}")
     print(f"  containers : {n_containers}")
     print(f"  duration   : {exp_duration}s")
     print(f"  lambda     : {lamda}")
@@ -76,22 +197,32 @@ def main():
     print(f"  config     : {istream_config}")
     print(f"  bw range   : {bw_min}–{bw_max} kbps")
 
+    if native:
+        run_native(cfg, config_path, exp_dir, exp_name)
+        return
+
     # === Start containers ===
     for i in range(n_containers):
-        log_dir = exp_dir / str(i)
-        log_dir.mkdir(parents=True, exist_ok=True)
+        first_client = i * clients_per_container
+        container_clients = min(clients_per_container, n_clients - first_client)
+        for client in range(first_client, first_client + container_clients):
+            log_dir = exp_dir / str(client)
+            log_dir.mkdir(parents=True, exist_ok=True)
         trace_id = i
 
         env = os.environ.copy()
         env.update({
             "ID": str(i),
             "EXP_STR": exp_name,
-            "LOG_DIR": str(log_dir.resolve()),
+            "LOG_DIR": str((exp_dir / str(first_client)).resolve()),
             "LAMDA": str(lamda),
             "NODE_ID": str(node_id),
             "ISTREAM_CONFIG": str(istream_config),
             "TRACE_ID": str(trace_id),
             "EXPERIMENT_CONFIG": str(config_path),
+            "CLIENTS": str(container_clients),
+            "CLIENT_OFFSET": str(first_client),
+            "WORKERS": str(workers_per_container),
         })
 
         cmd = [
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Aggregate the playback reports of the experiments started by run_experiment.py
+
+Expected layout (see run_experiment.py and wrapper.py):
+
+    <logs>/experiment_N/experiment.yaml         Experiment config
+    <logs>/experiment_N/<container>/info.json   Sessions of the container, with their sequence
+    <logs>/experiment_N/<container>/data-*.json Report of each session
+
+Reports are parsed in a process pool and cached by file mtime, so re-runs only parse new or modified reports.
+QoE metrics are then computed per group of (number of clients, segment duration, sequence).
+"""
+
+import argparse
+import json
+import os
+import pickle
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+
+GROUP_KEYS = ("n_clients", "segment_duration", "sequence")
+SESSION_COLUMNS = {
+    "experiment": "U",
+    "n_clients": "i8",
+    "segment_duration": "f8",
+    "sequence": "U",
+    "container": "U",
+    "session": "U",
+    "startup_delay": "f8",
+    "playback_duration": "f8",
+    "session_duration": "f8",
+    "stall_num": "i8",
+    "stall_dur": "f8",
+    "switch_num": "i8",
+    "segment_num": "i8",
+    "mean_bitrate": "f8",
+}
+PERCENTILES = (5, 50, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser("Aggregate the playback reports of run_experiment.py experiments")
+    parser.add_argument("--logs", default="./logs", type=str, help="Folder containing the experiment_N folders")
+    parser.add_argument("--experiments", nargs="*", default=None, help="Only aggregate these experiment folders")
+    parser.add_argument("--workers", type=int, default=None, help="Number of parser processes")
+    parser.add_argument("--cache", type=str, default=None, help="Cache file (default: <logs>/.aggregate_cache.pkl)")
+    parser.add_argument("--sessions-csv", type=str, default=None, help="Write the per-session table to this CSV file")
+    parser.add_argument("--csv", type=str, default=None, help="Write the per-group metrics to this CSV file")
+    args = parser.parse_args()
+
+    logs = Path(args.logs)
+    cache_path = Path(args.cache) if args.cache is not None else logs / ".aggregate_cache.pkl"
+
+    reports = find_reports(logs, args.experiments)
+    records = parse_reports(reports, cache_path, args.workers)
+    if len(records) == 0:
+        print(f"No reports found in {logs}")
+        return
+
+    table = make_table(records)
+    groups = aggregate(table)
+
+    print_groups(groups, sys.stdout)
+    if args.sessions_csv is not None:
+        write_csv(args.sessions_csv, table)
+    if args.csv is not None:
+        write_csv(args.csv, groups)
+
+
+def segment_duration_of(cfg: Dict[str, Any]) -> float:
+    """Segment duration of an experiment, explicit or from the player config name (e.g. 2s_segments.yaml)"""
+    if "segment_duration" in cfg:
+        return float(cfg["segment_duration"])
+    match = re.search(r"(\d+(?:\.\d+)?)s_segments", str(cfg.get("istream_player_config_path", "")))
+    return float(match.group(1)) if match is not None else float("nan")
+
+
+def find_reports(logs: Path, experiments: Optional[List[str]] = None) -> List[Tuple[str, Dict[str, Any]]]:
+    """Return (report path, session metadata) for every report in the logs folder"""
+    pattern = re.compile(r"^experiment_(\d+)$")
+    reports = []
+    for exp_dir in sorted(logs.iterdir()) if logs.is_dir() else []:
+        if not exp_dir.is_dir() or pattern.match(exp_dir.name) is None:
+            continue
+        if experiments is not None and exp_dir.name not in experiments:
+            continue
+
+        cfg = {}
+        if (exp_dir / "experiment.yaml").exists():
+            with open(exp_dir / "experiment.yaml") as f:
+                cfg = yaml.safe_load(f) or {}
+        containers = [d for d in exp_dir.iterdir() if d.is_dir()]
+        n_clients = int(cfg.get("n_containers", len(containers)))
+        segment_duration = segment_duration_of(cfg)
+
+        for container_dir in containers:
+            sequences = {}
+            info_path = container_dir / "info.json"
+            if info_path.exists():
+                with open(info_path) as f:
+                    for session in json.load(f).get("sessions", []):
+                        if "session_id" in session:
+                            sequences[session["session_id"]] = session.get("sequence", "")
+
+            for report in container_dir.glob("data-*.json"):
+                meta = {
+                    "experiment": exp_dir.name,
+                    "n_clients": n_clients,
+                    "segment_duration": segment_duration,
+                    "sequence": sequences.get(report.stem, ""),
+                    "container": container_dir.name,
+                    "session": report.stem,
+                }
+                reports.append((str(report), meta))
+    return reports
+
+
+def parse_report(path: str) -> Dict[str, Any]:
+    """Extract the per-session metrics of one report. Runs in the worker processes."""
+    with open(path) as f:
+        data = json.load(f)
+
+    if "segments" in data:
+        segments = data["segments"]
+        indexes = np.array([s["index"] for s in segments], dtype=np.int64)
+        qualities = np.array([s["quality"] for s in segments], dtype=np.int64)
+        bitrates = np.array([s["bitrate"] for s in segments], dtype=np.int64)
+    else:
+        # Summary of a columnar data collector, the segments are in the metrics folder next to it
+        from istream_player.modules.analyzer.metrics_store import load_metrics
+
+        columns = load_metrics(path[: -len(".json")] + ".metrics", ["segments"])["segments"]
+        indexes, qualities, bitrates = columns["index"], columns["quality"], columns["bitrate"]
+
+    order = np.argsort(indexes, kind="stable")
+    qualities = qualities[order]
+
+    times = np.array([s["time"] for s in data.get("states", [])], dtype=np.float64)
+    states = [s["state"] for s in data.get("states", [])]
+    ready = [t for t, s in zip(times, states) if s == "State.READY"]
+    startup_delay = ready[0] if len(ready) > 0 else float("nan")
+    playback_duration = times[-1] - startup_delay if len(times) > 0 else float("nan")
+    session_duration = times[-1] if len(times) > 0 else float("nan")
+
+    return {
+        "startup_delay": startup_delay,
+        "playback_duration": playback_duration,
+        "session_duration": session_duration,
+        "stall_num": int(data.get("num_stall", 0)),
+        "stall_dur": float(data.get("dur_stall", 0)),
+        "switch_num": int(np.count_nonzero(np.diff(qualities))),
+        "segment_num": len(qualities),
+        "mean_bitrate": float(bitrates.mean()) if len(bitrates) > 0 else float("nan"),
+        "bitrates": bitrates,
+    }
+
+
+def parse_reports(
+    reports: List[Tuple[str, Dict[str, Any]]], cache_path: Path, workers: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    cache: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    if cache_path.exists():
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+
+    mtimes = {path: os.stat(path).st_mtime_ns for path, _ in reports}
+    stale = [path for path, _ in reports if path not in cache or cache[path][0] != mtimes[path]]
+    print(f"{len(reports)} reports, {len(stale)} to parse", file=sys.stderr)
+
+    if len(stale) > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, parsed in zip(stale, executor.map(parse_report, stale, chunksize=16)):
+                cache[path] = (mtimes[path], parsed)
+    # Reports which do not exist anymore are dropped from the cache
+    if len(stale) > 0 or len(cache) != len(mtimes):
+        cache = {path: cache[path] for path in mtimes}
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump(cache, f)
+
+    return [{**meta, **cache[path][1]} for path, meta in reports]
+
+
+def make_table(records: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    table = {col: np.array([r[col] for r in records], dtype=dtype) for col, dtype in SESSION_COLUMNS.items()}
+    # Stalls include the initial buffering, so they are compared to the whole session
+    table["stall_ratio"] = table["stall_dur"] / table["session_duration"]
+    table["switch_rate"] = table["switch_num"] * 60 / table["playback_duration"]
+    # Kept aside for the bitrate percentiles, one array per session
+    table["bitrates"] = np.empty(len(records), dtype=object)
+    for i, r in enumerate(records):
+        table["bitrates"][i] = r["bitrates"]
+    return table
+
+
+def aggregate(table: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Compute the QoE metrics of each (n_clients, segment_duration, sequence) group.
+    The sessions whose segment duration is unknown (NaN) are grouped together.
+    """
+    # NaN is not equal to itself, np.unique would make a group of each of these sessions. Durations are positive.
+    durations = np.where(np.isnan(table["segment_duration"]), -1.0, table["segment_duration"])
+    keys = np.rec.fromarrays(
+        [durations if k == "segment_duration" else table[k] for k in GROUP_KEYS], names=GROUP_KEYS
+    )
+    unique_keys, group_of = np.unique(keys, return_inverse=True)
+    group_of = group_of.reshape(-1)
+    n_groups = len(unique_keys)
+    counts = np.bincount(group_of, minlength=n_groups)
+
+    def mean(col: str) -> np.ndarray:
+        values = table[col].astype(np.float64)
+        valid = ~np.isnan(values)
+        sums = np.bincount(group_of[valid], weights=values[valid], minlength=n_groups)
+        return sums / np.maximum(np.bincount(group_of[valid], minlength=n_groups), 1)
+
+    groups = {k: unique_keys[k] for k in GROUP_KEYS}
+    groups["segment_duration"] = np.where(groups["segment_duration"] < 0, np.nan, groups["segment_duration"])
+    groups["sessions"] = counts
+    groups["startup_delay"] = mean("startup_delay")
+    groups["stall_num"] = mean("stall_num")
+    groups["stall_dur"] = mean("stall_dur")
+    groups["stall_ratio"] = mean("stall_ratio")
+    groups["switch_rate"] = mean("switch_rate")
+    groups["mean_bitrate"] = mean("mean_bitrate")
+
+    # Percentiles over all the segments of the group
+    order = np.argsort(group_of, kind="stable")
+    bounds = np.cumsum(counts)[:-1]
+    percentiles = np.full((n_groups, len(PERCENTILES)), np.nan)
+    for i, sessions in enumerate(np.split(order, bounds)):
+        bitrates = [table["bitrates"][s] for s in sessions if len(table["bitrates"][s]) > 0]
+        if len(bitrates) > 0:
+            percentiles[i] = np.percentile(np.concatenate(bitrates), PERCENTILES)
+    for j, p in enumerate(PERCENTILES):
+        groups[f"bitrate_p{p}"] = percentiles[:, j]
+    return groups
+
+
+def print_groups(groups: Dict[str, np.ndarray], output):
+    columns = list(groups.keys())
+    output.write("".join("%-18s" % col for col in columns) + "\n")
+    for i in range(len(groups["sessions"])):
+        for col in columns:
+            value = groups[col][i]
+            if isinstance(value, (float, np.floating)):
+                output.write("%-18.3f" % value)
+            else:
+                output.write("%-18s" % value)
+        output.write("\n")
+
+
+def write_csv(path: str, table: Dict[str, np.ndarray]):
+    columns = [col for col, values in table.items() if values.dtype != object]
+    with open(path, "w") as f:
+        f.write(",".join(columns) + "\n")
+        for row in zip(*(table[col] for col in columns)):
+            f.write(",".join(str(v) for v in row) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,10 +15,12 @@ setup(
         "aiohttp",
         "requests",
         "aioquic==0.9.20",
+        "h2",
         "pyyaml",
         # "sslkeylog",
         "pytest",
         "parameterized",
-        "matplotlib"
+        "matplotlib",
+        "numpy"
     ],
 )
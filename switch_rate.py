@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Rate applier of the switch container.
+
+Plays the bandwidth trace in a loop, like switch.sh did: the rate of a line holds from the timestamp of the
+previous line to its own. The changes are scheduled against absolute monotonic deadlines, so the time spent
+applying them does not delay the rest of the trace, and they are written to one long running `tc -batch`
+process instead of forking tc for every line.
+
+The trace is read from the library written by prepare_traces.py, only the rates of this trace, with the standard
+library since the switch image has no NumPy. The trace_N.csv files are used when there is no library.
+"""
+
+import ast
+import csv
+import os
+import signal
+import statistics
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zipfile
+from array import array
+
+IFACE = os.environ.get("IFACE", "eth0")
+TRACE_ID = os.environ.get("TRACE_ID")
+TRACE_DIR = os.environ.get("TRACE_DIR", "/traces")
+TRACE_LIBRARY = os.environ.get("TRACE_LIBRARY", os.path.join(TRACE_DIR, "traces.npz"))
+DELAY = os.environ.get("DELAY", "30ms 5ms")
+
+# Array types of the .npy members of the library
+NPY_TYPECODES = {"<f4": "f", "<i8": "q"}
+
+
+def _member_array(archive, f, name, start=0, stop=None):
+    """Read the items [start:stop] of a 1-d (or scalar) .npy member stored without compression"""
+    info = archive.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"{name} is compressed in the trace library, write it again with prepare_traces.py")
+    # The data follows the local file header, whose name and extra field lengths can differ from the central directory
+    f.seek(info.header_offset)
+    name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+    f.seek(info.header_offset + 30 + name_len + extra_len)
+    magic = f.read(8)
+    if magic[:6] != b"\x93NUMPY":
+        raise ValueError(f"{name} is not a .npy array")
+    header_len, = struct.unpack("<H", f.read(2)) if magic[6] == 1 else struct.unpack("<I", f.read(4))
+    header = ast.literal_eval(f.read(header_len).decode("latin1"))
+    typecode = NPY_TYPECODES.get(header["descr"])
+    if typecode is None:
+        raise ValueError(f"Unexpected type {header['descr']} of {name}")
+    size = 1
+    for dim in header["shape"]:
+        size *= dim
+    stop = size if stop is None else stop
+    values = array(typecode)
+    f.seek(start * values.itemsize, os.SEEK_CUR)
+    values.fromfile(f, stop - start)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def read_library_trace(path, index):
+    """Return the rates (kbit/s) of one trace of a library, one per step, and the step in seconds"""
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        offsets = _member_array(archive, f, "offsets")
+        if not 0 <= index < len(offsets) - 1:
+            raise ValueError(f"No trace {index} in {path}, it has {len(offsets) - 1} traces")
+        step_ms = _member_array(archive, f, "step_ms")[0]
+        return _member_array(archive, f, "rates", offsets[index], offsets[index + 1]), step_ms / 1000
+
+
+def load_library_trace(path, index):
+    """Same as load_trace, for a trace of a library"""
+    rates, step = read_library_trace(path, index)
+    if len(rates) == 0:
+        raise ValueError("Trace too short")
+    # Steps with the same rate are one change
+    changes = []
+    for i, rate in enumerate(rates):
+        if not changes or int(rate) != changes[-1][1]:
+            changes.append((i * step, int(rate)))
+    return changes, len(rates) * step
+
+
+def load_trace(path):
+    """Return the (offset in seconds, rate in kbit/s) changes of one loop of the trace, and the loop duration"""
+    with open(path, newline="") as f:
+        rows = [(int(row[0]), int(float(row[1]))) for row in list(csv.reader(f))[1:] if row]
+    if len(rows) < 2:
+        raise ValueError("Trace too short")
+    # Out of order timestamps are applied immediately, like the skipped sleeps of switch.sh
+    timestamps = []
+    for ts, _ in rows:
+        timestamps.append(max(ts, timestamps[-1]) if timestamps else ts)
+    # The rate of each line starts at the timestamp of the previous one
+    changes = [((timestamps[i - 1] - timestamps[0]) / 1000, rows[i][1]) for i in range(1, len(rows))]
+    return changes, (timestamps[-1] - timestamps[0]) / 1000
+
+
+class RateApplier:
+    def __init__(self, iface):
+        self.iface = iface
+        # Reads the commands line by line as they are written
+        self.tc = subprocess.Popen(
+            ["tc", "-force", "-batch", "-"], stdin=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1
+        )
+        # With -force, tc goes on after a failed command and only reports it on stderr
+        self.errors = 0
+        threading.Thread(target=self._read_errors, daemon=True).start()
+
+    def _read_errors(self):
+        for line in self.tc.stderr:
+            if line.startswith("Command failed"):
+                self.errors += 1
+            print(f"[switch] tc: {line.rstrip()}", file=sys.stderr, flush=True)
+
+    def command(self, line):
+        if self.tc.poll() is not None:
+            raise RuntimeError(f"tc exited with code {self.tc.returncode}")
+        self.tc.stdin.write(line + "\n")
+        self.tc.stdin.flush()
+
+    def setup(self, rate):
+        self.command(f"qdisc replace dev {self.iface} root handle 1: netem delay {DELAY}")
+        self.command(f"qdisc replace dev {self.iface} parent 1:1 handle 10: cake bandwidth {rate}kbit besteffort flows")
+
+    def set_rate(self, rate):
+        # Only the shaper changes, netem and the cake queues are kept
+        self.command(f"qdisc change dev {self.iface} parent 1:1 handle 10: cake bandwidth {rate}kbit")
+
+    def close(self):
+        self.tc.stdin.close()
+        self.tc.wait()
+
+
+def report(loop, drifts, errors):
+    """
+    The drift is measured when the command is written to tc, the time tc takes to apply it is not included.
+    The failed commands are counted from the stderr of tc.
+    """
+    drifts_ms = sorted(d * 1000 for d in drifts)
+    p95 = drifts_ms[min(len(drifts_ms) - 1, int(0.95 * len(drifts_ms)))]
+    print(f"[switch] loop {loop}: {len(drifts_ms)} changes, write drift mean {statistics.fmean(drifts_ms):.2f} ms, "
+          f"p95 {p95:.2f} ms, max {drifts_ms[-1]:.2f} ms, {errors} failed tc commands so far", flush=True)
+
+
+def main():
+    if TRACE_ID is None:
+        print("TRACE_ID env variable not set")
+        sys.exit(1)
+    try:
+        if os.path.exists(TRACE_LIBRARY):
+            print(f"[switch] Using trace {TRACE_ID} of {TRACE_LIBRARY}")
+            changes, period = load_library_trace(TRACE_LIBRARY, int(TRACE_ID))
+        else:
+            trace_file = os.path.join(TRACE_DIR, f"trace_{TRACE_ID}.csv")
+            print(f"[switch] Using trace: {trace_file}")
+            changes, period = load_trace(trace_file)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f"[switch] Loaded {len(changes)} rate changes, {period:.3f} s per loop", flush=True)
+
+    applier = RateApplier(IFACE)
+    try:
+        applier.setup(changes[0][1])
+        if period <= 0:
+            # Nothing to pace, keep the last rate until the container stops
+            applier.set_rate(changes[-1][1])
+            while True:
+                signal.pause()
+        start = time.monotonic()
+        loop = 0
+        while True:
+            drifts = []
+            for i, (offset, rate) in enumerate(changes):
+                deadline = start + loop * period + offset
+                if not (loop == 0 and i == 0):
+                    delay = deadline - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    applier.set_rate(rate)
+                drifts.append(time.monotonic() - deadline)
+            report(loop, drifts, applier.errors)
+            loop += 1
+    finally:
+        applier.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import unittest
+from contextlib import redirect_stderr
+from os.path import dirname, join
+from pathlib import Path
+
+import numpy as np
+
+from istream_player.modules.analyzer.analyzer import SEGMENT_COLUMNS
+from istream_player.modules.analyzer.metrics_store import MetricsStore
+
+sys.path.insert(0, join(dirname(__file__), "..", "scripts"))
+import aggregate_reports  # noqa: E402
+
+
+def write_report(path: Path, qualities, stall_dur: float):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "segments": [
+            {"index": i + 1, "quality": quality, "bitrate": (quality + 1) * 100_000} for i, quality in enumerate(qualities)
+        ],
+        "states": [
+            {"time": 0, "state": "State.BUFFERING", "position": 0},
+            {"time": 1, "state": "State.READY", "position": 0},
+            {"time": 11, "state": "State.END", "position": 10},
+        ],
+        "num_stall": 1 if stall_dur > 0 else 0,
+        "dur_stall": stall_dur,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f)
+
+
+def write_columnar_report(path: Path, qualities, stall_dur: float):
+    """Summary without the segments, which are in the .metrics folder next to it like the columnar collector does"""
+    write_report(path, qualities, stall_dur)
+    with open(path) as f:
+        report = json.load(f)
+    segments = report.pop("segments")
+    with open(path, "w") as f:
+        json.dump(report, f)
+
+    store = MetricsStore(str(path)[: -len(".json")] + ".metrics")
+    store.add_table("segments", SEGMENT_COLUMNS)
+    # Completed out of order, as with parallel downloads
+    for segment in reversed(segments):
+        row = {col: "" if dtype == "U" else 0 for col, dtype in SEGMENT_COLUMNS.items()}
+        row.update(segment)
+        store.append("segments", *row.values())
+    store.flush()
+
+
+def write_experiment(exp_dir: Path, cfg: str, sequences=None):
+    """Experiment folder with its config, and the sequence of each session as {container: {session: sequence}}"""
+    exp_dir.mkdir(parents=True)
+    with open(exp_dir / "experiment.yaml", "w") as f:
+        f.write(cfg)
+    for container, sessions in (sequences or {}).items():
+        (exp_dir / container).mkdir()
+        with open(exp_dir / container / "info.json", "w") as f:
+            json.dump({"sessions": [{"session_id": s, "sequence": q} for s, q in sessions.items()]}, f)
+
+
+class AggregateReportsTest(unittest.TestCase):
+    logs = Path("./runs/test_aggregate_reports")
+
+    def setUp(self):
+        shutil.rmtree(self.logs, ignore_errors=True)
+
+    def parse(self):
+        """Parse the reports of the logs folder, and return the records and the number of reports parsed again"""
+        reports = aggregate_reports.find_reports(self.logs)
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            records = aggregate_reports.parse_reports(reports, self.logs / "cache.pkl", workers=1)
+        assert stderr.getvalue().startswith(f"{len(reports)} reports, ")
+        return records, int(stderr.getvalue().split(", ")[1].split()[0])
+
+    def test_unknown_segment_duration(self):
+        # Neither segment_duration nor a player config name with the segment duration
+        exp_dir = self.logs / "experiment_0"
+        exp_dir.mkdir(parents=True)
+        with open(exp_dir / "experiment.yaml", "w") as f:
+            f.write("n_containers: 2\n")
+        write_report(exp_dir / "client_0" / "data-1.json", [0, 1, 1, 2], 0)
+        write_report(exp_dir / "client_1" / "data-1.json", [2, 2, 2, 2], 1.1)
+
+        reports = aggregate_reports.find_reports(self.logs)
+        records = aggregate_reports.parse_reports(reports, self.logs / "cache.pkl", workers=1)
+        table = aggregate_reports.make_table(records)
+        assert np.isnan(table["segment_duration"]).all()
+
+        groups = aggregate_reports.aggregate(table)
+        # One group for both sessions, whose segment duration stays unknown
+        assert list(groups["sessions"]) == [2] and np.isnan(groups["segment_duration"][0])
+        assert groups["n_clients"][0] == 2
+        self.assertAlmostEqual(groups["stall_dur"][0], 0.55)
+        self.assertAlmostEqual(groups["stall_ratio"][0], 0.05)
+        # 2 switches in 10 s of playback, and none
+        assert groups["switch_rate"][0] == 6
+        assert groups["mean_bitrate"][0] == 250_000 and groups["bitrate_p50"][0] == 300_000
+
+    def test_cache(self):
+        write_experiment(self.logs / "experiment_0", "n_containers: 1\nsegment_duration: 2\n")
+        paths = [self.logs / "experiment_0" / "client_0" / f"data-{i}.json" for i in range(3)]
+        for path in paths:
+            write_report(path, [0, 0, 0, 0], 0)
+
+        records, parsed = self.parse()
+        assert len(records) == 3 and parsed == 3
+        records, parsed = self.parse()
+        assert len(records) == 3 and parsed == 0
+
+        # Same path, new content
+        write_report(paths[1], [0, 1, 0, 1], 0)
+        mtime_ns = os.stat(paths[1]).st_mtime_ns + 1_000_000_000
+        os.utime(paths[1], ns=(mtime_ns, mtime_ns))
+        records, parsed = self.parse()
+        assert parsed == 1
+        assert sorted(r["switch_num"] for r in records) == [0, 0, 3]
+
+        paths[0].unlink()
+        records, parsed = self.parse()
+        assert len(records) == 2 and parsed == 0
+        with open(self.logs / "cache.pkl", "rb") as f:
+            assert sorted(pickle.load(f).keys()) == sorted(str(path) for path in paths[1:])
+
+    def test_groups(self):
+        write_experiment(
+            self.logs / "experiment_0",
+            "n_containers: 1\nistream_player_config_path: ./configs/2s_segments.yaml\n",
+            {"client_0": {"data-1": "seq_a", "data-2": "seq_b"}},
+        )
+        write_report(self.logs / "experiment_0" / "client_0" / "data-1.json", [0, 0, 0, 0], 0)
+        write_report(self.logs / "experiment_0" / "client_0" / "data-2.json", [1, 1, 1, 1], 0)
+        write_experiment(
+            self.logs / "experiment_1", "n_containers: 2\nsegment_duration: 4\n",
+            {"client_0": {"data-1": "seq_a"}, "client_1": {"data-1": "seq_a"}},
+        )
+        write_report(self.logs / "experiment_1" / "client_0" / "data-1.json", [2, 2, 2, 2], 2.2)
+        write_report(self.logs / "experiment_1" / "client_1" / "data-1.json", [0, 0, 0, 0], 0)
+
+        records, _ = self.parse()
+        groups = aggregate_reports.aggregate(aggregate_reports.make_table(records))
+        keys = list(zip(groups["n_clients"], groups["segment_duration"], groups["sequence"]))
+        assert keys == [(1, 2.0, "seq_a"), (1, 2.0, "seq_b"), (2, 4.0, "seq_a")]
+        assert list(groups["sessions"]) == [1, 1, 2]
+        assert list(groups["mean_bitrate"]) == [100_000, 200_000, 200_000]
+        self.assertAlmostEqual(groups["stall_dur"][2], 1.1)
+        assert groups["stall_dur"][0] == 0 and groups["stall_dur"][1] == 0
+
+    def test_columnar_report(self):
+        write_experiment(self.logs / "experiment_0", "n_containers: 2\nsegment_duration: 2\n")
+        write_report(self.logs / "experiment_0" / "client_0" / "data-1.json", [0, 1, 1, 2], 0)
+        write_columnar_report(self.logs / "experiment_0" / "client_1" / "data-1.json", [0, 1, 1, 2], 0)
+
+        records, _ = self.parse()
+        by_container = {r["container"]: r for r in records}
+        json_record, columnar_record = by_container["client_0"], by_container["client_1"]
+        for col in ("switch_num", "segment_num", "mean_bitrate", "startup_delay", "playback_duration"):
+            assert json_record[col] == columnar_record[col], col
+        assert columnar_record["switch_num"] == 2 and columnar_record["segment_num"] == 4
+        assert list(columnar_record["bitrates"]) == [300_000, 200_000, 200_000, 100_000]
+
+
+if __name__ == "__main__":
+    unittest.main()
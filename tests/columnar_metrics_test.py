@@ -0,0 +1,65 @@
+import json
+import shutil
+import unittest
+from os.path import exists, join
+from unittest.mock import patch
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.module_composer import PlayerComposer
+from istream_player.modules.analyzer.analyzer import PlaybackAnalyzer
+from istream_player.modules.analyzer.metrics_store import load_metrics
+
+
+class ColumnarMetricsTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_columnar"
+
+    def make_config(self, store: str = "columnar"):
+        config = PlayerConfig(
+            input="./tests/resources/static_1as_5repr_4seg.mpd",
+            run_dir=self.run_dir,
+            session_id="session-a",
+            mod_abr="dash",
+            mod_analyzer=[f"data_collector:store={store},flush_interval=0,plots_dir={join(self.run_dir, 'plots')}"],
+            mod_downloader="local",
+            time_factor=0
+        )
+        config.static.max_initial_bitrate = 100_000
+        return config
+
+    def setUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    async def test_columnar(self):
+        composer = PlayerComposer()
+        composer.register_core_modules()
+        async with composer.make_player(self.make_config()) as player:
+            await player.run()
+
+        with open(join(self.run_dir, "session-a.json")) as f:
+            summary = json.load(f)
+        assert summary["num_segments"] == 4
+        assert not exists(join(self.run_dir, "data-1.json"))
+
+        tables = load_metrics(join(self.run_dir, "session-a.metrics"))
+        assert sorted(tables["segments"]["index"].tolist()) == [1, 2, 3, 4]
+        assert all(url.endswith(".m4s") for url in tables["segments"]["url"])
+        assert len(tables["buffer_level"]["time"]) > 0
+        assert tables["states"]["state"][-1] == "State.END"
+
+    async def test_plots(self):
+        composer = PlayerComposer()
+        composer.register_core_modules()
+        samples = {}
+        for store in ("json", "columnar"):
+            with patch.object(PlaybackAnalyzer, "save_plots") as save_plots:
+                async with composer.make_player(self.make_config(store)) as player:
+                    await player.run()
+            save_plots.assert_called_once()
+            samples[store] = save_plots.call_args.args
+        # The columnar store plots the bandwidth estimates like the json one
+        for store, (buffer_times, buffer_levels, bw_times, bws) in samples.items():
+            assert len(buffer_times) > 0 and len(bws) > 0 and len(bw_times) == len(bws), store
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import unittest
+from os.path import join
+
+from istream_player.config.config import PlayerConfig
+from istream_player.modules.downloader.local import LocalClient
+from istream_player.modules.mpd.mpd_provider_impl import MPDProviderImpl
+
+MPD_TEMPLATE = """<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="{type}" minimumUpdatePeriod="PT2S">
+  <Period>
+    <AdaptationSet id="0" contentType="video">
+      <Representation id="1" mimeType="video/mp4" codecs="avc1" bandwidth="100000" width="320" height="180">
+        <SegmentTemplate timescale="1000" media="seg-$Number%05d$.m4s" initialization="init.mp4" startNumber="1">
+          <SegmentTimeline>{timeline}</SegmentTimeline>
+        </SegmentTemplate>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+class DynamicMPDTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_dynamic_mpd"
+
+    def write_mpd(self, timeline: str, type_: str = "dynamic", mtime: int = 1_000_000):
+        with open(self.mpd_path, "w") as f:
+            f.write(MPD_TEMPLATE.format(type=type_, timeline=timeline))
+        os.utime(self.mpd_path, (mtime, mtime))
+
+    async def asyncSetUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+        self.mpd_path = join(self.run_dir, "live.mpd")
+        config = PlayerConfig(input=self.mpd_path, time_factor=0)
+        self.downloader = LocalClient()
+        await self.downloader.setup(config)
+        self.provider = MPDProviderImpl()
+        await self.provider.setup(config, self.downloader)
+
+    async def asyncTearDown(self):
+        await self.downloader.cleanup()
+
+    async def test_refresh(self):
+        self.write_mpd('<S t="0" d="2000" r="1"/>')
+        await self.provider.run()
+        mpd = self.provider.mpd
+        assert mpd is not None
+        assert mpd.minimum_update_period == 2
+        assert (mpd.first_segment, mpd.last_segment) == (1, 2)
+
+        # Refreshes are limited by minimumUpdatePeriod
+        await self.provider.update()
+        assert self.downloader.get_response(self.mpd_path) is not None
+        self.provider.last_updated = 0
+
+        # Unchanged MPD: 304, the model is kept as is
+        await self.provider.update()
+        assert self.downloader.get_response(self.mpd_path).status == 304
+        assert self.provider.mpd is mpd and mpd.version == 0
+
+        # New S entries are merged into the current model
+        self.write_mpd('<S t="0" d="2000" r="1"/><S d="1000" r="1"/>', mtime=1_000_010)
+        self.provider.last_updated = 0
+        await self.provider.update()
+        assert self.downloader.get_response(self.mpd_path).status == 200
+        assert self.provider.mpd is mpd and mpd.version == 1
+        assert mpd.last_segment == 4 and mpd.adaptation_sets[0].last_segment == 4
+        segment = self.provider.segment_by_url(join(self.run_dir, "seg-00004.m4s"))
+        assert segment is not None and (segment.start_time, segment.duration) == (5, 1)
+
+        # The MPD becomes static, waiting for a segment beyond the end returns
+        self.write_mpd('<S t="0" d="2000" r="1"/><S d="1000" r="2"/>', type_="static", mtime=1_000_020)
+        self.provider.last_updated = 0
+        await self.provider.update()
+        mpd = await self.provider.wait_for_segment(100)
+        assert mpd.type == "static" and mpd.last_segment == 5
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+from os.path import join
+
+import numpy as np
+
+from istream_player.config.config import PlayerConfig
+from istream_player.modules.downloader.emulated import EmulatedClient
+from istream_player.utils.bandwidth_trace import BandwidthTrace, TraceLibrary
+
+import switch_rate
+from tests.throttle_utils import VirtualClock, download_all, make_segments
+
+
+class EmulatedDownloaderTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_emulated_downloader"
+    time_factor = 0.1
+
+    def setUp(self):
+        self.segment_path = make_segments(self.run_dir, 1, 100_000)[0]
+
+    def test_trace(self):
+        path = join(self.run_dir, "trace_0.csv")
+        with open(path, "w") as f:
+            f.write("timestamp_ms,bandwidth_kbit_s\n0,800\n1000,800\n2000,1600\n")
+        trace = BandwidthTrace.load(path)
+        assert trace.period == 2 and trace.period_bytes == 300_000
+        assert trace.rate_at(0.5) == 100_000 and trace.rate_at(2.5) == 100_000 and trace.rate_at(1.5) == 200_000
+        assert trace.bytes_until(1.5) == 200_000
+        assert trace.bytes_until(3) == 400_000
+        assert trace.time_for_bytes(200_000) == 1.5
+        assert trace.time_for_bytes(500_000) == 3.5
+
+    def test_trace_library(self):
+        path = join(self.run_dir, "traces.npz")
+        TraceLibrary.save(path, ["a.log", "b.log"], [np.array([800, 1600], np.float32), np.array([400] * 3, np.float32)], 1000)
+        library = TraceLibrary(path)
+        assert isinstance(library.rates, np.memmap)
+        assert len(library) == 2 and library.names == ["a.log", "b.log"]
+        assert list(library.mean) == [1200, 400] and list(library.duration) == [2, 3]
+        assert list(library.kbit(1)) == [400] * 3
+
+        trace = BandwidthTrace.load(path + "#0")
+        assert trace.period == 2 and trace.rate_at(0.5) == 100_000 and trace.rate_at(1.5) == 200_000
+
+        # The rate applier of the switch reads the same rates without NumPy
+        rates, step = switch_rate.read_library_trace(path, 1)
+        assert list(rates) == [400] * 3 and step == 1
+        assert switch_rate.load_library_trace(path, 0) == ([(0, 800), (1, 1600)], 2)
+
+    def test_empty_trace_keeps_indices(self):
+        path = join(self.run_dir, "traces.npz")
+        TraceLibrary.save(path, ["a.log", "empty.log", "c.log"], [np.array([800], np.float32), np.zeros(0, np.float32),
+                                                                  np.array([400] * 2, np.float32)], 1000)
+        library = TraceLibrary(path)
+        assert len(library) == 3 and list(library.kbit(2)) == [400] * 2 and np.isnan(library.mean[1])
+        assert list(switch_rate.read_library_trace(path, 2)[0]) == [400] * 2
+        with self.assertRaises(ValueError):
+            switch_rate.load_library_trace(path, 1)
+
+    async def make_clients(self, link: str):
+        clients = []
+        for _ in range(2):
+            # Each client is its own player
+            config = PlayerConfig(input=self.segment_path, time_factor=self.time_factor)
+            client = EmulatedClient(bw_kbit="800", link=link)
+            await client.setup(config)
+            clients.append(client)
+        return clients
+
+    async def test_shared_link(self):
+        with VirtualClock(asyncio.get_running_loop()):
+            # 100 kB at 100 kB/s per player, the first 20 kB packet is sent with the burst
+            clients = await self.make_clients("")
+            separate = await download_all([(client, self.segment_path) for client in clients], self.time_factor)
+            for t in separate:
+                self.assertAlmostEqual(t, 0.8)
+
+            # Both transfers share the bottleneck, packet by packet
+            clients = await self.make_clients("bottleneck")
+            shared = sorted(await download_all([(client, self.segment_path) for client in clients], self.time_factor))
+            self.assertAlmostEqual(shared[1], 1.8)
+            assert 0.8 < shared[0] < 1.8, shared
+
+    def test_invalid_loss(self):
+        # Every packet would be lost again, forever
+        for loss in ("1", "1.5", "-0.1"):
+            with self.assertRaises(Exception):
+                EmulatedClient(loss=loss)
+        assert EmulatedClient(loss="0.99").loss == 0.99
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import unittest
+from os.path import join
+
+from parameterized import parameterized
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.module_composer import PlayerComposer
+from istream_player.modules.analyzer.file_content_listener import \
+    SegmentContainer
+
+
+class FileSaverTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_file_saver"
+
+    def make_config(self, file_saver: str):
+        config = PlayerConfig(
+            input="./tests/resources/static_1as_5repr_4seg.mpd",
+            run_dir=self.run_dir,
+            mod_abr="dash",
+            mod_analyzer=[file_saver],
+            mod_downloader="local",
+            time_factor=0
+        )
+        config.static.max_initial_bitrate = 100_000
+        return config
+
+    def setUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    async def play(self, file_saver: str):
+        composer = PlayerComposer()
+        composer.register_core_modules()
+        async with composer.make_player(self.make_config(file_saver)) as player:
+            await player.run()
+
+    @parameterized.expand([["file_saver"], ["file_saver:max_pending=1"]])
+    async def test_files(self, file_saver: str):
+        await self.play(file_saver)
+        download_dir = join(self.run_dir, "downloaded")
+        saved = [name for name in os.listdir(download_dir) if name.endswith(".m4s")]
+        # 4 segments and at least one init segment
+        assert len(saved) >= 5
+        for name in saved:
+            with open(join(download_dir, name), "rb") as f, open(join("./tests/resources/chunks", name), "rb") as o:
+                assert f.read() == o.read()
+
+    async def test_container(self):
+        await self.play("file_saver:container=true")
+        container = SegmentContainer(join(self.run_dir, "downloaded"))
+        assert len([url for url in container if url.endswith(".m4s")]) >= 5
+        for url in container:
+            assert container.entries[url]["complete"]
+            with open(url, "rb") as f:
+                assert container.read(url) == f.read()
+
+
+if __name__ == "__main__":
+    unittest.main()
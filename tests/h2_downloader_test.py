@@ -0,0 +1,138 @@
+import asyncio
+import unittest
+from typing import List
+
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.events import RequestReceived, StreamReset
+from h2.exceptions import StreamClosedError
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.downloader import DownloadEventListener, DownloadRequest, DownloadType
+from istream_player.modules.downloader.http2 import H2ClientImpl
+
+BODY = bytes(1000)
+
+
+class ScriptedH2Server:
+    """
+    HTTP/2 server answering by path:
+    /goaway closes the connection with GOAWAY, /stall sends the headers and 1000 of 100000 bytes,
+    /echo/* gets its path as body, anything else gets a 1000 bytes body
+    """
+
+    def __init__(self):
+        self.connections: List[asyncio.StreamWriter] = []
+        self.resets: List[str] = []
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections.append(writer)
+        conn = H2Connection(config=H2Configuration(client_side=False, header_encoding="utf-8"))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        paths = {}
+
+        while data := await reader.read(65536):
+            for event in conn.receive_data(data):
+                if isinstance(event, RequestReceived):
+                    path = dict(event.headers)[":path"]
+                    paths[event.stream_id] = path
+                    if path == "/goaway":
+                        conn.close_connection()
+                        writer.write(conn.data_to_send())
+                        await writer.drain()
+                        writer.close()
+                        return
+                    try:
+                        if path == "/stall":
+                            conn.send_headers(event.stream_id, [(":status", "200"), ("content-length", "100000")])
+                            conn.send_data(event.stream_id, BODY)
+                        else:
+                            body = path.encode() if path.startswith("/echo/") else BODY
+                            conn.send_headers(event.stream_id, [(":status", "200"), ("content-length", str(len(body)))])
+                            conn.send_data(event.stream_id, body, end_stream=True)
+                    except StreamClosedError:
+                        # Reset in the same read as the request
+                        pass
+                elif isinstance(event, StreamReset):
+                    self.resets.append(paths[event.stream_id])
+            writer.write(conn.data_to_send())
+            await writer.drain()
+        writer.close()
+
+
+class H2DownloaderTest(unittest.IsolatedAsyncioTestCase):
+    base_url = "http://localhost:8082"
+
+    async def asyncSetUp(self):
+        self.h2_server = ScriptedH2Server()
+        self.server = await asyncio.start_server(self.h2_server.handle, "localhost", 8082)
+        self.client = H2ClientImpl()
+        await self.client.setup(PlayerConfig(input=self.base_url))
+
+    async def asyncTearDown(self):
+        await self.client.cleanup()
+        for writer in self.h2_server.connections:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def fetch(self, path: str):
+        url = self.base_url + path
+        await self.client.download(DownloadRequest(url, DownloadType.SEGMENT))
+        return await asyncio.wait_for(self.client.wait_complete(url), 5)
+
+    async def test_goaway(self):
+        # A stream in flight on the closed connection is dropped
+        stalled = self.base_url + "/stall"
+        await self.client.download(DownloadRequest(stalled, DownloadType.SEGMENT))
+        assert await self.fetch("/goaway") is None
+        assert await asyncio.wait_for(self.client.wait_complete(stalled), 5) is None
+        assert len(self.client._sessions) == 0 and len(self.client._reader_tasks) == 0
+
+        # The next request opens a new connection
+        content, size = await self.fetch("/segment-1.m4s")
+        assert size == len(BODY) and bytes(content) == BODY
+        assert len(self.h2_server.connections) == 2
+
+    async def test_stop(self):
+        url = self.base_url + "/stall"
+        await self.client.download(DownloadRequest(url, DownloadType.SEGMENT))
+        while len(self.client._content[url]) < len(BODY):
+            await asyncio.sleep(0.01)
+        await self.client.stop(url)
+        content, size = await asyncio.wait_for(self.client.wait_complete(url), 5)
+        # The bytes received until the stop are kept
+        assert len(content) == len(BODY) and size == 100000
+
+        # The other streams of the connection go on
+        content, size = await self.fetch("/segment-1.m4s")
+        assert bytes(content) == BODY
+        assert self.h2_server.resets == ["/stall"]
+        assert len(self.h2_server.connections) == 1
+
+    async def test_drop(self):
+        url = self.base_url + "/stall"
+        await self.client.download(DownloadRequest(url, DownloadType.SEGMENT))
+        await self.client.drop_url(url)
+        assert await asyncio.wait_for(self.client.wait_complete(url), 5) is None
+        content, size = await self.fetch("/segment-1.m4s")
+        assert bytes(content) == BODY
+
+    async def test_concurrent_requests(self):
+        class SlowStartListener(DownloadEventListener):
+            async def on_transfer_start(self, url):
+                # Like the decoder started by the playback for the init segments
+                await asyncio.sleep(0.01)
+
+        self.client.add_listener(SlowStartListener())
+        urls = [f"{self.base_url}/echo/{i}" for i in range(4)]
+        await asyncio.gather(*[self.client.download(DownloadRequest(url, DownloadType.SEGMENT)) for url in urls])
+        for i, url in enumerate(urls):
+            content, size = await asyncio.wait_for(self.client.wait_complete(url), 5)
+            assert bytes(content) == f"/echo/{i}".encode()
+        assert len(self.h2_server.connections) == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import datetime
+import os
+import shutil
+import unittest
+from os.path import join
+
+from aioquic.asyncio import QuicConnectionProtocol, serve
+from aioquic.h3.connection import H3_ALPN, H3Connection
+from aioquic.h3.events import HeadersReceived
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.events import ProtocolNegotiated
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.downloader import DownloadRequest, DownloadType
+from istream_player.modules.downloader.quic.client import QuicClientImpl
+
+BODY = bytes(50_000)
+
+
+def write_certificate(run_dir: str):
+    """Self-signed certificate of localhost, the client does not verify it"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = join(run_dir, "cert.pem"), join(run_dir, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+    return cert_path, key_path
+
+
+class H3ServerProtocol(QuicConnectionProtocol):
+    """Answers every request with a 50000 bytes body"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._http = None
+
+    def quic_event_received(self, event):
+        if isinstance(event, ProtocolNegotiated):
+            self._http = H3Connection(self._quic)
+        if self._http is None:
+            return
+        for http_event in self._http.handle_event(event):
+            if isinstance(http_event, HeadersReceived):
+                self._http.send_headers(
+                    http_event.stream_id, [(b":status", b"200"), (b"content-length", str(len(BODY)).encode())]
+                )
+                self._http.send_data(http_event.stream_id, BODY, end_stream=True)
+        self.transmit()
+
+
+class H3DownloaderTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_h3_downloader"
+    port = 8443
+
+    async def asyncSetUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+        configuration = QuicConfiguration(alpn_protocols=H3_ALPN, is_client=False)
+        configuration.load_cert_chain(*write_certificate(self.run_dir))
+        self.server = await serve("localhost", self.port, configuration=configuration, create_protocol=H3ServerProtocol)
+        self.client = QuicClientImpl()
+        await self.client.setup(config=PlayerConfig(input=f"https://localhost:{self.port}/"))
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.server.close()
+
+    async def test_timing(self):
+        url = f"https://localhost:{self.port}/segment-1.m4s"
+        await self.client.download(DownloadRequest(url, DownloadType.SEGMENT))
+        content, size = await asyncio.wait_for(self.client.wait_complete(url), 10)
+        assert size == len(BODY) and bytes(content) == BODY
+
+        timing = self.client.get_timing(url)
+        assert timing is not None and timing.bytes == len(BODY) and timing.chunks > 0
+        assert timing.request_ns <= timing.headers_ns <= timing.first_byte_ns <= timing.last_byte_ns == timing.end_ns
+        assert timing.ttfb is not None and timing.ttfb >= 0
+
+
+if __name__ == "__main__":
+    unittest.main()
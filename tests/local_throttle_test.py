@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+from os.path import join
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.downloader import DownloadEventListener
+from istream_player.modules.downloader.local import LocalClient
+
+from tests.throttle_utils import VirtualClock, download_all, make_segments
+
+
+class LocalThrottleTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_local_throttle"
+    time_factor = 0.1
+
+    def setUp(self):
+        self.paths = make_segments(self.run_dir, 2, 100_000)
+
+    async def download_all(self, client: LocalClient):
+        """Download the segments in parallel and return their completion time in trace seconds"""
+        with VirtualClock(asyncio.get_running_loop()):
+            await client.setup(PlayerConfig(input=self.paths[0], time_factor=self.time_factor))
+            return sorted(await download_all([(client, path) for path in self.paths], self.time_factor))
+
+    async def test_share_client(self):
+        # 200 kB at 100 kB/s, in 20 kB chunks of both segments
+        times = await self.download_all(LocalClient(bw="100000"))
+        self.assertAlmostEqual(times[0], 1.8)
+        self.assertAlmostEqual(times[1], 2.0)
+
+    async def test_share_url(self):
+        times = await self.download_all(LocalClient(bw="100000", share="url"))
+        self.assertAlmostEqual(times[0], 1.0)
+        self.assertAlmostEqual(times[1], 1.0)
+
+    async def test_trace(self):
+        trace_path = join(self.run_dir, "trace_0.csv")
+        # 400 kbit/s (50 kB/s) for 1 s, then 1600 kbit/s (200 kB/s)
+        with open(trace_path, "w") as f:
+            f.write("timestamp_ms,bandwidth_kbit_s\n0,400\n1000,400\n10000,1600\n")
+        times = await self.download_all(LocalClient(trace=trace_path))
+        # 50 kB in the first second, 150 kB in the next 0.75 s
+        self.assertAlmostEqual(times[0], 1.65)
+        self.assertAlmostEqual(times[1], 1.75)
+
+    async def test_chunk_timestamps(self):
+        class SlowListener(DownloadEventListener):
+            def __init__(self):
+                self.stamps = []
+
+            async def on_bytes_transferred(self, length, url, position, size, content, timestamp_ns=None):
+                self.stamps.append(timestamp_ns)
+                # Slower than the link, the stamps must not be delayed by the dispatch
+                await asyncio.sleep(0.05)
+
+        client = LocalClient(bw="100000")
+        listener = SlowListener()
+        client.add_listener(listener)
+        self.paths = self.paths[:1]
+        await self.download_all(client)
+
+        timing = client.get_timing(self.paths[0])
+        assert timing is not None and timing.end_ns is not None
+        assert timing.chunks == 5 and timing.bytes == 100_000
+        assert listener.stamps[0] == timing.first_byte_ns and listener.stamps[-1] == timing.last_byte_ns
+        # 20 kB at 100 kB/s with the time factor
+        self.assertAlmostEqual(timing.ttfb, 0.02)
+        # 4 chunks of 20 kB after the first one, 0.08 s instead of 0.2 s of dispatch
+        self.assertAlmostEqual((timing.last_byte_ns - timing.first_byte_ns) / 1e9, 0.08)
+
+
+if __name__ == "__main__":
+    unittest.main()
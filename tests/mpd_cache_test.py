@@ -0,0 +1,53 @@
+import os
+import shutil
+import unittest
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.module_composer import PlayerComposer
+from istream_player.modules.mpd.cache import MPDCache
+
+
+class MPDCacheTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_mpd_cache"
+    cache_dir = "./runs/test_mpd_cache/cache"
+
+    def setUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+        # Sessions of a process share the composer, like the wrapper does
+        self.composer = PlayerComposer()
+        self.composer.register_core_modules()
+
+    async def run_session(self, n: int):
+        config = PlayerConfig(
+            input="./tests/resources/static_1as_5repr_4seg.mpd",
+            run_dir=self.run_dir,
+            session_id=f"session-{n}",
+            mod_mpd=f"mpd:cache_dir={self.cache_dir}",
+            mod_downloader="local",
+            time_factor=0,
+        )
+        async with self.composer.make_player(config) as player:
+            await player.run()
+        return player.modules["mpd"]["mpd"]
+
+    async def test_sessions_share_mpd(self):
+        first_provider = await self.run_session(1)
+        second_provider = await self.run_session(2)
+        # Each session gets its own modules
+        assert second_provider is not first_provider
+        first, second = first_provider.mpd, second_provider.mpd
+        # The second session revalidates the MPD and reuses the parsed one
+        assert second is first
+
+        # A new process would load it from the directory
+        entry = MPDCache(self.cache_dir).get("./tests/resources/static_1as_5repr_4seg.mpd")
+        assert entry is not None and entry.mpd is not None
+        assert entry.validators.keys() == {"If-None-Match", "If-Modified-Since"}
+        assert entry.mpd.last_segment == first.last_segment == 4
+        adaptation_set = entry.mpd.adaptation_sets[0]
+        assert adaptation_set.ladder.ranks == first.adaptation_sets[0].ladder.ranks
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import pickle
+import unittest
+
+from istream_player.models import BitrateLadder, SegmentUrlTemplate, TemplateSegments, TimelineSegments
+from istream_player.modules.mpd.parser import DefaultMPDParser
+
+MPD_PATH = "./tests/resources/static_1as_5repr_4seg.mpd"
+
+
+def parse_mpd(path: str = MPD_PATH):
+    with open(path) as f:
+        return DefaultMPDParser().parse(f.read(), path)
+
+
+def timeline(start_number: int, *runs) -> TimelineSegments:
+    segments = TimelineSegments(SegmentUrlTemplate("seg-$Number$.m4s"), "init.mp4", 0, 0, start_number)
+    for start_time, duration, count in runs:
+        segments.add_run(start_time, duration, count)
+    return segments
+
+
+class SegmentUrlTemplateTest(unittest.TestCase):
+    def test_round_trip(self):
+        template = SegmentUrlTemplate("chunks/chunk-stream0-$Number$.m4s")
+        for number in (0, 1, 9, 10, 123456):
+            assert template.parse(template.format(number)) == number
+        assert template.format(7) == "chunks/chunk-stream0-7.m4s"
+
+    def test_padded_round_trip(self):
+        template = SegmentUrlTemplate("chunks/chunk-stream0-$Number%05d$.m4s")
+        assert template.format(7) == "chunks/chunk-stream0-00007.m4s"
+        # Wider than the padding
+        assert template.format(1234567) == "chunks/chunk-stream0-1234567.m4s"
+        for number in (0, 1, 99999, 100000, 1234567):
+            assert template.parse(template.format(number)) == number
+
+    def test_parse_other_urls(self):
+        template = SegmentUrlTemplate("seg-$Number%05d$.m4s")
+        for url in ("seg-.m4s", "seg-0000a.m4s", "other-00001.m4s", "seg-00001.mp4", "init.mp4", "seg--0001.m4s"):
+            assert template.parse(url) is None, url
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            SegmentUrlTemplate("segment.m4s")
+        with self.assertRaises(ValueError):
+            SegmentUrlTemplate("seg-$Time$-$Number$.m4s")
+        assert SegmentUrlTemplate("a-$Number%03d$") == SegmentUrlTemplate("a-$Number%03d$")
+        assert SegmentUrlTemplate("a-$Number%03d$") != SegmentUrlTemplate("a-$Number$")
+
+
+class TemplateSegmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.segments = TemplateSegments(SegmentUrlTemplate("seg-$Number%05d$.m4s"), "init.mp4", 0, 2, 5, 1000, 2.0)
+
+    def test_range(self):
+        segments = self.segments
+        assert (segments.first, segments.last, len(segments)) == (5, 1004, 1000)
+        assert list(segments)[:2] == [5, 6] and list(segments)[-1] == 1004
+
+        first, last = segments[5], segments[1004]
+        assert (first.url, first.start_time, first.duration) == ("seg-00005.m4s", 0, 2)
+        assert (last.url, last.start_time, last.duration) == ("seg-01004.m4s", 1998, 2)
+        assert (last.init_url, last.as_id, last.repr_id) == ("init.mp4", 0, 2)
+        for number in (4, 1005, -1, "5"):
+            assert number not in segments
+            with self.assertRaises(KeyError):
+                segments[number]  # type: ignore
+
+    def test_segment_by_url(self):
+        segments = self.segments
+        assert segments.segment_by_url("seg-00005.m4s") == segments[5]
+        assert segments.segment_by_url("seg-01004.m4s") == segments[1004]
+        assert segments.segment_by_url("seg-01005.m4s") is None and segments.segment_by_url("seg-00004.m4s") is None
+
+    def test_lazy(self):
+        # Nothing is materialized, a huge sequence costs the same as a small one
+        segments = TemplateSegments(SegmentUrlTemplate("seg-$Number$.m4s"), "init.mp4", 0, 0, 1, 10 ** 12, 1.0)
+        assert segments[10 ** 12].url == f"seg-{10 ** 12}.m4s" and segments[10 ** 12].start_time == 10 ** 12 - 1
+
+
+class TimelineSegmentsTest(unittest.TestCase):
+    def test_contiguous_runs_extended(self):
+        segments = timeline(1, (0, 2, 2), (None, 2, 1), (6, 2, 1), (8, 1, 2))
+        assert list(segments.run_counts) == [4, 2] and list(segments.run_durations) == [2, 1]
+        assert (segments[4].start_time, segments[5].start_time) == (6, 8)
+
+        # A gap in the timeline starts a new run
+        segments.add_run(20, 1, 1)
+        assert list(segments.run_counts) == [4, 2, 1] and segments[7].start_time == 20
+
+    def test_merge_extends_last_run(self):
+        segments = timeline(1, (0, 2, 3))
+        for refresh in range(3, 100):
+            # Sliding window of three segments, one new segment per refresh
+            segments.merge(timeline(refresh - 1, ((refresh - 2) * 2, 2, 3)))
+            assert (segments.first, segments.last) == (refresh - 1, refresh + 1)
+        assert len(segments.run_numbers) == 1 and len(segments) == 3
+        assert segments[100].start_time == 198 and segments[100].url == "seg-100.m4s"
+        with self.assertRaises(KeyError):
+            segments[97]
+
+    def test_merge_drops_expired_runs(self):
+        segments = timeline(1, (0, 2, 2), (None, 1, 2), (None, 4, 1))
+        segments.merge(timeline(4, (5, 1, 1), (6, 4, 1), (10, 3, 2)))
+        assert (segments.first, segments.last) == (4, 7)
+        assert list(segments.run_numbers) == [4, 5, 6] and list(segments.run_counts) == [1, 1, 2]
+        assert [segments[number].start_time for number in segments] == [5, 6, 10, 13]
+
+        # An update without new segments still moves the window
+        segments.merge(timeline(6, (10, 3, 2)))
+        assert (segments.first, segments.last) == (6, 7) and list(segments.run_numbers) == [6]
+
+    def test_merge_without_overlap(self):
+        segments = timeline(1, (0, 2, 2))
+        segments.merge(timeline(10, (18, 2, 2)))
+        assert (segments.first, segments.last) == (10, 11) and segments[10].start_time == 18
+
+
+class BitrateLadderTest(unittest.TestCase):
+    def test_ladder(self):
+        ladder = parse_mpd().adaptation_sets[0].ladder
+        assert ladder.ids == (4, 3, 2, 1, 0) and ladder.bandwidths == (15437, 46326, 75046, 122958, 263108)
+        assert ladder.ranks[0] == 4 and (ladder.lowest_id, ladder.highest_id) == (4, 0)
+        assert ladder.highest_below(100_000) == 2 and ladder.highest_below(75046) == 3
+        assert ladder.highest_below(1000) == 4 and ladder.highest_below(10 ** 9) == 0
+        assert ladder.id_of_bandwidth(46326) == 3 and ladder.id_of_bandwidth(46327) is None
+
+    def test_pickle(self):
+        mpd = parse_mpd()
+        ladder = mpd.adaptation_sets[0].ladder
+        copy = pickle.loads(pickle.dumps(ladder))
+        assert isinstance(copy, BitrateLadder)
+        assert (copy.ids, copy.bandwidths, dict(copy.ranks)) == (ladder.ids, ladder.bandwidths, dict(ladder.ranks))
+        # The ranks stay read-only
+        with self.assertRaises(TypeError):
+            copy.ranks[0] = 0  # type: ignore
+        assert copy.highest_below(100_000) == ladder.highest_below(100_000)
+
+        # As part of the whole model, like the MPD cache stores it
+        ladder_copy = pickle.loads(pickle.dumps(mpd)).adaptation_sets[0].ladder
+        assert ladder_copy.ids == ladder.ids and dict(ladder_copy.ranks) == dict(ladder.ranks)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import unittest
+from pathlib import Path
+from os.path import join
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.module_composer import PlayerComposer
+
+import run_experiment
+import wrapper
+
+
+class MultiClientTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_multi_client"
+
+    def setUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    async def test_concurrent_players(self):
+        composer = PlayerComposer()
+        composer.register_core_modules()
+
+        async def run_client(client_id: int):
+            client_dir = join(self.run_dir, str(client_id))
+            os.makedirs(client_dir)
+            config = PlayerConfig(
+                input="./tests/resources/static_1as_5repr_4seg.mpd",
+                run_dir=client_dir,
+                session_id="data-1",
+                mod_downloader="local",
+                time_factor=0,
+            )
+            async with composer.make_player(config) as player:
+                await player.run()
+            return player
+
+        players = await asyncio.gather(*[run_client(i) for i in range(4)])
+
+        # Each client has its own modules and results file
+        assert len({id(player.modules["scheduler"]["scheduler"]) for player in players}) == 4
+        for i in range(4):
+            with open(join(self.run_dir, str(i), "data-1.json")) as f:
+                assert len(json.load(f)["segments"]) == 4
+
+
+class ClientNetworkTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_client_network"
+
+    def setUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+
+    def test_distinct_source_addresses(self):
+        with patch.multiple(wrapper, n_clients=3, client_offset="6", local_addrs=["10.0.0.1", "10.0.0.2", "10.0.0.3"]):
+            clients = wrapper.make_clients()
+        assert [client.client_id for client in clients] == ["6", "7", "8"]
+        assert [client.local_addr for client in clients] == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+
+        # Clients sharing a source address would share their network identity
+        with patch.multiple(wrapper, n_clients=3, client_offset="6", local_addrs=["10.0.0.1"]):
+            with self.assertRaises(ValueError):
+                wrapper.make_clients()
+
+    def test_shared_shaped_link_rejected(self):
+        run_experiment.check_container_clients(1)
+        with self.assertRaises(SystemExit):
+            run_experiment.check_container_clients(4)
+
+    async def test_client_session_config(self):
+        exp_config = join(self.run_dir, "experiment.yaml")
+        with open(exp_config, "w") as f:
+            f.write("sequences: [loot]\n")
+        with patch.dict(os.environ, {"EXPERIMENT_CONFIG": exp_config}):
+            session_wrapper = wrapper.Wrapper()
+        session_wrapper.composer.run = AsyncMock()
+
+        with patch.multiple(wrapper, container_exp="exp", lamda="1000", node_id=""), \
+                patch.dict(os.environ, {"ISTREAM_RUN_DIR": self.run_dir}):
+            for client in [wrapper.Client("1", "10.0.0.1"), wrapper.Client("2", "10.0.0.2")]:
+                await session_wrapper.run_with_config_file(client, "./resources/1s_segments.yaml")
+        configs = [call.args[0] for call in session_wrapper.composer.run.call_args_list]
+        # Each client streams from its own source address into its own results directory
+        assert [config.local_addr for config in configs] == ["10.0.0.1", "10.0.0.2"]
+        assert [config.run_dir for config in configs] == [join(self.run_dir, "exp", "1"), join(self.run_dir, "exp", "2")]
+        assert [config.session_id for config in configs] == ["data-1", "data-1"]
+
+
+class ArrivalScheduleTest(unittest.TestCase):
+    def test_simultaneous(self):
+        assert run_experiment.schedule_arrivals(3) == [0.0, 0.0, 0.0]
+        # Without an interval every process starts the clients together
+        assert run_experiment.schedule_arrivals(3, "poisson", 0) == [0.0, 0.0, 0.0]
+
+    def test_staggered(self):
+        assert run_experiment.schedule_arrivals(4, "staggered", 2.5) == [0.0, 2.5, 5.0, 7.5]
+
+    def test_poisson(self):
+        delays = run_experiment.schedule_arrivals(2000, "poisson", 2.0, seed="1")
+        assert delays[0] == 0.0
+        assert all(a < b for a, b in zip(delays, delays[1:]))
+        # The gaps are exponential with the interval as mean
+        assert abs(delays[-1] / (len(delays) - 1) - 2.0) < 0.2
+        # Every node draws the same arrivals in each run
+        assert delays == run_experiment.schedule_arrivals(2000, "poisson", 2.0, seed="1")
+        assert delays != run_experiment.schedule_arrivals(2000, "poisson", 2.0, seed="2")
+
+    def test_unknown_process(self):
+        with self.assertRaises(ValueError):
+            run_experiment.schedule_arrivals(2, "burst", 1.0)
+
+
+class NativeRunnerTest(unittest.TestCase):
+    run_dir = Path("./runs/test_native_runner")
+
+    def setUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        self.run_dir.mkdir(parents=True)
+
+    def test_workers_terminated_on_failed_start(self):
+        barrier = MagicMock()
+        barrier.wait.side_effect = threading.BrokenBarrierError()
+        workers = []
+
+        def make_process(**kwargs):
+            workers.append(MagicMock())
+            return workers[-1]
+
+        cfg = {
+            "n_containers": 2, "sleep_lambda": 1, "istream_player_config_path": "", "duration": 1, "workers": 2,
+        }
+        with patch.object(run_experiment.multiprocessing, "Barrier", return_value=barrier), \
+                patch.object(run_experiment.multiprocessing, "Queue"), \
+                patch.object(run_experiment.multiprocessing, "Process", side_effect=make_process), \
+                patch.object(run_experiment, "CONTROL_FILE", self.run_dir / "run.flag"), \
+                patch.dict(os.environ):
+            with self.assertRaises(threading.BrokenBarrierError):
+                run_experiment.run_native(cfg, "experiment.yaml", self.run_dir, "exp")
+
+        assert len(workers) == 2
+        for worker in workers:
+            worker.terminate.assert_called_once()
+            worker.join.assert_called_once()
+        assert (self.run_dir / "run.flag").read_text() == "0"
+
+
+if __name__ == "__main__":
+    unittest.main()
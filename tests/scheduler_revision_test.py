@@ -0,0 +1,217 @@
+import asyncio
+import unittest
+from typing import Dict, List, Optional, Tuple
+
+from istream_player.core.bw_meter import DownloadStats
+from istream_player.core.downloader import DownloadManager, DownloadRequest
+from istream_player.models import AdaptationSet, Segment
+from istream_player.modules.bw_meter.bandwidth import BandwidthMeterImpl
+from istream_player.modules.bw_meter.bandwidth_bytes import BandwidthMeterBytes
+from istream_player.modules.mpd.parser import DefaultMPDParser
+from istream_player.modules.scheduler.scheduler import SchedulerImpl
+
+MPD_PATH = "./tests/resources/static_1as_5repr_4seg.mpd"
+
+
+class FakeDownloader(DownloadManager):
+    per_url_cancel = True
+
+    def __init__(self):
+        super().__init__()
+        self.requested: List[str] = []
+        self.dropped: List[str] = []
+
+    @property
+    def is_busy(self):
+        return False
+
+    async def download(self, req: DownloadRequest, save: bool = False) -> Optional[bytes]:
+        self.requested.append(req.url)
+        return None
+
+    async def wait_complete(self, url: str) -> Optional[Tuple[memoryview, int]]:
+        return None if url in self.dropped else (memoryview(b""), 0)
+
+    async def drop_url(self, url: str):
+        self.dropped.append(url)
+
+    async def close(self):
+        pass
+
+    async def stop(self, url: str):
+        pass
+
+    def cancel_read_url(self, url: str):
+        pass
+
+
+class FakeBandwidthMeter(object):
+    def __init__(self, bandwidth: float):
+        self.bandwidth = bandwidth
+
+
+class BandwidthABR(object):
+    """Highest representation below the bandwidth estimate"""
+
+    def __init__(self, bandwidth_meter: FakeBandwidthMeter):
+        self.bandwidth_meter = bandwidth_meter
+
+    def update_selection(self, adaptation_sets: Dict[int, AdaptationSet], index: int) -> Dict[int, int]:
+        return {
+            as_id: adaptation_set.ladder.highest_below(self.bandwidth_meter.bandwidth)
+            for as_id, adaptation_set in adaptation_sets.items()
+        }
+
+
+class SchedulerRevisionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        with open(MPD_PATH) as f:
+            mpd = DefaultMPDParser().parse(f.read(), MPD_PATH)
+        self.scheduler = SchedulerImpl(pipeline_depth="3")
+        self.downloader = FakeDownloader()
+        self.bandwidth_meter = FakeBandwidthMeter(100_000)
+        self.scheduler.download_manager = self.downloader
+        self.scheduler.bandwidth_meter = self.bandwidth_meter
+        self.scheduler.abr_controller = BandwidthABR(self.bandwidth_meter)
+        self.scheduler.adaptation_sets = mpd.adaptation_sets
+        # Initialization segments are not part of the test
+        self.scheduler._representation_initialized = {
+            f"{as_id}:{repr_id}" for as_id, adaptation_set in mpd.adaptation_sets.items()
+            for repr_id in adaptation_set.representations.keys()
+        }
+        for index in (1, 2):
+            self.scheduler._in_flight.append(await self.scheduler.request_index(index))
+
+    async def test_revise_not_started(self):
+        low_urls = [url for entry in self.scheduler._in_flight for url in entry.urls]
+        self.bandwidth_meter.bandwidth = 10_000_000
+        await self.scheduler.revise_queued_indices()
+
+        assert self.downloader.dropped == low_urls
+        high_urls = [url for entry in self.scheduler._in_flight for url in entry.urls]
+        assert self.downloader.requested == low_urls + high_urls
+        assert not set(high_urls) & set(low_urls)
+        assert [entry.bandwidth for entry in self.scheduler._in_flight] == [10_000_000, 10_000_000]
+
+    async def test_keep_started(self):
+        started_url = self.scheduler._in_flight[0].urls[0]
+        await self.scheduler.on_bytes_transferred(100, started_url, 100, 1000, b"")
+        self.bandwidth_meter.bandwidth = 10_000_000
+        await self.scheduler.revise_queued_indices()
+
+        assert self.scheduler._in_flight[0].urls == [started_url]
+        assert self.downloader.dropped == [self.downloader.requested[1]]
+
+    async def test_same_bandwidth(self):
+        await self.scheduler.revise_queued_indices()
+        assert self.downloader.dropped == [] and len(self.downloader.requested) == 2
+
+
+class FailingInitDownloader(FakeDownloader):
+    """Drops the first transfer of every initialization segment"""
+
+    async def wait_complete(self, url: str) -> Optional[Tuple[memoryview, int]]:
+        await asyncio.sleep(0)
+        if self.requested.count(url) == 1:
+            return None
+        return memoryview(b""), 0
+
+
+class InitializationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_initialization(self):
+        with open(MPD_PATH) as f:
+            mpd = DefaultMPDParser().parse(f.read(), MPD_PATH)
+        representation = mpd.adaptation_sets[0].representations[0]
+        scheduler = SchedulerImpl()
+        scheduler.download_manager = downloader = FailingInitDownloader()
+
+        # The waiting transfers are woken up, and one of them downloads it again
+        await asyncio.wait_for(
+            asyncio.gather(*[scheduler.initialize_representation(0, representation) for _ in range(3)]), 5
+        )
+        assert downloader.requested == [representation.initialization] * 2
+        assert scheduler._representation_initialized == {"0:0"} and scheduler._pending_initializations == {}
+
+    async def test_raising_initialization(self):
+        with open(MPD_PATH) as f:
+            mpd = DefaultMPDParser().parse(f.read(), MPD_PATH)
+        representation = mpd.adaptation_sets[0].representations[0]
+        scheduler = SchedulerImpl()
+        scheduler.download_manager = downloader = FakeDownloader()
+
+        async def fail(req, save=False):
+            raise ConnectionError()
+
+        downloader.download = fail
+        with self.assertRaises(ConnectionError):
+            await scheduler.initialize_representation(0, representation)
+        assert scheduler._representation_initialized == set() and scheduler._pending_initializations == {}
+
+
+class BandwidthMeterStatsTest(unittest.IsolatedAsyncioTestCase):
+    def make_meter(self, meter_class=BandwidthMeterImpl):
+        meter = meter_class()
+        meter._bw = 100_000
+        meter.smooth_factor = 0.5
+        return meter
+
+    @staticmethod
+    async def transfer(meter: BandwidthMeterImpl, url: str):
+        await meter.on_transfer_start(url)
+        await meter.on_bytes_transferred(100, url, 100, 100, b"")
+        await meter.on_transfer_end(100, url)
+
+    @staticmethod
+    def segments(index: int, n_tiles: int):
+        return {tile: Segment(f"u{tile}-{index}", "init.mp4", 1, index, tile, 0) for tile in range(n_tiles)}
+
+    async def test_init_stats_released(self):
+        meter = self.make_meter()
+        await meter.on_segment_download_start(1, {}, self.segments(1, 1))
+        # Init segments are never reported by the scheduler
+        for i in range(10):
+            await self.transfer(meter, f"init-{i}.m4s")
+        await self.transfer(meter, "u0-1")
+        assert meter.get_stats("u0-1").received_bytes == 100
+        await meter.on_segment_download_complete(1, self.segments(1, 1), {})
+        assert meter.stats == {} and meter._finished == {} and meter._expected == {}
+
+    async def test_pipelined_tiles(self):
+        for meter_class in (BandwidthMeterImpl, BandwidthMeterBytes):
+            await self.pipelined_tiles(self.make_meter(meter_class))
+
+    async def pipelined_tiles(self, meter):
+        # 24 tiles with a pipeline depth of 3: 72 transfers complete before the first index is reported
+        for index in (1, 2, 3):
+            await meter.on_segment_download_start(index, {}, self.segments(index, 24))
+        for index in (1, 2, 3):
+            for segment in self.segments(index, 24).values():
+                await self.transfer(meter, segment.url)
+
+        for index in range(1, 10):
+            segments = self.segments(index, 24)
+            stats = {tile: meter.get_stats(segment.url) for tile, segment in segments.items()}
+            assert all(st.received_bytes == 100 for st in stats.values())
+            await meter.on_segment_download_complete(index, segments, stats)
+            # The next index of the pipeline
+            await meter.on_segment_download_start(index + 3, {}, self.segments(index + 3, 24))
+            for segment in self.segments(index + 3, 24).values():
+                await self.transfer(meter, segment.url)
+            assert len(meter._finished) + len(meter.stats) <= 3 * 24
+
+    async def test_revised_stats_released(self):
+        meter = self.make_meter()
+        await meter.on_segment_download_start(2, {}, self.segments(2, 1))
+        await self.transfer(meter, "u0-2")
+        await meter.on_segment_download_start(1, {}, self.segments(1, 1))
+        await self.transfer(meter, "u0-1")
+        await meter.on_segment_download_complete(1, self.segments(1, 1), {})
+        assert list(meter._finished) == ["u0-2"]
+
+        # Index 2 is requested again with another segment
+        revised = {0: Segment("u0-2-high", "init.mp4", 1, 2, 0, 0)}
+        await meter.on_segment_download_start(2, {}, revised)
+        assert meter._finished == {}
+
+if __name__ == "__main__":
+    unittest.main()
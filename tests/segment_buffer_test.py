@@ -0,0 +1,54 @@
+import unittest
+
+from istream_player.utils.segment_buffer import SegmentBuffer
+
+
+class SegmentBufferTest(unittest.TestCase):
+    def test_known_size(self):
+        buffer = SegmentBuffer(6)
+        chunk_view = buffer.append(b"abc")
+        assert bytes(chunk_view) == b"abc" and len(buffer) == 3
+        assert bytes(buffer.view()) == b"abc"
+        buffer.append(b"def")
+        assert bytes(buffer.view()) == b"abcdef"
+
+        # The chunks and the content are views of the preallocated buffer, not copies
+        assert chunk_view.obj is buffer._buffer and buffer.view().obj is buffer._buffer
+        buffer._buffer[0] = ord("x")
+        assert bytes(chunk_view) == b"xbc"
+
+    def test_unknown_size(self):
+        buffer = SegmentBuffer()
+        for chunk in (b"ab", b"cd", b"e"):
+            assert bytes(buffer.append(chunk)) == chunk
+        assert len(buffer) == 5 and buffer._buffer is None
+        assert bytes(buffer.view()) == b"abcde"
+
+        # Joined once, the next views share the joined bytes until more bytes arrive
+        content = buffer.view()
+        assert len(buffer._chunks) == 1 and buffer.view().obj is content.obj
+        buffer.append(b"fg")
+        assert bytes(buffer.view()) == b"abcdefg" and len(buffer) == 7
+
+    def test_past_content_length(self):
+        buffer = SegmentBuffer(4)
+        buffer.append(b"abc")
+        assert bytes(buffer.append(b"def")) == b"def"
+        assert len(buffer) == 6 and buffer._buffer is None
+        assert bytes(buffer.view()) == b"abcdef"
+
+    def test_discard(self):
+        buffer = SegmentBuffer(10, discard=True)
+        assert bytes(buffer.append(b"abcd")) == b"abcd"
+        buffer.append(b"efghijkl")
+        # The bytes are counted, past the announced size too, but none is kept
+        assert len(buffer) == 12 and buffer.position == 12
+        assert buffer._buffer is None and buffer._chunks == []
+        assert bytes(buffer.view()) == b""
+
+    def test_empty(self):
+        assert bytes(SegmentBuffer().view()) == b"" and bytes(SegmentBuffer(5).view()) == b""
+
+
+if __name__ == "__main__":
+    unittest.main()
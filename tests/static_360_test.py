@@ -12,6 +12,7 @@ from unittest.mock import patch
 from istream_player.config.config import PlayerConfig
 from istream_player.core.module_composer import PlayerComposer
 from istream_player.modules.downloader.local import LocalClient
+from istream_player.utils.timing import now_ns
 
 MOCK_FILE_CONTEN = randbytes(20_000)
 
@@ -20,14 +21,14 @@ def mock_request_read():
     async def _mock(self: LocalClient, url: str):
         # print("Mock request called", url)
         if not url.endswith(".mpd"):
-            await self.transfer_queue.put((url, bytes(MOCK_FILE_CONTEN)))
-            await self.transfer_queue.put((url, None))
+            await self.transfer_queue.put((url, bytes(MOCK_FILE_CONTEN), now_ns()))
+            await self.transfer_queue.put((url, None, now_ns()))
         else:
             with open(url, "rb") as f:
                 while True:
                     data = f.read(self.max_packet_size)
                     # print(f"Putting {len(data)} bytes for {url}")
-                    await self.transfer_queue.put((url, data))
+                    await self.transfer_queue.put((url, data, now_ns()))
                     if not data:
                         break
 
@@ -40,6 +41,8 @@ def mock_path_stat():
     class MockStat():
         st_size = len(MOCK_FILE_CONTEN)
         st_mode: int = S_IFREG
+        st_mtime: float = 0
+        st_mtime_ns: int = 0
 
     def _mock(path: PosixPath, *args, **kwargs):
         if str(path).endswith('.mpd') or str(path).endswith('.m4s'):
@@ -0,0 +1,101 @@
+import asyncio
+import pathlib
+import unittest
+from typing import Dict, List
+from unittest.mock import patch
+
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.events import RequestReceived, StreamReset
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.module_composer import PlayerComposer
+
+
+class H2StaticServer:
+    """Minimal cleartext HTTP/2 (prior knowledge) server for the files under one directory"""
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+        self.connections: List[asyncio.StreamWriter] = []
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections.append(writer)
+        conn = H2Connection(config=H2Configuration(client_side=False, header_encoding="utf-8"))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        pending: Dict[int, memoryview] = {}
+
+        while data := await reader.read(65536):
+            for event in conn.receive_data(data):
+                if isinstance(event, RequestReceived):
+                    path = dict(event.headers)[":path"]
+                    file = self.root / path.lstrip("/")
+                    if file.is_file():
+                        body = file.read_bytes()
+                        conn.send_headers(event.stream_id, [(":status", "200"), ("content-length", str(len(body)))])
+                        pending[event.stream_id] = memoryview(body)
+                    else:
+                        conn.send_headers(event.stream_id, [(":status", "404")], end_stream=True)
+                elif isinstance(event, StreamReset):
+                    pending.pop(event.stream_id, None)
+            # Send as much as the flow control windows allow
+            for stream_id, body in list(pending.items()):
+                while len(body) > 0:
+                    size = min(conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size, len(body))
+                    if size <= 0:
+                        break
+                    conn.send_data(stream_id, body[:size].tobytes())
+                    body = body[size:]
+                if len(body) == 0:
+                    conn.end_stream(stream_id)
+                    del pending[stream_id]
+                else:
+                    pending[stream_id] = body
+            writer.write(conn.data_to_send())
+            await writer.drain()
+        writer.close()
+
+
+class StaticTest(unittest.IsolatedAsyncioTestCase):
+    def make_config(self):
+        config = PlayerConfig(
+            input="http://localhost:8081/resources/static_1as_5repr_4seg.mpd",
+            run_dir="./runs/test",
+            mod_abr='dash',
+            mod_downloader="h2",
+            mod_analyzer=["data_collector"],
+            time_factor=0
+        )
+        config.static.max_initial_bitrate = 100_000
+        return config
+
+    async def asyncSetUp(self):
+        self.h2_server = H2StaticServer(pathlib.Path(__file__).parent)
+        self.server = await asyncio.start_server(self.h2_server.handle, "localhost", 8081)
+
+    async def asyncTearDown(self) -> None:
+        for writer in self.h2_server.connections:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_static_h2(self):
+        save_file_patcher = patch("istream_player.modules.analyzer.analyzer.PlaybackAnalyzer.save_file")
+        save_file_mock = save_file_patcher.start()
+
+        composer = PlayerComposer()
+        composer.register_core_modules()
+        async with composer.make_player(self.make_config()) as player:
+            await player.run()
+
+        save_file_patcher.stop()
+        save_file_mock.assert_called_once()
+        [path, data] = save_file_mock.call_args.args
+        assert len(data["segments"]) == 4
+        # One connection each for the MPD and the segment downloader
+        assert len(self.h2_server.connections) == 2
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,22 +1,42 @@
 # test_with_pytest.py
 
 
+import asyncio
 import json
+import os
+import shutil
 import unittest
+from os.path import join
+from typing import Dict, List, Tuple
 from unittest.mock import patch
 
 from parameterized import parameterized
 
 from istream_player.config.config import PlayerConfig
+from istream_player.core.downloader import DownloadEventListener
 from istream_player.core.module_composer import PlayerComposer
 
 
+class TransferTimes(DownloadEventListener):
+    """Start and end of every transfer, in event loop time"""
+
+    def __init__(self):
+        self.times: Dict[str, List[float]] = {}
+
+    async def on_transfer_start(self, url) -> None:
+        self.times[url] = [asyncio.get_running_loop().time()]
+
+    async def on_transfer_end(self, size: int, url: str) -> None:
+        self.times[url].append(asyncio.get_running_loop().time())
+
+
 class StaticTest(unittest.IsolatedAsyncioTestCase):
-    def make_config(self, abr: str):
+    def make_config(self, abr: str, scheduler: str):
         config = PlayerConfig(
             input="./tests/resources/static_1as_5repr_4seg.mpd",
             run_dir="./runs/test",
             mod_abr=abr,
+            mod_scheduler=scheduler,
             mod_analyzer=["data_collector:plots_dir=./runs/test/plots"],
             mod_downloader="local:bw=100_000",
             time_factor=1
@@ -24,15 +44,17 @@ class StaticTest(unittest.IsolatedAsyncioTestCase):
         config.static.max_initial_bitrate = 100_000
         return config
 
-    @parameterized.expand([["dash"]])
-    async def test_static(self, abr: str):
+    @parameterized.expand(
+        [["dash", "scheduler"], ["dash", "scheduler:pipeline_depth=3"], ["dash", "scheduler:pipeline_depth=2,fanout=4"]]
+    )
+    async def test_static(self, abr: str, scheduler: str):
         save_file_patcher = patch("istream_player.modules.analyzer.analyzer.PlaybackAnalyzer.save_file")
         save_file_mock = save_file_patcher.start()
 
         composer = PlayerComposer()
         composer.register_core_modules()
 
-        async with composer.make_player(self.make_config(abr)) as player:
+        async with composer.make_player(self.make_config(abr, scheduler)) as player:
             await player.run()
 
         save_file_patcher.stop()
@@ -42,5 +64,77 @@ class StaticTest(unittest.IsolatedAsyncioTestCase):
         assert len(data["segments"]) == 4
 
 
+class FanoutTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_fanout"
+    num_segments = 30
+
+    def setUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+        shutil.copy("./tests/resources/static_2as_5repr_30seg.mpd", self.run_dir)
+        # Three packets per segment, so that the transfers take several steps
+        for repr_id in range(10):
+            with open(join(self.run_dir, f"init-stream{repr_id}.m4s"), "wb") as f:
+                f.write(bytes(1000))
+            for number in range(1, self.num_segments + 1):
+                with open(join(self.run_dir, f"chunk-stream{repr_id}-{number:05d}.m4s"), "wb") as f:
+                    f.write(bytes(50_000))
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    async def run_player(self, fanout: int) -> Tuple[Dict[str, List[float]], List[float]]:
+        config = PlayerConfig(
+            input=join(self.run_dir, "static_2as_5repr_30seg.mpd"),
+            run_dir=self.run_dir,
+            session_id="session",
+            mod_abr="dash",
+            mod_scheduler=f"scheduler:pipeline_depth=2,fanout={fanout}",
+            mod_analyzer=["data_collector"],
+            mod_downloader="local:bw=2000000",
+            time_factor=0.02,
+        )
+        config.static.max_initial_bitrate = 100_000
+        composer = PlayerComposer()
+        composer.register_core_modules()
+        recorder = TransferTimes()
+        # Start time of each group of segments enqueued to the buffer
+        enqueued: List[float] = []
+        async with composer.make_player(config) as player:
+            player.modules["downloader"]["segment_downloader"].add_listener(recorder)
+            buffer_manager = player.modules["buffer"]["buffer_manager"]
+            enqueue_buffer = buffer_manager.enqueue_buffer
+
+            async def record_enqueue(segments):
+                enqueued.append(max(segment.start_time for segment in segments.values()))
+                await enqueue_buffer(segments)
+
+            buffer_manager.enqueue_buffer = record_enqueue
+            await player.run()
+        return recorder.times, enqueued
+
+    def overlaps(self, times: Dict[str, List[float]]) -> List[bool]:
+        """For each index, whether the transfers of both adaptation sets overlapped"""
+        result = []
+        for number in range(1, self.num_segments + 1):
+            intervals = [t for url, t in times.items() if url.endswith(f"-{number:05d}.m4s")]
+            assert len(intervals) == 2, intervals
+            (start_0, end_0), (start_1, end_1) = intervals
+            result.append(start_0 < end_1 and start_1 < end_0)
+        return result
+
+    async def test_fanout_concurrent(self):
+        times, enqueued = await self.run_player(fanout=4)
+        assert all(self.overlaps(times))
+        # In index order, once each
+        assert len(enqueued) == self.num_segments and enqueued == sorted(set(enqueued))
+
+    async def test_fanout_bounded(self):
+        # One transfer at a time, the second adaptation set starts when the first one completes
+        times, enqueued = await self.run_player(fanout=1)
+        assert not any(self.overlaps(times))
+        assert len(enqueued) == self.num_segments and enqueued == sorted(set(enqueued))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -6,19 +6,21 @@ import unittest
 from unittest.mock import patch
 
 from aiohttp import web
+from parameterized import parameterized
 
 from istream_player.config.config import PlayerConfig
 from istream_player.core.module_composer import PlayerComposer
+from istream_player.modules.downloader.pooled import close_connection_pools
 
 
 # @unittest.skip("Cannot bind to port inside test")
 class StaticTest(unittest.IsolatedAsyncioTestCase):
-    def make_config(self):
+    def make_config(self, downloader: str):
         config = PlayerConfig(
             input="http://localhost:8080/resources/static_1as_5repr_4seg.mpd",
             run_dir="./runs/test",
             mod_abr='dash',
-            mod_downloader="tcp",
+            mod_downloader=downloader,
             mod_analyzer=["data_collector"],
             time_factor=0
         )
@@ -26,7 +28,15 @@ class StaticTest(unittest.IsolatedAsyncioTestCase):
         return config
 
     async def asyncSetUp(self):
-        app = web.Application()
+        # Client ports of the requests, one per connection
+        self.client_ports = []
+
+        @web.middleware
+        async def record_port(request, handler):
+            self.client_ports.append(request.transport.get_extra_info("peername")[1])
+            return await handler(request)
+
+        app = web.Application(middlewares=[record_port])
         app.router.add_static("/", pathlib.Path(__file__).parent, show_index=True)
 
         self.runner = web.AppRunner(app)
@@ -35,15 +45,17 @@ class StaticTest(unittest.IsolatedAsyncioTestCase):
         await site.start()
 
     async def asyncTearDown(self) -> None:
-        await self.runner.shutdown()
+        await close_connection_pools()
+        await self.runner.cleanup()
 
-    async def test_static_tcp(self):
+    @parameterized.expand([["tcp"], ["tcp_pool"], ["tcp_pool:discard_body=true"]])
+    async def test_static_tcp(self, downloader: str):
         save_file_patcher = patch("istream_player.modules.analyzer.analyzer.PlaybackAnalyzer.save_file")
         save_file_mock = save_file_patcher.start()
 
         composer = PlayerComposer()
         composer.register_core_modules()
-        async with composer.make_player(self.make_config()) as player:
+        async with composer.make_player(self.make_config(downloader)) as player:
             await player.run()
 
         save_file_patcher.stop()
@@ -52,6 +64,18 @@ class StaticTest(unittest.IsolatedAsyncioTestCase):
         # print(json.dumps(data, indent=4))
         assert len(data["segments"]) == 4
 
+    async def test_connections_reused(self):
+        composer = PlayerComposer()
+        composer.register_core_modules()
+        ports = []
+        for _ in range(2):
+            async with composer.make_player(self.make_config("tcp")) as player:
+                await player.run()
+            ports.append(set(self.client_ports))
+            self.client_ports.clear()
+        # The second session only uses the warm connections of the first one
+        assert ports[1] <= ports[0], ports
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import unittest
+from collections import Counter
+from os.path import join
+
+from istream_player.config.config import PlayerConfig
+from istream_player.core.downloader import DownloadEventListener
+from istream_player.core.module_composer import PlayerComposer
+from istream_player.modules.mpd.parser import (DefaultMPDParser,
+                                               StreamingMPDParser)
+
+
+class TransferRecorder(DownloadEventListener):
+    def __init__(self):
+        self.started = Counter()
+
+    async def on_transfer_start(self, url) -> None:
+        self.started[url] += 1
+
+
+class StreamingMPDTest(unittest.IsolatedAsyncioTestCase):
+    run_dir = "./runs/test_streaming_mpd"
+    mpd_path = "./tests/resources/static_2as_5repr_30seg.mpd"
+
+    def setUp(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+
+    def test_chunked_parse(self):
+        with open(self.mpd_path) as f:
+            content = f.read()
+        expected = DefaultMPDParser().parse(content, self.mpd_path)
+
+        parser = StreamingMPDParser()
+        parser.reset(self.mpd_path)
+        data = content.encode("utf-8")
+        parsed = []
+        for i in range(0, len(data), 100):
+            parsed += [adaptation_set.id for adaptation_set in parser.feed(data[i:i + 100])]
+        mpd = parser.close()
+
+        assert parsed == list(expected.adaptation_sets.keys())
+        assert mpd.content == content
+        for as_id, adaptation_set in expected.adaptation_sets.items():
+            for repr_id, representation in adaptation_set.representations.items():
+                segments = mpd.adaptation_sets[as_id].representations[repr_id].segments
+                assert [vars(s) for s in segments.values()] == [vars(s) for s in representation.segments.values()]
+
+    async def test_stream_parser_player(self):
+        config = PlayerConfig(
+            input="./tests/resources/static_1as_5repr_4seg.mpd",
+            run_dir=self.run_dir,
+            session_id="session",
+            mod_mpd="mpd:parser=stream",
+            mod_abr="dash",
+            mod_downloader="local",
+            time_factor=0,
+        )
+        config.static.max_initial_bitrate = 100_000
+        composer = PlayerComposer()
+        composer.register_core_modules()
+        recorder = TransferRecorder()
+        async with composer.make_player(config) as player:
+            for downloader in player.modules["downloader"].values():
+                downloader.add_listener(recorder)
+            await player.run()
+
+        with open(join(self.run_dir, "session.json")) as f:
+            assert len(json.load(f)["segments"]) == 4
+        # The prefetched initialization segment is not downloaded again by the scheduler
+        init_urls = [url for url in recorder.started if "init-stream" in url]
+        assert len(init_urls) > 0
+        assert all(recorder.started[url] == 1 for url in init_urls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import shutil
+from os.path import join
+from typing import List, Sequence, Tuple
+from unittest.mock import patch
+
+from istream_player.core.downloader import DownloadManager, DownloadRequest, DownloadType
+
+
+def make_segments(run_dir: str, count: int, size: int) -> List[str]:
+    """Empty run_dir and write count segment files of size bytes in it"""
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    paths = [join(run_dir, f"segment-{i}.m4s") for i in range(count)]
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(bytes(size))
+    return paths
+
+
+async def download_all(downloads: Sequence[Tuple[DownloadManager, str]], time_factor: float) -> List[float]:
+    """
+    Download the files in parallel, and return their completion times in trace seconds.
+    The downloaders are cleaned up afterwards.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def download(client: DownloadManager, path: str):
+        await client.download(DownloadRequest(path, DownloadType.SEGMENT))
+        content, size = await client.wait_complete(path)
+        assert size == os.path.getsize(path) and len(content) == size
+        return (loop.time() - start) / time_factor
+
+    try:
+        return await asyncio.gather(*[download(client, path) for client, path in downloads])
+    finally:
+        for client in {id(client): client for client, _ in downloads}.values():
+            await client.cleanup()
+
+
+class VirtualClock(object):
+    """
+    Runs the event loop on a virtual clock: when nothing is ready before the next timer, the clock jumps to it
+    instead of waiting. The throttled transfers then complete exactly at their scheduled times, whatever the load
+    of the machine. The chunk timestamps of the downloaders are read from the same clock.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.now = loop.time()
+        self._patches = []
+
+    def time(self) -> float:
+        return self.now
+
+    def now_ns(self) -> int:
+        return round(self.now * 1e9)
+
+    def _select(self, select):
+        def virtual_select(timeout=None):
+            if timeout is None:
+                return select(timeout)
+            events = select(0)
+            if not events and timeout > 0:
+                self.now += timeout
+            return events
+
+        return virtual_select
+
+    def __enter__(self) -> "VirtualClock":
+        selector = self.loop._selector  # type: ignore
+        self._patches = [
+            patch.object(self.loop, "time", self.time),
+            patch.object(selector, "select", self._select(selector.select)),
+            patch("istream_player.modules.downloader.local.now_ns", self.now_ns),
+            patch("istream_player.modules.downloader.emulated.now_ns", self.now_ns),
+            patch("istream_player.utils.timing.now_ns", self.now_ns),
+        ]
+        for p in self._patches:
+            p.start()
+        return self
+
+    def __exit__(self, *exc):
+        for p in reversed(self._patches):
+            p.stop()
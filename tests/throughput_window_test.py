@@ -0,0 +1,65 @@
+import random
+import unittest
+
+import numpy as np
+
+from istream_player.utils.throughput_window import ThroughputWindow
+
+
+def window_samples(samples, window, min_samples=2):
+    """Samples of the window, found by scanning all of them backwards"""
+    window_start = samples[-1][1] - window
+    values = []
+    for sample in samples[::-1]:
+        if sample[1] < window_start and len(values) >= min_samples:
+            break
+        values.append(sample)
+    return values
+
+
+class ThroughputWindowTest(unittest.TestCase):
+    def make_samples(self, n=2000):
+        rng = random.Random(1)
+        samples, t = [], 0.0
+        for _ in range(n):
+            start = t
+            t += rng.uniform(0.001, 0.05)
+            samples.append((start, t, rng.randint(1000, 20000)))
+        return samples
+
+    def check(self, estimator, expected, **kwargs):
+        samples = self.make_samples()
+        window = ThroughputWindow(0.5, estimator, **kwargs)
+        for i, sample in enumerate(samples):
+            window.add(*sample)
+            if i >= 1:
+                values = window_samples(samples[:i + 1], 0.5)
+                assert len(window) == len(values)
+                self.assertAlmostEqual(window.value / expected(values), 1, places=6)
+
+    def test_mean(self):
+        self.check("mean", lambda values: 8 * sum(b for _, _, b in values) / sum(e - s for s, e, _ in values))
+
+    def test_harmonic(self):
+        self.check("harmonic", lambda values: len(values) / sum((e - s) / (8 * b) for s, e, b in values))
+
+    def test_percentile(self):
+        def expected(values):
+            rates = sorted(8 * b / (e - s) for s, e, b in values)
+            return rates[min(len(rates) - 1, int(len(rates) * 0.9))]
+
+        self.check("percentile", expected, percentile=90)
+
+    def test_ewma(self):
+        window = ThroughputWindow(1, "ewma")
+        window.add(0, 1, 1000)
+        window.add(1, 2, 1000)
+        assert window.value == 8000
+        # After a long time at a new rate, the average follows it
+        for t in np.arange(2, 12, 0.5):
+            window.add(t, t + 0.5, 1000)
+        self.assertAlmostEqual(window.value, 16000, delta=10)
+
+
+if __name__ == "__main__":
+    unittest.main()
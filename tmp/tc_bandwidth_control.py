@@ -6,24 +6,35 @@ import sys
 import csv
 import time
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
 from datetime import datetime
 import argparse
 
+# the trace library reader of the switch, standard library only
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from switch_rate import read_library_trace  # noqa: E402
+
 control_file = Path(os.getenv("CONTROL_FILE", "./control/run.flag"))
 ready_file = Path("control/ready.flag")
 
 
 class BandwidthController:
-    def __init__(self, count: int, csv_files: List[str], static_bandwidth: float = None, target_bandwidth_csv: int = 0):
+    def __init__(self, count: int, csv_files: List[str], static_bandwidth: float = None, target_bandwidth_csv: int = 0,
+                 log_file: str = None, library: str = None, trace_ids: List[int] = None):
         self.count = count
         self.csv_files = csv_files
+        # traces of a library written by prepare_traces.py, used instead of the csv files
+        self.library = library
+        self.trace_ids = trace_ids or []
         self.static_bandwidth = static_bandwidth
         self.veth_interfaces = []
         self.container_names = []
         self.container_csv_map = {}
         self.csv_data = {}
         self.target_bandwidth_csv = target_bandwidth_csv
+        # interfaces which already have the tbf qdisc, later updates only change its rate
+        self.shaped = set()
+        self.log_file = log_file
     
     # check if csv file exists
     def validate_csv_files(self):
@@ -104,7 +115,11 @@ class BandwidthController:
             print("no containers found")
             sys.exit(1)
         
-        if not self.static_bandwidth: 
+        if self.library:
+            for i in range(num_containers):
+                self.container_csv_map[i] = self.trace_ids[i % len(self.trace_ids)]
+                print(f"container {i} ({self.container_names[i]}) -> trace {self.container_csv_map[i]} of {self.library}")
+        elif not self.static_bandwidth: 
             num_csv_files = len(self.csv_files)
             # assign each container a csv file 
             for i in range(num_containers):
@@ -123,6 +138,24 @@ class BandwidthController:
         except ValueError:
             return 0.0
     
+    # load the traces of the library, one rate per step
+    def load_library_data(self):
+        for i in range(len(self.veth_interfaces)):
+            rates, step = read_library_trace(self.library, self.container_csv_map[i])
+            if len(rates) == 0:
+                print(f"trace {self.container_csv_map[i]} of {self.library} is empty")
+                sys.exit(1)
+            # uniform steps, the time average is the mean
+            scale_factor = self.target_bandwidth_csv / (sum(rates) / len(rates)) if self.target_bandwidth_csv else 1
+            self.csv_data[i] = {
+                'timestamps': [j * step for j in range(len(rates))],
+                'bandwidths': [int(rate * scale_factor) for rate in rates],
+                'length': len(rates),
+                'period': len(rates) * step,
+                'current_index': 0,
+                'start': 0.0
+            }
+
     # load csv data
     def load_csv_data(self):
         
@@ -157,18 +190,18 @@ class BandwidthController:
                         continue
                 
                 #time based scaling
-                if self.target_bandwidth_csv > 0:
+                if self.target_bandwidth_csv and self.target_bandwidth_csv > 0:
                     if len(bandwidths) > 1:
-                        sum = 0.0
+                        weighted = 0.0
                         total_time = 0.0
                         
                         for j in range(len(timestamps) - 1):
                             diff = timestamps[j + 1] - timestamps[j]
-                            sum += bandwidths[j] * diff
+                            weighted += bandwidths[j] * diff
                             total_time += diff
                         
                         if total_time > 0:
-                            time_avg = sum / total_time
+                            time_avg = weighted / total_time
                             scale_factor = self.target_bandwidth_csv / time_avg
                         
                         else:
@@ -184,82 +217,112 @@ class BandwidthController:
                         timestamps = [0.0]
                         bandwidths = [self.target_bandwidth_csv]
             
+            # the last rate holds as long as the step before it, then the profile restarts
+            if len(timestamps) > 1:
+                period = 2 * timestamps[-1] - timestamps[-2]
+            else:
+                period = 1.0
             self.csv_data[i] = {
                 'timestamps': timestamps,
                 'bandwidths': bandwidths,
                 'length': len(timestamps),
-                'current_index': 0
+                'period': period,
+                'current_index': 0,
+                # start of the current loop of the profile, each interface has its own timeline
+                'start': 0.0
             }
             
-    # set bandwidth
-    def set_bandwidth(self, veth: str, bandwidth: int):
+    def tc_command(self, veth: str, bandwidth: int) -> str:
+        # the first update installs the qdisc, the next ones change its rate in place, so the link is never unshaped
+        action = 'change' if veth in self.shaped else 'replace'
+        return f"qdisc {action} dev {veth} root handle 1: tbf rate {bandwidth}kbit burst 32kbit latency 400ms"
+
+    # set the bandwidth of several interfaces with one tc process
+    def set_bandwidths(self, updates: List[Tuple[str, int]]) -> bool:
+        commands = "".join(self.tc_command(veth, bandwidth) + "\n" for veth, bandwidth in updates)
         try:
-            # delete old rule
-            del_proc = subprocess.run(
-                ['sudo', 'tc', 'qdisc', 'del', 'dev', veth, 'root'],
-                capture_output=True, text=True
+            proc = subprocess.run(
+                ['sudo', 'tc', '-force', '-batch', '-'],
+                input=commands, capture_output=True, text=True
             )
-            if del_proc.returncode not in (0, 2):  # 2 = "No such file or directory"
-                print(f"[WARN] Failed to delete qdisc on {veth}: {del_proc.stderr.strip()}")
+        except Exception as e:
+            print(f"[ERROR] tc batch failed: {e}")
+            proc = None
+        if proc is None or proc.returncode != 0:
+            if proc is not None:
+                print(f"[ERROR] tc batch failed: {proc.stderr.strip()}")
+            # install the qdisc again on the next update
+            self.shaped.difference_update(veth for veth, _ in updates)
+            return False
+        self.shaped.update(veth for veth, _ in updates)
+        return True
 
-            # apply new rule
-            add_proc = subprocess.run(
-                ['sudo', 'tc', 'qdisc', 'add', 'dev', veth, 'root', 'tbf',
-                 'rate', f'{bandwidth}kbit', 'burst', '32kbit', 'latency', '400ms'],
-                capture_output=True, text=True
-            )
+    # set bandwidth
+    def set_bandwidth(self, veth: str, bandwidth: int):
+        self.set_bandwidths([(veth, bandwidth)])
 
-            if add_proc.returncode != 0:
-                raise RuntimeError(
-                    f"tc add failed for {veth} ({bandwidth} kbit/s): {add_proc.stderr.strip()}"
-                )
+    def next_deadline(self, i: int) -> float:
+        data = self.csv_data[i]
+        return data['start'] + data['timestamps'][data['current_index']]
 
-        except Exception as e:
-            print(f"[ERROR] set_bandwidth failed for {veth}: {e}")
-        
     def run(self):
         # signal start of bandwidth control     
         ready_file.parent.mkdir(exist_ok=True)
         ready_file.write_text("1")
-        
-        start_time = time.time()
-        
-        while True:
-            current_time = time.time()
-            elapsed = current_time - start_time
-            
-            for i in range(len(self.veth_interfaces)):
-                veth = self.veth_interfaces[i]
-                data = self.csv_data[i]
-                
-                current_idx = data['current_index']
-                
-                if current_idx < data['length']:
-                    target_time = data['timestamps'][current_idx]
-                    
-                    # update bandwidth based
-                    if elapsed >= target_time:
-                        bandwidth = data['bandwidths'][current_idx]
-                        
-                        self.set_bandwidth(veth, bandwidth)
-                        
-                        print(f"[{elapsed:.2f}s] {self.container_names[i]} with {veth}: {bandwidth} kbit/s")
-                        
-                        data['current_index'] += 1
-                        
-                        # restart bandwidth profile if too short
-                        if data['current_index'] >= data['length']:
-                            print(f"container {i}: restart bandwidth profile")
-                            data['current_index'] = 0
-                            start_time = time.time()
-            time.sleep(0.1)
+
+        log = open(self.log_file, 'w', newline='') if self.log_file else None
+        writer = csv.writer(log) if log else None
+        if writer:
+            writer.writerow(['container', 'veth', 'bandwidth_kbit', 'scheduled_s', 'applied_s', 'lag_ms'])
+
+        start_time = time.monotonic()
+        for data in self.csv_data.values():
+            data['start'] = start_time
+
+        try:
+            while True:
+                # sleep until the next change of any interface
+                deadline = min(self.next_deadline(i) for i in self.csv_data)
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                now = time.monotonic()
+                due = []
+                for i in range(len(self.veth_interfaces)):
+                    data = self.csv_data[i]
+                    scheduled = self.next_deadline(i)
+                    if scheduled > now:
+                        continue
+                    due.append((i, scheduled, data['bandwidths'][data['current_index']]))
+
+                    data['current_index'] += 1
+                    # restart the bandwidth profile of this interface only
+                    if data['current_index'] >= data['length']:
+                        print(f"container {i}: restart bandwidth profile")
+                        data['current_index'] = 0
+                        data['start'] += data['period']
+
+                self.set_bandwidths([(self.veth_interfaces[i], bandwidth) for i, _, bandwidth in due])
+                applied = time.monotonic()
+                for i, scheduled, bandwidth in due:
+                    lag_ms = (applied - scheduled) * 1000
+                    print(f"[{applied - start_time:.3f}s] {self.container_names[i]} with {self.veth_interfaces[i]}: "
+                          f"{bandwidth} kbit/s (lag {lag_ms:.1f} ms)")
+                    if writer:
+                        writer.writerow([self.container_names[i], self.veth_interfaces[i], bandwidth,
+                                         f"{scheduled - start_time:.6f}", f"{applied - start_time:.6f}", f"{lag_ms:.3f}"])
+                if log:
+                    log.flush()
+        finally:
+            if log:
+                log.close()
 
     def run_static(self, bandwidth: int):
         # signal start of bandwidth control     
         ready_file.parent.mkdir(exist_ok=True)
         ready_file.write_text("1")
-        veth = self.veth_interfaces[0]
-        self.set_bandwidth(veth, bandwidth)
+        self.set_bandwidths([(veth, bandwidth) for veth in self.veth_interfaces])
 
 def main():
     parser = argparse.ArgumentParser(description='tc bandwidth control script')
@@ -267,6 +330,9 @@ def main():
     parser.add_argument('--csv-files', nargs='+', help='csv files for bandwidth control')
     parser.add_argument('--bandwidth', type=int, help='static bandwidth in kbit/s')
     parser.add_argument('--target-bandwidth-csv', type=int, help='average bandwidth to which csv profiles are scaled')
+    parser.add_argument('--log-file', help='csv file recording when each bandwidth change was applied')
+    parser.add_argument('--library', help='trace library (.npz) written by prepare_traces.py, instead of csv files')
+    parser.add_argument('--traces', type=int, nargs='+', default=[0], help='indices of the library traces')
     
     args = parser.parse_args()
     
@@ -280,11 +346,19 @@ def main():
         controller = BandwidthController(count, [], static_bandwidth=args.bandwidth)
         controller.collect_veth_interfaces()
         controller.run_static(args.bandwidth)
+    elif args.library:
+        print(f"trace library: {args.library}, traces {args.traces}")
+        controller = BandwidthController(count, [], target_bandwidth_csv=args.target_bandwidth_csv,
+                                         log_file=args.log_file, library=args.library, trace_ids=args.traces)
+        controller.collect_veth_interfaces()
+        controller.load_library_data()
+        controller.run()
     else:
         # csv bandwidth
         csv_files = args.csv_files
         print("csv files:\n" + "\n".join(f"  - {f}" for f in csv_files))
-        controller = BandwidthController(count, csv_files, target_bandwidth_csv=args.target_bandwidth_csv)
+        controller = BandwidthController(count, csv_files, target_bandwidth_csv=args.target_bandwidth_csv,
+                                         log_file=args.log_file)
         controller.validate_csv_files()
         controller.collect_veth_interfaces()
         controller.load_csv_data()
@@ -6,12 +6,16 @@ from pathlib import Path
 from typing import Dict, Any
 from istream_player.config.config import PlayerConfig
 from istream_player.core.module_composer import PlayerComposer
-from istream_player.main import load_from_dict, load_from_config_file
+from istream_player.main import load_from_dict
+from istream_player.modules.downloader.pooled import close_connection_pools
 import asyncio
 import logging
+import multiprocessing
 import random
 import time
 import json
+from dataclasses import dataclass, field
+from typing import List, Optional
 
 
 container_id = os.environ.get("ID", "")
@@ -21,15 +25,52 @@ control_file = Path(os.getenv("CONTROL_FILE", "/app/control/run.flag"))
 ready_file = Path("control/ready.flag")
 node_id = os.environ.get("NODE_ID", "")
 config_path = os.environ.get("ISTREAM_CONFIG", ".ressources/online.yaml")
+# Number of clients hosted by the container, their first ID and the number of worker processes running them
+n_clients = int(os.environ.get("CLIENTS", "1"))
+client_offset = os.environ.get("CLIENT_OFFSET") or container_id
+n_workers = int(os.environ.get("WORKERS", "1"))
+# Source addresses assigned to the clients in turn
+local_addrs = [addr.strip() for addr in os.environ.get("ISTREAM_LOCAL_ADDRS", "").split(",") if addr.strip()]
+
+
+@dataclass
+class Client:
+    """State of one emulated client. A container hosts one or more of them."""
+
+    client_id: str
+    local_addr: Optional[str] = None
+    # Arrival of the client after the start of the experiment, scheduled by the orchestrator
+    start_delay: float = 0.0
+    node_logged: bool = False
+    rng: random.Random = field(init=False)
+
+    def __post_init__(self):
+        # Same draws as a container running this client alone
+        self.rng = random.Random(f"{self.client_id}{node_id}")
+
+
+def make_clients() -> List[Client]:
+    if n_clients == 1:
+        ids = [client_offset]
+    else:
+        # Each client keeps its own network identity
+        if len(local_addrs) < n_clients:
+            raise ValueError(f"{n_clients} clients need as many source addresses in ISTREAM_LOCAL_ADDRS, got {local_addrs}")
+        ids = [str(int(client_offset or 0) + i) for i in range(n_clients)]
+    return [Client(client_id, local_addrs[i % len(local_addrs)] if local_addrs else None) for i, client_id in enumerate(ids)]
 
 
 class Wrapper:
     def __init__(self):
         self.config_dir = Path(__file__).parent / "resources"
-        self.node_logged = False
         self.exp_cfg = yaml.safe_load(open(os.environ["EXPERIMENT_CONFIG"]))
         self.sequences = self.exp_cfg["sequences"]
-        random.seed(f"{container_id}{node_id}")
+        # Kept for the whole process: the sessions of all its clients share the event loop, module registry,
+        # connection pools, TLS contexts and parsed MPDs
+        self.composer = PlayerComposer()
+        self.composer.register_core_modules()
+        self.raw_configs: Dict[str, str] = {}
+        self.logging_configured = False
 
     def load_env_overrides(self) -> Dict[str, Any]:
         """Load configuration overrides from environment variables"""
@@ -39,6 +80,7 @@ class Wrapper:
             "ISTREAM_INPUT": "input",
             "ISTREAM_RUN_DIR": "run_dir",
             "ISTREAM_TIME_FACTOR": "time_factor",
+            "ISTREAM_MPD": "mod_mpd",
             "ISTREAM_DOWNLOADER": "mod_downloader",
             "ISTREAM_BW": "mod_bw",
             "ISTREAM_ABR": "mod_abr",
@@ -76,32 +118,30 @@ class Wrapper:
 
         return env_config
 
-    def generate_sleep_time(self) -> float:
+    def generate_sleep_time(self, client: Client) -> float:
         """Draw random value for sleep time duration between sessions"""
-        return random.expovariate(float(lamda))
-
-    def run_with_config_file(self, config_file: str, overrides: Dict[str, Any] = None):
-        composer = PlayerComposer()
-        composer.register_core_modules()
-        config = PlayerConfig()
+        return client.rng.expovariate(float(lamda))
 
-        sequence = random.choice(self.sequences)
+    def resolve_config(self, config_file: str, sequence: str) -> PlayerConfig:
+        """Build the session configuration in memory from the config file template and the sequence"""
+        if config_file not in self.raw_configs:
+            self.raw_configs[config_file] = Path(config_file).read_text()
+        raw = self.raw_configs[config_file].replace("${SEQUENCE}", sequence)
+        return load_from_dict(yaml.safe_load(raw), PlayerConfig())
 
-        raw = Path(config_file).read_text()
-        raw = raw.replace("${SEQUENCE}", sequence)
-
-        tmp_cfg = "/tmp/resolved_config.yaml"
-        Path(tmp_cfg).write_text(raw)
-
-        load_from_config_file(tmp_cfg, config)
+    async def run_with_config_file(self, client: Client, config_file: str, overrides: Dict[str, Any] = None):
+        sequence = client.rng.choice(self.sequences)
+        config = self.resolve_config(config_file, sequence)
         env_overrides = self.load_env_overrides()
 
-        if container_id and container_exp:
+        if client.client_id and container_exp:
             base_run_dir = env_overrides.get("run_dir", getattr(config, "run_dir", "./logs"))
-            env_overrides["run_dir"] = os.path.join(base_run_dir, container_exp, container_id)
+            env_overrides["run_dir"] = os.path.join(base_run_dir, container_exp, client.client_id)
+        if client.local_addr is not None:
+            env_overrides["local_addr"] = client.local_addr
 
         # compute sleep time
-        sleep_time = self.generate_sleep_time()
+        sleep_time = self.generate_sleep_time(client)
 
         if env_overrides:
             load_from_dict(env_overrides, config)
@@ -109,30 +149,50 @@ class Wrapper:
             load_from_dict(overrides, config)
 
         config.validate()
-        verbose = getattr(config, "verbose", False)
-        logging.basicConfig(
-            level=logging.DEBUG if verbose else logging.INFO,
-            format="%(asctime)s %(name)20s %(levelname)8s:\t%(message)s",
-        )
-
-        # wait for readiness flag
-        while True:
-            if ready_file.exists() and ready_file.read_text().strip() == "1":
-                break
-            time.sleep(0.1)
+        if not self.logging_configured:
+            verbose = getattr(config, "verbose", False)
+            logging.basicConfig(
+                level=logging.DEBUG if verbose else logging.INFO,
+                format="%(asctime)s %(name)20s %(levelname)8s:\t%(message)s",
+            )
+            self.logging_configured = True
 
         # log metadata
-        if not self.node_logged and node_id:
+        if not client.node_logged and node_id:
             log_session(env_overrides["run_dir"], node_id=node_id)
-            self.node_logged = True
-        log_session(env_overrides["run_dir"], time.time(), sleep_time)
+            client.node_logged = True
+        session_num = log_session(env_overrides["run_dir"], time.time(), sleep_time, sequence=sequence)
+        # Name the report after the session, so it can be matched with its sequence in info.json
+        config.session_id = f"data-{session_num}"
+
+        await asyncio.sleep(sleep_time)
+        await self.composer.run(config)
 
-        time.sleep(sleep_time)
-        asyncio.run(composer.run(config))
+    async def run_client(self, client: Client, config_file: str):
+        """Run the sessions of a client one after another until the control flag is cleared"""
+        await asyncio.sleep(client.start_delay)
+        while True:
+            if not control_file.exists() or control_file.read_text().strip() != "1":
+                print(f"stop client loop {client.client_id}")
+                break
+            await self.run_with_config_file(client, config_file)
+
+    async def run_sessions(self, config_file: str, clients: List[Client], wait_ready: bool = True):
+        """Run the clients concurrently in the same event loop"""
+        # wait for readiness flag
+        while wait_ready:
+            if ready_file.exists() and ready_file.read_text().strip() == "1":
+                break
+            await asyncio.sleep(0.1)
+        try:
+            await asyncio.gather(*[self.run_client(client, config_file) for client in clients])
+        finally:
+            await close_connection_pools()
 
 
 def log_session(path: str, timestamp: float = None, sleep_duration: float = None,
-                node_id: str = None):
+                node_id: str = None, sequence: str = None) -> int:
+    """Record the node or a new session in info.json and return the number of sessions"""
     filepath = os.path.join(path, "info.json")
     os.makedirs(path, exist_ok=True)
 
@@ -145,21 +205,57 @@ def log_session(path: str, timestamp: float = None, sleep_duration: float = None
     if node_id and "node_id" not in data:
         data["node_id"] = node_id
     elif timestamp is not None and sleep_duration is not None:
-        entry = {"timestamp": timestamp, "sleep_duration": sleep_duration}
-        data.setdefault("sessions", []).append(entry)
+        sessions = data.setdefault("sessions", [])
+        entry = {"timestamp": timestamp, "sleep_duration": sleep_duration, "sequence": sequence,
+                 "session_id": f"data-{len(sessions) + 1}"}
+        sessions.append(entry)
 
     with open(filepath, "w") as f:
         json.dump(data, f)
+    return len(data.get("sessions", []))
 
 
-def main():
+def run_worker(clients: List[Client], start_barrier=None, started=None, cpu: Optional[int] = None):
+    """
+    Run the sessions of the clients in one event loop.
+
+    Parameters
+    ----------
+    clients:
+        Shard of clients hosted by the worker
+    start_barrier: multiprocessing.Barrier, optional
+        Released by the orchestrator once all its workers are up. Replaces the readiness flag.
+    started: multiprocessing.Queue, optional
+        Receives (cpu, pid, time) when the worker passes the barrier, to measure the start skew
+    cpu: int, optional
+        Core to pin the worker to
+    """
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
     wrapper = Wrapper()
+    if start_barrier is not None:
+        start_barrier.wait()
+        if started is not None:
+            started.put((cpu, os.getpid(), time.time()))
     # Loop for running multiple streaming sessions in one experiment
-    while True:
-        if not control_file.exists() or control_file.read_text().strip() != "1":
-            print("stop container loop")
-            break
-        wrapper.run_with_config_file(config_path)
+    asyncio.run(wrapper.run_sessions(config_path, clients, wait_ready=start_barrier is None))
+
+
+def main():
+    clients = make_clients()
+    if n_workers <= 1:
+        run_worker(clients)
+        return
+    # Split the clients between worker processes, each running its share in one event loop
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(clients[i::n_workers],))
+        for i in range(min(n_workers, len(clients)))
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    print("stop container loop")
 
 
 if __name__ == "__main__":